@@ -3,16 +3,20 @@ import pysb.core
 from pysb.generator.bng import BngGenerator
 import os
 import subprocess
-import re
 import itertools
 import sympy
 import numpy
 import tempfile
-from pkg_resources import parse_version
 import abc
 from warnings import warn
 import shutil
 import collections
+import hashlib
+import contextlib
+import array
+import threading
+import time
+from pysb.util import get_cache_dir, read_trajectories
 
 try:
     from cStringIO import StringIO
@@ -31,10 +35,14 @@ except NameError:
 
 # Cached value of BNG path
 _bng_path = None
+# Cached value of BNG version
+_bng_version = None
 
 def set_bng_path(dir):
     global _bng_path
+    global _bng_version
     _bng_path = os.path.join(dir,'BNG2.pl')
+    _bng_version = None
     # Make sure file exists and that it is not a directory
     if not os.access(_bng_path, os.F_OK) or not os.path.isfile(_bng_path):
         raise Exception('Could not find BNG2.pl in ' + os.path.abspath(dir) + '.')
@@ -98,6 +106,47 @@ def _get_bng_path():
     return script_path
 
 
+def _get_bng_version():
+    """
+    Return the version string of the BioNetGen distribution in use.
+
+    The version is read from the VERSION file of the BNG distribution,
+    so it does not require starting BNG itself. If that file is missing, the
+    path and modification time of BNG2.pl are used instead, which is
+    sufficient to distinguish installations for caching purposes.
+    """
+    global _bng_version
+
+    # Just return cached value if it's available
+    if _bng_version:
+        return _bng_version
+
+    bng_path = _get_bng_path()
+    bng_dir = os.path.dirname(bng_path)
+    # Check the BNG2.pl directory and its parent (for old Perl2 layouts)
+    for version_dir in (bng_dir, os.path.dirname(bng_dir)):
+        version_filename = os.path.join(version_dir, 'VERSION')
+        if os.path.isfile(version_filename):
+            with open(version_filename, 'r') as version_file:
+                _bng_version = version_file.read().strip()
+            break
+    else:
+        _bng_version = '%s@%f' % (bng_path, os.path.getmtime(bng_path))
+    return _bng_version
+
+
+def _network_cache_filename(bng_content):
+    """
+    Return the network cache filename for a given BNGL model definition.
+
+    The filename is derived from a hash of the BNGL content and the BNG
+    version, since either may affect the generated network.
+    """
+    key = '%s\n%s' % (_get_bng_version(), bng_content)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(get_cache_dir('networks'), digest + '.net')
+
+
 class BngInterfaceError(RuntimeError):
     """BNG reported an error"""
     pass
@@ -240,26 +289,29 @@ class BngBaseInterface(object):
         array
         """
         # Read concentrations data
-        cdat_arr = numpy.loadtxt(self.base_filename + '.cdat', skiprows=1)
-        # Read groups data
-        if self.model and len(self.model.observables):
-            # Exclude first column (time)
-            gdat_arr = numpy.loadtxt(self.base_filename + '.gdat',
-                                     skiprows=1)[:,1:]
-        else:
-            gdat_arr = numpy.ndarray((len(cdat_arr), 0))
-
+        cdat_arr = read_trajectories(self.base_filename + '.cdat')
         # -1 for time column
-        names = ['time'] + ['__s%d' % i for i in range(cdat_arr.shape[1]-1)]
+        n_species = len(cdat_arr.dtype) - 1
+        names = ['time'] + ['__s%d' % i for i in range(n_species)]
+        cdat_arr.dtype.names = names
+        if not (self.model and len(self.model.observables)):
+            return cdat_arr
+
         yfull_dtype = list(zip(names, itertools.repeat(float)))
-        if self.model and len(self.model.observables):
-            yfull_dtype += list(zip(self.model.observables.keys(),
-                                    itertools.repeat(float)))
+        yfull_dtype += list(zip(self.model.observables.keys(),
+                                itertools.repeat(float)))
         yfull = numpy.ndarray(len(cdat_arr), yfull_dtype)
-
         yfull_view = yfull.view(float).reshape(len(yfull), -1)
-        yfull_view[:, :len(names)] = cdat_arr
-        yfull_view[:, len(names):] = gdat_arr
+        yfull_view[:, :len(names)] = cdat_arr.view(float).reshape(
+            len(cdat_arr), -1)
+        del cdat_arr
+
+        # Read groups data straight into the result, excluding the first
+        # column (time)
+        def store_groups(start, chunk):
+            yfull_view[start:start + len(chunk), len(names):] = \
+                chunk.view(float).reshape(len(chunk), -1)[:, 1:]
+        read_trajectories(self.base_filename + '.gdat', callback=store_groups)
 
         return yfull
 
@@ -280,6 +332,9 @@ class BngConsole(BngBaseInterface):
                               "It is not currently available on Windows.")
 
         self.suppress_warnings = suppress_warnings
+        # Parameter values as currently set in the console
+        self._parameter_values = {}
+        self._network_generated = False
 
         try:
             # Generate BNGL file
@@ -295,6 +350,8 @@ class BngConsole(BngBaseInterface):
             if self.model:
                 self.console.sendline('load %s' % self.bng_filename)
                 self._console_wait()
+                self._parameter_values = dict((p.name, p.value) for p in
+                                              self.model.parameters)
         except Exception as e:
             raise BngInterfaceError(e)
 
@@ -303,12 +360,41 @@ class BngConsole(BngBaseInterface):
         In console mode, commands have already been executed, so we simply
         close down the console and erase the temporary directory if applicable.
         """
-        self.console.sendline('done')
-        self.console.close()
+        self.close()
+
+    def close(self):
+        """Shut down the BNG console and erase the temporary directory if
+        applicable"""
+        if self.console.isalive():
+            try:
+                self.console.sendline('done')
+            except OSError:
+                pass
+        self.console.close(force=True)
         if self.cleanup:
             self._delete_tmpdir()
 
-    def _console_wait(self):
+    def is_alive(self, timeout=5):
+        """
+        Check that the BNG console is running and responding to input
+
+        Parameters
+        ----------
+        timeout : number, optional
+            Time in seconds to wait for a response
+        """
+        import pexpect
+        if not self.console.isalive():
+            return False
+        try:
+            # Any input gives a new prompt
+            self.console.sendline('')
+            self.console.expect('BNG>', timeout=timeout)
+        except (pexpect.TIMEOUT, pexpect.EOF, OSError):
+            return False
+        return True
+
+    def _console_wait(self, suppress_warnings=False):
         """
         Wait for BNG console to process the command, and return the output
         :return: BNG console output from the previous command
@@ -318,7 +404,8 @@ class BngConsole(BngBaseInterface):
         console_msg = self.console.before.decode('utf-8')
         if "ERROR:" in console_msg:
             raise BngInterfaceError(console_msg)
-        elif not self.suppress_warnings and "WARNING:" in console_msg:
+        elif not (self.suppress_warnings or suppress_warnings) and \
+                "WARNING:" in console_msg:
             warn(console_msg)
         elif self.verbose:
             print(console_msg)
@@ -356,11 +443,45 @@ class BngConsole(BngBaseInterface):
         # Process BNG arguments into a string
         action_args = self._format_action_args(**kwargs)
 
-        # Execute the command via the console
-        self.console.sendline('action %s({%s})' % (action, action_args))
+        # Execute the command via the console. Actions without arguments
+        # are called with an empty argument list, since some (e.g.
+        # resetConcentrations) treat a hash argument as a label.
+        if action_args:
+            self.console.sendline('action %s({%s})' % (action, action_args))
+        else:
+            self.console.sendline('action %s()' % action)
 
         # Wait for the command to execute and return the result
-        return self._console_wait()
+        console_msg = self._console_wait()
+        if action == 'generate_network':
+            self._network_generated = True
+        return console_msg
+
+    def set_parameter(self, name, value):
+        """
+        Sets the value of a parameter in the BNG console
+
+        Parameters
+        ----------
+        name : string
+            The parameter name
+        value : number
+            The new value
+        """
+        self.console.sendline('action setParameter("%s",%s)' %
+                              (name, repr(float(value))))
+        # BNG always warns that the parameter was previously defined
+        self._console_wait(suppress_warnings=True)
+        self._parameter_values[name] = value
+
+    def update_parameters(self):
+        """
+        Sets any parameters whose values in the model differ from those in
+        the BNG console
+        """
+        for p in self.model.parameters:
+            if self._parameter_values.get(p.name) != p.value:
+                self.set_parameter(p.name, p.value)
 
     def load_bngl(self, bngl_file):
         """
@@ -376,6 +497,194 @@ class BngConsole(BngBaseInterface):
         self._base_file_stem = os.path.splitext(os.path.basename(bngl_file))[0]
 
 
+class BngConsolePool(object):
+    """
+    Pool of running BNG consoles which can be reused for repeated actions
+
+    Starting BNG and loading a model's BNGL takes much longer than most
+    individual actions. The pool keeps consoles running with a model loaded
+    and hands them out for reuse, so repeated actions on a model (e.g.
+    simulations with different parameter values) skip that overhead.
+
+    When a console is checked out, any parameters whose values have changed
+    in the model since they were last sent to the console are updated with
+    setParameter. When it is returned, its concentrations are reset with
+    resetConcentrations. Consoles are only reused for the same model object,
+    and only while the model is not structurally modified (see
+    :py:attr:`pysb.core.Model.revision`).
+
+    Parameters
+    ----------
+    max_consoles : int, optional
+        Maximum number of consoles running at once (default 1). Idle consoles
+        for other models are shut down to make room if necessary.
+    timeout : number, optional
+        Timeout in seconds for each console command (default 30).
+    checkout_timeout : number or None, optional
+        Time in seconds to wait for a console to become available before
+        raising BngInterfaceError. None (default) means wait indefinitely.
+    health_check_timeout : number, optional
+        Time in seconds an idle console has to respond to input when checked
+        out (default 5). Consoles which fail the check are replaced.
+    verbose : bool, optional
+        If True, print BNG console output.
+    suppress_warnings : bool, optional
+        If True, don't issue Python warnings for BNG warnings.
+
+    Examples
+    --------
+    Run a parameter scan with a single BNG process::
+
+        with BngConsolePool() as pool:
+            for k_value in k_values:
+                model.parameters['k'].value = k_value
+                yfull = run_ssa(model, t_end=100, pool=pool)
+    """
+    def __init__(self, max_consoles=1, timeout=30, checkout_timeout=None,
+                 health_check_timeout=5, verbose=False,
+                 suppress_warnings=False):
+        if max_consoles < 1:
+            raise ValueError("max_consoles must be at least 1")
+        self.max_consoles = max_consoles
+        self.timeout = timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_timeout = health_check_timeout
+        self.verbose = verbose
+        self.suppress_warnings = suppress_warnings
+        self._condition = threading.Condition()
+        # Idle consoles, least recently used first
+        self._idle = []
+        self._n_consoles = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextlib.contextmanager
+    def console(self, model):
+        """
+        Check out a console with the model loaded, for use in a with block
+
+        The console is returned to the pool at the end of the block, unless
+        an exception is raised, in which case it is shut down.
+
+        Parameters
+        ----------
+        model : pysb.Model
+            The model to load in the console.
+        """
+        bng = self._checkout(model)
+        try:
+            yield bng
+        except BaseException:
+            self._discard(bng)
+            raise
+        self._checkin(bng)
+
+    def _checkout(self, model):
+        while True:
+            bng, stale = self._reserve(model)
+            for console in stale:
+                console.close()
+            if bng is None:
+                # A slot was reserved for a new console
+                try:
+                    bng = BngConsole(model, verbose=self.verbose,
+                                     timeout=self.timeout,
+                                     suppress_warnings=self.suppress_warnings)
+                except BaseException:
+                    self._release_slot()
+                    raise
+                # The BNGL generator may add synthesis/degradation components
+                bng._model_revision = model.revision
+                return bng
+            if bng.is_alive(self.health_check_timeout):
+                try:
+                    bng.update_parameters()
+                except BaseException:
+                    self._discard(bng)
+                    raise
+                return bng
+            self._discard(bng)
+
+    def _reserve(self, model):
+        """
+        Take an idle console for the model, or reserve a slot for a new one
+
+        Returns the console (or None if a slot was reserved) and a list of
+        idle consoles which should be shut down.
+        """
+        deadline = None
+        if self.checkout_timeout is not None:
+            deadline = time.time() + self.checkout_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise BngInterfaceError("The console pool is closed")
+                stale = [c for c in self._idle if c.model is model and
+                         c._model_revision != model.revision]
+                self._idle = [c for c in self._idle if c not in stale]
+                self._n_consoles -= len(stale)
+                for i, c in enumerate(self._idle):
+                    if c.model is model:
+                        return self._idle.pop(i), stale
+                if self._n_consoles < self.max_consoles:
+                    self._n_consoles += 1
+                    return None, stale
+                if self._idle:
+                    # Make room by shutting down the least recently used
+                    # console
+                    stale.append(self._idle.pop(0))
+                    return None, stale
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise BngInterfaceError(
+                            "Timed out waiting for a BNG console")
+                self._condition.wait(remaining)
+
+    def _release_slot(self):
+        with self._condition:
+            self._n_consoles -= 1
+            self._condition.notify()
+
+    def _checkin(self, bng):
+        try:
+            if bng._network_generated:
+                bng.action('resetConcentrations')
+        except BaseException:
+            self._discard(bng)
+            raise
+        with self._condition:
+            if not self._closed:
+                self._idle.append(bng)
+                self._condition.notify()
+                return
+        bng.close()
+        self._release_slot()
+
+    def _discard(self, bng):
+        try:
+            bng.close()
+        finally:
+            self._release_slot()
+
+    def close(self):
+        """Shut down all idle consoles; consoles in use are shut down when
+        they are returned"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._n_consoles -= len(idle)
+            self._condition.notify_all()
+        for bng in idle:
+            bng.close()
+
+
 class BngFileInterface(BngBaseInterface):
     def __init__(self, model=None, verbose=False, output_dir=None,
                  output_prefix=None, cleanup=True):
@@ -466,7 +775,7 @@ class BngFileInterface(BngBaseInterface):
 
 def run_ssa(model, t_end=10, n_steps=100, param_values=None, output_dir=None,
             output_file_basename=None, cleanup=True, verbose=False,
-            **additional_args):
+            pool=None, **additional_args):
     """
     Simulate a model with BNG's SSA simulator and return the trajectories.
 
@@ -496,6 +805,11 @@ def run_ssa(model, t_end=10, n_steps=100, param_values=None, output_dir=None,
         finished. If False, leave them in place. Useful for debugging.
     verbose: bool, optional
         If True, print BNG screen output.
+    pool : BngConsolePool, optional
+        Run the simulation in a console from this pool rather than starting
+        a new BNG process. The network is only generated the first time a
+        console is used for the model. `output_dir`,
+        `output_file_basename` and `cleanup` are ignored.
     additional_args: kwargs, optional
         Additional arguments to pass to BioNetGen
 
@@ -511,6 +825,14 @@ def run_ssa(model, t_end=10, n_steps=100, param_values=None, output_dir=None,
         for i in range(len(param_values)):
             model.parameters[i].value = param_values[i]
 
+    if pool is not None:
+        with pool.console(model) as bng:
+            if not bng._network_generated:
+                bng.action('generate_network', overwrite=True,
+                           verbose=verbose)
+            bng.action('simulate', **additional_args)
+            return _read_ssa_results(model, bng)
+
     with BngFileInterface(model, verbose=verbose, output_dir=output_dir,
                           output_prefix=output_file_basename,
                           cleanup=cleanup) as bngfile:
@@ -519,18 +841,23 @@ def run_ssa(model, t_end=10, n_steps=100, param_values=None, output_dir=None,
 
         bngfile.execute()
 
-        output = bngfile.read_netfile()
+        return _read_ssa_results(model, bngfile)
 
-        # Parse netfile (in case this hasn't already been done)
-        if not model.species:
-            _parse_netfile(model, iter(output.split('\n')))
 
-        yfull = bngfile.read_simulation_results()
+def _read_ssa_results(model, bng):
+    """Read the results of run_ssa from a BNG interface's output files"""
+    # Parse netfile (in case this hasn't already been done)
+    if not model.species or model.equations_outdated():
+        model.reset_equations()
+        with open(bng.net_filename, 'r') as net_file:
+            _parse_netfile(model, net_file)
+        model._equations_revision = model.revision
 
-    return yfull
+    return bng.read_simulation_results()
 
 
-def generate_network(model, cleanup=True, append_stdout=False, verbose=False):
+def generate_network(model, cleanup=True, append_stdout=False,
+                     verbose=False, use_cache=True, pool=None):
     """
     Return the output from BNG's generate_network function given a model.
 
@@ -538,6 +865,11 @@ def generate_network(model, cleanup=True, append_stdout=False, verbose=False):
     and 'groups', and the 'species' section expanded to contain all possible
     species. BNG refers to this as a 'net' file.
 
+    Generated networks are cached on disk (in the ``networks`` subdirectory
+    of :func:`pysb.util.get_cache_dir`), keyed by the BNGL content of the
+    model and the BNG version, so network generation for a model that has
+    been seen before skips running BNG entirely.
+
     Parameters
     ----------
     model : Model
@@ -551,17 +883,73 @@ def generate_network(model, cleanup=True, append_stdout=False, verbose=False):
         compatibility reasons.
     verbose : bool, optional
         If True, print output from BNG to stdout.
+    use_cache : bool, optional
+        If True (default), look up the network in the on-disk cache before
+        running BNG, and store newly generated networks there.
+    pool : BngConsolePool, optional
+        Generate the network in a console from this pool rather than
+        starting a new BNG process.
     """
-    with BngFileInterface(model, verbose=verbose, cleanup=cleanup) as bngfile:
-        bngfile.action('generate_network', overwrite=True, verbose=verbose)
-        bngfile.execute()
-
-        output = bngfile.read_netfile()
+    with _network_file(model, cleanup=cleanup, verbose=verbose,
+                       use_cache=use_cache, pool=pool) as net_file:
+        return net_file.read()
 
-    return output
 
+@contextlib.contextmanager
+def _network_file(model, cleanup=True, verbose=False, use_cache=True,
+                  pool=None):
+    """
+    Context manager giving an open BNG net file for a model.
 
-def generate_equations(model, cleanup=True, verbose=False):
+    The network is read from the cache if possible, otherwise BNG is run to
+    generate it (see :func:`generate_network`).
+    """
+    with BngFileInterface(model, verbose=verbose, cleanup=cleanup) as bngfile:
+        cache_filename = None
+        if use_cache:
+            cache_filename = _network_cache_filename(
+                bngfile.generator.get_content())
+            if os.path.exists(cache_filename):
+                if verbose:
+                    print("Using cached network %s" % cache_filename)
+                with open(cache_filename, 'r') as net_file:
+                    yield net_file
+                return
+
+        if pool is not None:
+            with pool.console(model) as bng:
+                bng.action('generate_network', overwrite=True,
+                           verbose=verbose)
+                shutil.copyfile(bng.net_filename, bngfile.net_filename)
+        else:
+            bngfile.action('generate_network', overwrite=True,
+                           verbose=verbose)
+            bngfile.execute()
+
+        net_filename = bngfile.net_filename
+        if cache_filename is not None:
+            # Copy to a temporary file in the cache directory and rename it
+            # into place (atomically, as it's on the same filesystem), so
+            # concurrent processes never read a partially written network
+            tmp_filename = None
+            try:
+                fd, tmp_filename = tempfile.mkstemp(
+                    suffix='.tmp', dir=os.path.dirname(cache_filename))
+                os.close(fd)
+                shutil.copyfile(net_filename, tmp_filename)
+                os.rename(tmp_filename, cache_filename)
+                net_filename = cache_filename
+            except (IOError, OSError) as e:
+                warn("Could not write network cache file %s: %s" %
+                     (cache_filename, e))
+                if tmp_filename is not None and os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+
+        with open(net_filename, 'r') as net_file:
+            yield net_file
+
+
+def generate_equations(model, cleanup=True, verbose=False, pool=None):
     """
     Generate math expressions for reaction rates and species in a model.
 
@@ -573,50 +961,57 @@ def generate_equations(model, cleanup=True, verbose=False):
     * reactions_bidirectional
     * observables (just `coefficients` and `species` fields for each element)
 
+    The net file is parsed as it is read from disk, and the reactions are
+    stored as integer arrays; the sympy expressions for `odes`, `reactions`
+    and `reactions_bidirectional` are only built when one of those fields is
+    first accessed.
+
+    The equations are only regenerated if the model has been structurally
+    modified since they were last generated (see `Model.revision`). Changes
+    to parameter values alone never trigger regeneration, since parameters
+    appear symbolically in the equations.
+
+    If a :py:class:`BngConsolePool` is given as `pool`, BNG is run in a
+    console from the pool rather than as a new process.
+
     """
-    # only need to do this once
-    # TODO track "dirty" state, i.e. "has model been modified?"
-    #   or, use a separate "math model" object to contain ODEs
-    if model.odes:
+    if not model.equations_outdated():
         return
-    lines = iter(generate_network(model,cleanup,verbose=verbose).split('\n'))
-    _parse_netfile(model, lines)
+    model.reset_equations()
+    with _network_file(model, cleanup=cleanup, verbose=verbose,
+                       pool=pool) as net_file:
+        _parse_netfile(model, net_file)
+    # BngGenerator may have modified the model (enable_synth_deg), so record
+    # the revision after network generation
+    model._equations_revision = model.revision
 
 
 def _parse_netfile(model, lines):
     """Parse 'species', 'reactions', and 'groups' blocks from a BNGL net file."""
+    lines = iter(lines)
     try:
-        global new_reverse_convention
-        (bng_version, bng_codename) = re.match(r'# Created by BioNetGen (\d+\.\d+\.\d+)(?:-(\w+))?$', next(lines)).groups()
-        if parse_version(bng_version) > parse_version("2.2.6") or parse_version(bng_version) == parse_version("2.2.6") and bng_codename == "stable":
-            new_reverse_convention = True
-        else:
-            new_reverse_convention = False
+        header = next(lines)
+        if not header.startswith('# Created by BioNetGen '):
+            raise BngInterfaceError("Not a BNG net file (header line %r)" %
+                                    header.strip())
 
         while 'begin species' not in next(lines):
             pass
         model.species = []
+        monomer_cache = {}
         while True:
             line = next(lines)
             if 'end species' in line: break
-            _parse_species(model, line)
+            _parse_species(model, line, monomer_cache)
 
         while 'begin reactions' not in next(lines):
             pass
-        model.odes = [sympy.numbers.Zero()] * len(model.species)
-        global reaction_cache
-        reaction_cache = {}
+        network = _NetfileReactions(len(model.species))
+        model._defer_equations(network)
         while True:
             line = next(lines)
             if 'end reactions' in line: break
-            _parse_reaction(model, line)
-        # fix up reactions whose reverse version we saw first
-        for r in model.reactions_bidirectional:
-            if all(r['reverse']):
-                r['reactants'], r['products'] = r['products'], r['reactants']
-                r['rate'] *= -1
-            # now the 'reverse' value is no longer needed
-            del r['reverse']
+            network.add(line)
 
         while 'begin groups' not in next(lines):
             pass
@@ -629,67 +1024,180 @@ def _parse_netfile(model, lines):
         pass
 
 
-def _parse_species(model, line):
+def _parse_species(model, line, monomer_cache=None):
     """Parse a 'species' line from a BNGL net file."""
-    index, species, value = line.strip().split()
-    species_compartment_name, complex_string = re.match(r'(?:@(\w+)::)?(.*)', species).groups()
-    species_compartment = model.compartments.get(species_compartment_name)
-    monomer_strings = complex_string.split('.')
+    index, species, value = line.split()
+    species_compartment = None
+    if species.startswith('@'):
+        species_compartment_name, _, species = species[1:].partition('::')
+        species_compartment = model.compartments.get(species_compartment_name)
+    if monomer_cache is None:
+        monomer_cache = {}
     monomer_patterns = []
-    for ms in monomer_strings:
-        monomer_name, site_strings, monomer_compartment_name = re.match(r'(\w+)\(([^)]*)\)(?:@(\w+))?', ms).groups()
-        site_conditions = {}
-        if len(site_strings):
-            for ss in site_strings.split(','):
-                # FIXME this should probably be done with regular expressions
-                if '!' in ss and '~' in ss:
-                    site_name, condition = ss.split('~')
-                    state, bond = condition.split('!')
-                    if bond == '?':
-                        bond = pysb.core.WILD
-                    elif bond == '!':
-                        bond = pysb.core.ANY
-                    else:
-                        bond = int(bond)
-                    condition = (state, bond)
-                elif '!' in ss:
-                    site_name, condition = ss.split('!', 1)
-                    if '!' in condition:
-                        condition = [int(c) for c in condition.split('!')]
-                    else:
-                        condition = int(condition)
-                elif '~' in ss:
-                    site_name, condition = ss.split('~')
-                else:
-                    site_name, condition = ss, None
-                site_conditions[site_name] = condition
-        monomer = model.monomers[monomer_name]
-        monomer_compartment = model.compartments.get(monomer_compartment_name)
+    for ms in species.split('.'):
+        parsed = monomer_cache.get(ms)
+        if parsed is None:
+            parsed = monomer_cache[ms] = _parse_monomer(model, ms)
+        monomer, site_conditions, monomer_compartment = parsed
         # Compartment prefix notation in BNGL means "assign this compartment to
         # all molecules without their own explicit compartment".
         compartment = monomer_compartment or species_compartment
-        mp = pysb.core.MonomerPattern(monomer, site_conditions, compartment)
+        mp = pysb.core.MonomerPattern(monomer, dict(site_conditions),
+                                      compartment)
         monomer_patterns.append(mp)
 
     cp = pysb.core.ComplexPattern(monomer_patterns, None)
     model.species.append(cp)
 
 
-def _parse_reaction(model, line):
-    """Parse a 'reaction' line from a BNGL net file."""
-    (number, reactants, products, rate, rule) = line.strip().split(' ', 4)
-    # the -1 is to switch from one-based to zero-based indexing
-    reactants = tuple(int(r) - 1 for r in reactants.split(','))
-    products = tuple(int(p) - 1 for p in products.split(','))
-    rate = rate.rsplit('*')
-    (rule_list, unit_conversion) = re.match(
-                    r'#([\w,\(\)]+)(?: unit_conversion=(.*))?\s*$', rule).groups()
-    rule_list = rule_list.split(',') # BNG lists all rules that generate a rxn
-    # Support new (BNG 2.2.6-stable or greater) and old BNG naming convention for reverse rules
-    rule_name, is_reverse = zip(*[re.subn('^_reverse_|\(reverse\)$', '', r) for r in rule_list])
-    is_reverse = tuple(bool(i) for i in is_reverse)
-    r_names = ['__s%d' % r for r in reactants]
-    combined_rate = sympy.Mul(*[sympy.S(t) for t in r_names + rate])
+def _parse_monomer(model, ms):
+    """
+    Parse a molecule from a BNGL species string.
+
+    Returns the Monomer, a dict of site conditions and the molecule's own
+    compartment (or None).
+    """
+    monomer_name, _, rest = ms.partition('(')
+    site_strings, _, rest = rest.partition(')')
+    monomer_compartment = None
+    if rest.startswith('@'):
+        monomer_compartment = model.compartments.get(rest[1:])
+    site_conditions = {}
+    if len(site_strings):
+        for ss in site_strings.split(','):
+            if '!' in ss and '~' in ss:
+                site_name, condition = ss.split('~')
+                state, bond = condition.split('!')
+                if bond == '?':
+                    bond = pysb.core.WILD
+                elif bond == '!':
+                    bond = pysb.core.ANY
+                else:
+                    bond = int(bond)
+                condition = (state, bond)
+            elif '!' in ss:
+                site_name, condition = ss.split('!', 1)
+                if '!' in condition:
+                    condition = [int(c) for c in condition.split('!')]
+                else:
+                    condition = int(condition)
+            elif '~' in ss:
+                site_name, condition = ss.split('~')
+            else:
+                site_name, condition = ss, None
+            site_conditions[site_name] = condition
+    return model.monomers[monomer_name], site_conditions, monomer_compartment
+
+
+def _parse_rule_list(rule_field):
+    """
+    Parse the '#rule,...' comment of a reaction line from a BNGL net file.
+
+    Returns tuples of the rule names and of whether each is a reverse rule.
+    BNG lists all rules that generate a reaction. Reverse rules are named
+    '<rule>(reverse)' since BNG 2.2.6-stable and '_reverse_<rule>' before.
+    """
+    rule_list = rule_field.split()[0].lstrip('#')
+    rule_names = []
+    is_reverse = []
+    for rule in rule_list.split(','):
+        reverse = False
+        if rule.endswith('(reverse)'):
+            rule, reverse = rule[:-len('(reverse)')], True
+        elif rule.startswith('_reverse_'):
+            rule, reverse = rule[len('_reverse_'):], True
+        rule_names.append(rule)
+        is_reverse.append(reverse)
+    return tuple(rule_names), tuple(is_reverse)
+
+
+class _NetfileReactions(object):
+    """
+    Reactions from a BNGL net file, stored as integer arrays.
+
+    Reactant and product species indices are stored back to back in
+    `reactants` and `products`, with reaction i's indices starting at
+    `reactant_offsets[i]` and `product_offsets[i]`. Each reaction's rate
+    constant (the rate field of the net file, e.g. ``2*kf``) and rule list
+    are stored as an index into `rate_terms` and `rules` respectively, so
+    each distinct rate constant and rule list is only parsed once.
+    """
+    def __init__(self, n_species):
+        self.n_species = n_species
+        self.reactants = array.array('l')
+        self.reactant_offsets = array.array('l', [0])
+        self.products = array.array('l')
+        self.product_offsets = array.array('l', [0])
+        self.rate_ids = array.array('l')
+        self.rule_ids = array.array('l')
+        self.rate_terms = []
+        self.rules = []
+        self._rate_index = {}
+        self._rule_index = {}
+
+    def __len__(self):
+        return len(self.rate_ids)
+
+    def add(self, line):
+        """Add a reaction from a 'reactions' line of a BNGL net file."""
+        number, reactants, products, rate, rule = line.split(None, 4)
+        # the -1 is to switch from one-based to zero-based indexing
+        self.reactants.extend(int(r) - 1 for r in reactants.split(','))
+        self.reactant_offsets.append(len(self.reactants))
+        self.products.extend(int(p) - 1 for p in products.split(','))
+        self.product_offsets.append(len(self.products))
+        self.rate_ids.append(self._intern(rate, self.rate_terms,
+                                          self._rate_index))
+        self.rule_ids.append(self._intern(rule, self.rules,
+                                          self._rule_index))
+
+    @staticmethod
+    def _intern(value, values, index):
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(values)
+            values.append(value)
+        return i
+
+    def __call__(self, model):
+        """
+        Fill in a model's reactions, reactions_bidirectional and odes.
+
+        This is the model's deferred equations callback, so it is an instance
+        (which can be pickled along with the model) rather than a bound method.
+        """
+        species_symbols = [sympy.Symbol('__s%d' % i)
+                           for i in range(self.n_species)]
+        rates = [[sympy.S(t) for t in rate.split('*')]
+                 for rate in self.rate_terms]
+        rules = [_parse_rule_list(rule) for rule in self.rules]
+        model.reactions = []
+        model.reactions_bidirectional = []
+        reaction_cache = {}
+        for i in range(len(self)):
+            reactants = tuple(self.reactants[self.reactant_offsets[i]:
+                                             self.reactant_offsets[i + 1]])
+            products = tuple(self.products[self.product_offsets[i]:
+                                           self.product_offsets[i + 1]])
+            combined_rate = sympy.Mul(*([species_symbols[r] for r in
+                                         reactants] + rates[self.rate_ids[i]]))
+            rule_name, is_reverse = rules[self.rule_ids[i]]
+            _add_reaction(model, reaction_cache, reactants, products,
+                          combined_rate, rule_name, is_reverse)
+        _finish_reactions_bidirectional(model)
+        _build_odes(model, self.n_species)
+
+
+def _add_reaction(model, reaction_cache, reactants, products, combined_rate,
+                  rule_name, is_reverse):
+    """
+    Add a reaction to a model's reactions and reactions_bidirectional.
+
+    `reaction_cache` maps (reactants, products) to the entries of
+    reactions_bidirectional added so far, and should start out empty for each
+    network. Call :func:`_finish_reactions_bidirectional` and
+    :func:`_build_odes` once all reactions have been added.
+    """
     reaction = {
         'reactants': reactants,
         'products': products,
@@ -719,17 +1227,37 @@ def _parse_reaction(model, line):
         reaction_bd['reversible'] = False
         reaction_cache[key] = reaction_bd
         model.reactions_bidirectional.append(reaction_bd)
-    # odes
-    for p in products:
-        model.odes[p] += combined_rate
-    for r in reactants:
-        model.odes[r] -= combined_rate
+
+
+def _finish_reactions_bidirectional(model):
+    """Tidy up reactions_bidirectional once all reactions are added."""
+    # fix up reactions whose reverse version we saw first
+    for r in model.reactions_bidirectional:
+        if all(r['reverse']):
+            r['reactants'], r['products'] = r['products'], r['reactants']
+            r['rate'] *= -1
+        # now the 'reverse' value is no longer needed
+        del r['reverse']
+
+
+def _build_odes(model, n_species):
+    """Set a model's odes from its reactions."""
+    # Collect the terms for each species and sum them once at the end, as
+    # repeatedly adding to a sympy sum is quadratic in the number of terms
+    terms = [[] for i in range(n_species)]
+    for reaction in model.reactions:
+        rate = reaction['rate']
+        for p in reaction['products']:
+            terms[p].append(rate)
+        for r in reaction['reactants']:
+            terms[r].append(-rate)
+    model.odes = [sympy.Add(*t) for t in terms]
             
             
 def _parse_group(model, line):
     """Parse a 'group' line from a BNGL net file."""
     # values are number (which we ignore), name, and species list
-    values = line.strip().split()
+    values = line.split()
     obs = model.observables[values[1]]
     if len(values) == 3:
         # combination is a comma separated list of [coeff*]speciesnumber
@@ -463,6 +463,53 @@ class MonomerPattern(object):
 
 
 
+def _compartment_name(compartment):
+    return compartment.name if compartment is not None else ''
+
+
+def _condition_bonds(condition):
+    """Return the bond numbers in a site condition."""
+    if isinstance(condition, int):
+        return [condition]
+    elif isinstance(condition, (tuple, list)):
+        return [b for c in condition for b in _condition_bonds(c)]
+    return []
+
+
+def _bond_free_condition(condition):
+    """Return a site condition with bond numbers replaced by a placeholder."""
+    if isinstance(condition, int):
+        return '!'
+    elif isinstance(condition, tuple):
+        return tuple(_bond_free_condition(c) for c in condition)
+    elif isinstance(condition, list):
+        return ['!'] * len(condition)
+    return condition
+
+
+def _renumber_condition(condition, bond_numbers):
+    """
+    Return a site condition with bonds renumbered by order of appearance.
+
+    `bond_numbers` maps original to new bond numbers and is updated with any
+    bonds seen for the first time.
+    """
+    if isinstance(condition, int):
+        return bond_numbers.setdefault(condition, len(bond_numbers) + 1)
+    elif isinstance(condition, tuple):
+        return tuple(_renumber_condition(c, bond_numbers) for c in condition)
+    elif isinstance(condition, list):
+        return sorted(_renumber_condition(c, bond_numbers)
+                      for c in condition)
+    return condition
+
+
+def _ranks(values):
+    """Replace each value by its rank among the distinct values."""
+    rank = dict((v, i) for i, v in enumerate(sorted(set(values))))
+    return [rank[v] for v in values]
+
+
 class ComplexPattern(object):
 
     """
@@ -513,19 +560,105 @@ class ComplexPattern(object):
         return mp_concrete_ok or compartment_ok
 
     def is_equivalent_to(self, other):
-        """Checks for equality with another ComplexPattern"""
-        # Didn't implement __eq__ to avoid confusion with __ne__ operator used for Rule building
+        """
+        Checks for equality with another ComplexPattern
 
-        # FIXME the literal site_conditions comparison requires bond numbering to be identical,
-        #   so some sort of canonicalization of that numbering is necessary.
+        Two patterns are equivalent if they describe the same graph of
+        monomers, sites, states and bonds, regardless of the order of the
+        monomer patterns and the numbering of the bonds (see
+        `canonical_key`).
+        """
+        # Didn't implement __eq__ to avoid confusion with __ne__ operator used for Rule building
         if not isinstance(other, ComplexPattern):
             raise Exception("Can only compare ComplexPattern to another ComplexPattern")
-        mp_order = lambda mp: (mp[0], mp[1].keys(), mp[2])
-        return (self.compartment == other.compartment and
-                sorted([(repr(mp.monomer), mp.site_conditions, mp.compartment)
-                       for mp in self.monomer_patterns], key=mp_order) ==
-                sorted([(repr(mp.monomer), mp.site_conditions, mp.compartment)
-                       for mp in other.monomer_patterns], key=mp_order))
+        return self.canonical_key() == other.canonical_key()
+
+    def canonical_key(self):
+        """
+        Return a hashable key which is identical for equivalent patterns.
+
+        The key is a canonical form of the graph whose nodes are the monomer
+        patterns (labelled by monomer, compartment, site states and bonded
+        sites) and whose edges are the bonds. It does not depend on the order
+        of the monomer patterns or on the numbering of the bonds, so it can be
+        used to look up species in dicts and sets. The match_once flag is not
+        part of the key.
+
+        The canonical ordering of the monomer patterns is found by colour
+        refinement, individualizing the members of any remaining classes of
+        indistinguishable monomer patterns in turn and keeping the smallest
+        resulting key.
+
+        The key reflects the pattern at the time of the call, so it must be
+        recomputed if the pattern is modified.
+        """
+        mps = self.monomer_patterns
+        # Neighbours of each monomer pattern: (site, neighbour index,
+        # neighbour site) for every bond
+        bond_sites = collections.defaultdict(list)
+        for i, mp in enumerate(mps):
+            for site, condition in mp.site_conditions.items():
+                for bond in _condition_bonds(condition):
+                    bond_sites[bond].append((i, site))
+        neighbours = [[] for mp in mps]
+        for sites in bond_sites.values():
+            for (i, site_i), (j, site_j) in itertools.permutations(sites, 2):
+                neighbours[i].append((site_i, j, site_j))
+
+        mp_labels = [(mp.monomer.name, _compartment_name(mp.compartment),
+                      tuple(sorted((site, repr(_bond_free_condition(cond)))
+                                   for site, cond in
+                                   mp.site_conditions.items())))
+                     for mp in mps]
+        colours = _ranks(mp_labels)
+
+        def refine(colours):
+            # Split colour classes by the colours of bonded neighbours until
+            # the partition is stable
+            while True:
+                new_colours = _ranks([
+                    (colours[i], tuple(sorted((site, colours[j], nsite) for
+                                              site, j, nsite in nbrs)))
+                    for i, nbrs in enumerate(neighbours)])
+                if len(set(new_colours)) == len(set(colours)):
+                    return new_colours
+                colours = new_colours
+
+        def build_key(colours):
+            order = sorted(range(len(mps)), key=colours.__getitem__)
+            bond_numbers = {}
+            key = []
+            for i in order:
+                name, compartment, sites = mp_labels[i]
+                key.append((name, compartment, tuple(
+                    (site, repr(_renumber_condition(
+                        mps[i].site_conditions[site], bond_numbers)))
+                    for site, _ in sites)))
+            return tuple(key)
+
+        def search(colours):
+            colours = refine(colours)
+            counts = collections.Counter(colours)
+            tied = [c for c, count in counts.items() if count > 1]
+            if not tied:
+                return build_key(colours)
+            target = min(tied)
+            # Monomer patterns with identical neighbourhoods can be swapped
+            # without changing the graph, so only one of them needs trying
+            candidates = {}
+            for i, c in enumerate(colours):
+                if c == target:
+                    candidates.setdefault(tuple(sorted(neighbours[i])), i)
+            best = None
+            for i in candidates.values():
+                individualized = [2 * c for c in colours]
+                individualized[i] = 2 * target - 1
+                key = search(individualized)
+                if best is None or key < best:
+                    best = key
+            return best
+
+        return _compartment_name(self.compartment), search(colours)
 
     def copy(self):
         """
@@ -1123,7 +1256,9 @@ class Model(object):
         ComplexPattern is concrete.
     odes : list of sympy.Expr
         Mathematical expressions describing the time derivative of the amount of
-        each species, as generated by the rules.
+        each species, as generated by the rules. Network generators may defer
+        building `odes`, `reactions` and `reactions_bidirectional` until one
+        of them is first accessed.
     reactions : list of dict
         Structures describing each possible unidirectional reaction that can be
         produced by the model. Each structure stores the name of the rule that
@@ -1140,6 +1275,11 @@ class Model(object):
     annotations : list of Annotation
         Structured annotations of model components. See the Annotation class for
         details.
+    revision : int
+        Counter which is incremented by every structural change to the model
+        (adding or renaming components, adding or changing initial
+        conditions). Changes to parameter values do not affect it. Used to
+        determine whether the generated equations are out of date.
 
     """
 
@@ -1165,6 +1305,12 @@ class Model(object):
         #####
         self.diffusivities = []
         #####
+        self._revision = 0
+        self._equations_revision = None
+        self._pending_equations = None
+        self._species_index = {}
+        self._species_index_list = None
+        self._species_index_len = 0
         if self._export:
             SelfExporter.export(self)
         if self.base is not None:
@@ -1179,6 +1325,17 @@ class Model(object):
     def __setstate__(self, state):
         # restore the 'model' weakrefs on all components
         self.__dict__.update(state)
+        # models pickled before revision tracking was added
+        self.__dict__.setdefault('_revision', 0)
+        self.__dict__.setdefault('_equations_revision', None)
+        self.__dict__.setdefault('_pending_equations', None)
+        # models pickled before the equation fields became properties
+        for name in ('odes', 'reactions', 'reactions_bidirectional'):
+            if name in self.__dict__:
+                self.__dict__['_' + name] = self.__dict__.pop(name)
+        self.__dict__.setdefault('_species_index', {})
+        self.__dict__.setdefault('_species_index_list', None)
+        self.__dict__.setdefault('_species_index_len', 0)
         for c in self.all_components():
             c.model = weakref.ref(self)
 
@@ -1280,11 +1437,75 @@ class Model(object):
             if isinstance(other, t):
                 cset.add(other)
                 other.model = weakref.ref(self)
+                self._modified()
                 break
         else:
             raise Exception("Tried to add component of unknown type '%s' to "
                             "model" % type(other))
 
+    @property
+    def revision(self):
+        return self._revision
+
+    def _modified(self):
+        """Record a structural change to the model."""
+        self._revision += 1
+
+    @property
+    def odes(self):
+        self._complete_equations()
+        return self._odes
+
+    @odes.setter
+    def odes(self, value):
+        self._odes = value
+
+    @property
+    def reactions(self):
+        self._complete_equations()
+        return self._reactions
+
+    @reactions.setter
+    def reactions(self, value):
+        self._reactions = value
+
+    @property
+    def reactions_bidirectional(self):
+        self._complete_equations()
+        return self._reactions_bidirectional
+
+    @reactions_bidirectional.setter
+    def reactions_bidirectional(self, value):
+        self._reactions_bidirectional = value
+
+    def _defer_equations(self, callback):
+        """
+        Defer building odes, reactions and reactions_bidirectional.
+
+        `callback` is called with the model the first time one of those
+        fields is accessed, and must fill all three in. This lets network
+        parsers store reactions compactly and skip building sympy expressions
+        which are never used. The callback is pickled along with the model,
+        so it must be picklable (which bound methods aren't on Python 2).
+        """
+        self._pending_equations = callback
+
+    def _complete_equations(self):
+        callback = self._pending_equations
+        if callback is not None:
+            self._pending_equations = None
+            callback(self)
+
+    def equations_outdated(self):
+        """
+        Return True if the generated equations do not reflect the model.
+
+        This is the case if equations have never been generated, or if the
+        model has been structurally modified since they were (see
+        `revision`).
+        """
+        return self._equations_revision != self._revision
+
     def add_annotation(self, annotation):
         """Add an annotation to the model."""
         self.annotations.append(annotation)
@@ -1308,6 +1529,7 @@ class Model(object):
         for cset in self.all_component_sets():
             if component in cset:
                 cset.rename(component, new_name)
+                self._modified()
 
     def _validate_initial_condition_pattern(self, pattern):
         """
@@ -1335,10 +1557,9 @@ class Model(object):
             raise InvalidInitialConditionError("Not a ComplexPattern")
         if not complex_pattern.is_concrete():
             raise InvalidInitialConditionError("Pattern not concrete")
-        if any(complex_pattern.is_equivalent_to(other_cp)
+        key = complex_pattern.canonical_key()
+        if any(key == other_cp.canonical_key()
                for other_cp, value in self.initial_conditions):
-            # FIXME until we get proper canonicalization this could produce
-            # false negatives
             raise InvalidInitialConditionError("Duplicate species")
         if complex_pattern.match_once:
             raise InvalidInitialConditionError("MatchOnce not allowed here")
@@ -1362,6 +1583,7 @@ class Model(object):
         complex_pattern = self._validate_initial_condition_pattern(pattern)
         validate_const_expr(value, "initial condition value")
         self.initial_conditions.append( (complex_pattern, value) )
+        self._modified()
 
     def update_initial_condition_pattern(self, before_pattern, after_pattern):
         """
@@ -1386,8 +1608,9 @@ class Model(object):
         """
 
         # Get the initial condition index
+        before_key = as_complex_pattern(before_pattern).canonical_key()
         ic_index_list = [i for i, ic in enumerate(self.initial_conditions)
-                   if ic[0].is_equivalent_to(as_complex_pattern(before_pattern))]
+                         if ic[0].canonical_key() == before_key]
 
         # If the initial condition to replace is not found, raise an error
         if not ic_index_list:
@@ -1411,6 +1634,7 @@ class Model(object):
         p = self.initial_conditions[ic_index][1]
         del self.initial_conditions[ic_index]
         self.initial_conditions.append( (after_pattern, p) )
+        self._modified()
 
     def get_species_index(self, complex_pattern):
         """
@@ -1422,11 +1646,25 @@ class Model(object):
             A concrete pattern specifying the species to find.
 
         """
-        # FIXME I don't even want to think about the inefficiency of this, but at least it works
-        try:
-            return next((i for i, s_cp in enumerate(self.species) if s_cp.is_equivalent_to(complex_pattern)))
-        except StopIteration:
-            return None
+        complex_pattern = as_complex_pattern(complex_pattern)
+        return self._get_species_index_map().get(
+            complex_pattern.canonical_key())
+
+    def _get_species_index_map(self):
+        """
+        Return a dict mapping species canonical keys to indices in `species`.
+
+        The dict is built on first use after the species list has been
+        (re)generated and rebuilt if `species` is replaced or extended.
+        """
+        if (self._species_index_list is not self.species or
+                self._species_index_len != len(self.species)):
+            self._species_index = {}
+            for i, cp in enumerate(self.species):
+                self._species_index.setdefault(cp.canonical_key(), i)
+            self._species_index_list = self.species
+            self._species_index_len = len(self.species)
+        return self._species_index
 
     def has_synth_deg(self):
         """Return true if model uses synthesis or degradation reactions."""
@@ -1442,18 +1680,20 @@ class Model(object):
             self.add_component(Parameter('__source_0', 1.0, _export=False))
 
         source_cp = as_complex_pattern(self.monomers['__source']())
+        ic_keys = set(cp.canonical_key() for cp, value in
+                      self.initial_conditions)
         if self.compartments:
             for c in self.compartments:
                 source_cp = source_cp ** c
-                if not any(source_cp.is_equivalent_to(other_cp) for
-                           other_cp, value in self.initial_conditions):
+                if source_cp.canonical_key() not in ic_keys:
                     self.initial(source_cp, self.parameters['__source_0'])
         else:
-            if not any(source_cp.is_equivalent_to(other_cp) for other_cp, value in self.initial_conditions):
+            if source_cp.canonical_key() not in ic_keys:
                 self.initial(source_cp, self.parameters['__source_0'])
 
     def reset_equations(self):
         """Clear out fields generated by bng.generate_equations or the like."""
+        self._pending_equations = None
         self.species = []
         self.odes = []
         self.reactions = []
@@ -1461,6 +1701,10 @@ class Model(object):
         for obs in self.observables:
             obs.species = []
             obs.coefficients = []
+        self._equations_revision = None
+        self._species_index = {}
+        self._species_index_list = None
+        self._species_index_len = 0
 
     def __repr__(self):
         return ("<%s '%s' (monomers: %d, rules: %d, parameters: %d, "
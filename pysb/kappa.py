@@ -13,22 +13,20 @@ specified in one of three ways:
 from __future__ import print_function as _
 import pysb
 from pysb.generator.kappa import KappaGenerator
+from pysb.util import read_trajectories
 import os
 import subprocess
 import random
-import re
 import sympy
 import numpy as np
 import tempfile
 import shutil
 import warnings
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
 from collections import namedtuple
 
-try:
-    from future_builtins import zip
-except ImportError:
-    pass
-
 # Cached value of Kappa program paths
 _kasim_path = None
 _kasa_path = None
@@ -133,6 +131,9 @@ StaticAnalysisResult = namedtuple('StaticAnalysisResult',
 SimulationResult = namedtuple('SimulationResult',
                                   ['timecourse', 'flux_map'])
 
+EnsembleResult = namedtuple('EnsembleResult',
+                            ['timecourses', 'mean', 'variance', 'seeds'])
+
 
 def run_simulation(model, time=10000, points=200, cleanup=True,
                    output_prefix=None, output_dir=None, flux_map=False,
@@ -231,16 +232,7 @@ def run_simulation(model, time=10000, points=200, cleanup=True,
             kappa_file.write('\n%s\n' % perturbation)
 
     # Run KaSim
-    kasim_path = _get_kappa_path('KaSim')
-    p = subprocess.Popen([kasim_path] + args,
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if verbose:
-        for line in iter(p.stdout.readline, b''):
-            print('@@', line, end='')
-    (p_out, p_err) = p.communicate()
-
-    if p.returncode:
-        raise KasimInterfaceError(p_out + '\n' + p_err)
+    _run_kasim(args, verbose)
 
     # The simulation data, as a numpy array
     data = _parse_kasim_outfile(out_filename)
@@ -276,6 +268,148 @@ def run_simulation(model, time=10000, points=200, cleanup=True,
         return data
 
 
+def run_ensemble(model, n_runs=10, time=10000, points=200, seed=None,
+                 num_processors=None, cleanup=True, output_prefix=None,
+                 output_dir=None, perturbation=None, verbose=False):
+    """Runs an ensemble of KaSim simulations of the given model in parallel.
+
+    The Kappa file is generated once, then KaSim is run ``n_runs`` times with
+    a different seed each time, with up to ``num_processors`` KaSim processes
+    running at once. The output of each run is parsed as soon as it finishes.
+
+    Parameters
+    ----------
+    model : pysb.core.Model
+        The model to simulate using KaSim.
+    n_runs : integer
+        The number of simulations to run. Default value is 10.
+    time : number
+        The amount of time (in arbitrary units) to run each simulation.
+        Identical to the -t argument when using KaSim at the command line.
+        Default value is 10000.
+    points : integer
+        The number of data points to collect for plotting, as for
+        :py:func:`run_simulation`.
+    seed : integer
+        The seed of the first simulation; the others use consecutive seeds.
+        Set to None (default) to start from a random seed, or supply a seed
+        for deterministic behaviour (e.g. for testing).
+    num_processors : integer
+        The maximum number of KaSim processes to run at once. Defaults to
+        the number of CPUs.
+    cleanup : boolean
+        Specifies whether output files produced by KaSim should be deleted
+        after execution is completed. Default value is True.
+    output_prefix: str
+        Prefix of the temporary directory name. Default is
+        'tmpKappa_<model name>_'.
+    output_dir : string
+        The directory in which to create the temporary directory for
+        the .ka and .out files. Defaults to the system temporary file
+        directory (e.g. /tmp). If the specified directory does not exist,
+        an Exception is thrown.
+    perturbation : string or None
+        Optional perturbation language syntax to be appended to the Kappa file.
+        See KaSim manual for more details. Default value is None (no
+        perturbation).
+    verbose : boolean
+        Whether to print a message as each simulation finishes.
+
+    Returns
+    -------
+    EnsembleResult, a namedtuple with four fields:
+
+    - `timecourses`, the data of all the simulations stacked in a Numpy
+      ndarray with one row per simulation, indexed by the same names as the
+      data returned by :py:func:`run_simulation` (e.g.
+      ``timecourses['AB'][0]`` for the first simulation)
+    - `mean` and `variance`, Numpy ndarrays indexed in the same way with the
+      mean and variance of each column over the simulations
+    - `seeds`, the list of the seeds used for each simulation
+    """
+
+    if n_runs < 1:
+        raise ValueError('n_runs must be at least 1')
+    if seed is None:
+        seed = random.randint(1, 2 ** 30)
+    seeds = [seed + i for i in range(n_runs)]
+    if num_processors is None:
+        num_processors = multiprocessing.cpu_count()
+
+    gen = KappaGenerator(model)
+
+    if output_prefix is None:
+        output_prefix = 'tmpKappa_%s_' % model.name
+
+    base_directory = tempfile.mkdtemp(prefix=output_prefix, dir=output_dir)
+
+    base_filename = os.path.join(base_directory, model.name)
+    kappa_filename = base_filename + '.ka'
+
+    with open(kappa_filename, 'w') as kappa_file:
+        kappa_file.write(gen.get_content())
+        if perturbation:
+            kappa_file.write('\n%s\n' % perturbation)
+
+    # The KaSim processes which have been started, so they can be stopped
+    # if a run fails
+    processes = []
+    lock = threading.Lock()
+    stopped = []
+
+    def run(i):
+        out_filename = '%s_%d.out' % (base_filename, i)
+        with lock:
+            if stopped:
+                return None
+            p = _start_kasim(['-i', kappa_filename, '-t', str(time),
+                              '-p', str(points), '-o', out_filename,
+                              '-seed', str(seeds[i])])
+            processes.append(p)
+        _wait_kasim(p)
+        return i, out_filename
+
+    # The KaSim processes run outside the interpreter, so threads are enough
+    # to keep num_processors of them busy
+    pool = ThreadPool(min(num_processors, n_runs))
+    timecourses = None
+    try:
+        for n_done, (i, out_filename) in enumerate(
+                pool.imap_unordered(run, range(n_runs))):
+            data = read_trajectories(out_filename)
+            if timecourses is None:
+                timecourses = np.empty((n_runs, len(data)), dtype=data.dtype)
+            elif data.shape != timecourses.shape[1:]:
+                raise KasimInterfaceError(
+                    'KaSim run with seed %d returned %d points instead of %d'
+                    % (seeds[i], len(data), timecourses.shape[1]))
+            timecourses[i] = data
+            if verbose:
+                print('KaSim run %d of %d finished (seed %d)' %
+                      (n_done + 1, n_runs, seeds[i]))
+    finally:
+        # Stop any KaSim processes still running (after a failure) and wait
+        # for them to exit before their directory is removed
+        with lock:
+            stopped.append(True)
+            for p in processes:
+                if p.poll() is None:
+                    p.kill()
+        pool.terminate()
+        for p in processes:
+            p.wait()
+        if cleanup:
+            shutil.rmtree(base_directory)
+
+    mean = np.empty(timecourses.shape[1], dtype=timecourses.dtype)
+    variance = np.empty_like(mean)
+    for name in timecourses.dtype.names:
+        mean[name] = np.mean(timecourses[name], axis=0)
+        variance[name] = np.var(timecourses[name], axis=0)
+
+    return EnsembleResult(timecourses, mean, variance, seeds)
+
+
 def run_static_analysis(model, influence_map=False, contact_map=False,
                         cleanup=True, output_prefix=None, output_dir=None,
                         verbose=False):
@@ -450,6 +584,35 @@ def influence_map(model, **kwargs):
 
 ### "PRIVATE" Functions ###############################################
 
+def _run_kasim(args, verbose=False):
+    """
+    Runs KaSim with the given command line arguments, raising a
+    KasimInterfaceError if it fails.
+    """
+    _wait_kasim(_start_kasim(args), verbose)
+
+
+def _start_kasim(args):
+    """Starts KaSim with the given command line arguments."""
+    kasim_path = _get_kappa_path('KaSim')
+    return subprocess.Popen([kasim_path] + args,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _wait_kasim(p, verbose=False):
+    """
+    Waits for a KaSim process to finish, raising a KasimInterfaceError if it
+    fails.
+    """
+    if verbose:
+        for line in iter(p.stdout.readline, b''):
+            print('@@', line, end='')
+    (p_out, p_err) = p.communicate()
+
+    if p.returncode:
+        raise KasimInterfaceError(p_out.decode() + '\n' + p_err.decode())
+
+
 def _parse_kasim_outfile(out_filename):
     """
     Parses the KaSim .out file into a Numpy ndarray.
@@ -473,28 +636,8 @@ def _parse_kasim_outfile(out_filename):
     """
 
     try:
-        out_file = open(out_filename, 'r')
-
-        line = out_file.readline().strip()  # Get the first line
-        out_file.close()
-        line = line[2:]  # strip off opening '# '
-        raw_names = re.split(' ', line)
-        column_names = []
-
-        # Get rid of the quotes surrounding the observable names
-        for raw_name in raw_names:
-            mo = re.match("'(.*)'", raw_name)
-            if (mo):
-                column_names.append(mo.group(1))
-            else:
-                column_names.append(raw_name)
-
-        # Create the dtype argument for the numpy record array
-        dt = list(zip(column_names, ('float', ) * len(column_names)))
-
-        # Load the output file as a numpy record array, skip the name row
-        arr = np.loadtxt(out_filename, dtype=float, skiprows=1)
-        recarr = arr.view(dt)
+        # Keep the (points, 1) shape returned by earlier versions
+        recarr = read_trajectories(out_filename).reshape(-1, 1)
     except Exception as e:
         raise Exception("problem parsing KaSim outfile: " + str(e))
 
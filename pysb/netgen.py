@@ -0,0 +1,658 @@
+"""
+Native Python reaction network generation.
+
+:py:func:`generate_equations` expands the rules of a model into its species,
+reactions and ODEs in-process, filling in the same model fields as
+:py:func:`pysb.bng.generate_equations` without writing a BNGL file or running
+BioNetGen. Once a model's equations have been generated, the simulators will
+use them as long as the model is not structurally modified, e.g.::
+
+    from pysb.netgen import generate_equations
+    from pysb.simulator import ScipyOdeSimulator
+
+    generate_equations(model)
+    result = ScipyOdeSimulator(model, tspan=tspan).run()
+
+Rules are applied with BioNetGen's semantics: reactant patterns are matched
+to species via all embeddings of their monomer patterns, molecules present
+only in the products are synthesized and molecules present only in the
+reactants are deleted (along with their whole species if the entire reactant
+pattern is deleted), and reaction rates include BioNetGen's statistical
+factors (the number of distinct ways a reaction can occur, divided by the
+number of permutations of identical reactant species).
+
+Compartments and multiple bonds on a single site are not supported; use
+:py:mod:`pysb.bng` for models which need them.
+
+"""
+
+from __future__ import print_function as _
+import collections
+import itertools
+from warnings import warn
+import sympy
+import pysb.bng
+from pysb.core import (ANY, WILD, ComplexPattern, MonomerPattern,
+                       as_complex_pattern)
+
+# Alias basestring under Python 3 for forwards compatibility
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+class NetworkGenerationError(RuntimeError):
+    """The model uses a feature which network generation does not support"""
+    pass
+
+
+def _split_condition(condition):
+    """Split a site condition into its state and bond parts."""
+    if condition is None:
+        return None, None
+    elif isinstance(condition, basestring):
+        return condition, None
+    elif isinstance(condition, int) or condition is ANY or condition is WILD:
+        return None, condition
+    elif isinstance(condition, tuple):
+        return condition[0], _split_condition(condition[1])[1]
+    elif isinstance(condition, list):
+        raise NetworkGenerationError("Multiple bonds on a single site are "
+                                     "not supported")
+    raise NetworkGenerationError("Unsupported site condition: %r" %
+                                 (condition, ))
+
+
+class _Pattern(object):
+    """
+    A ComplexPattern compiled for matching against species.
+
+    Bonds are stored as `partners`, a list (per monomer pattern) of tuples of
+    (site, partner monomer pattern index, partner site). Bond conditions in
+    `conditions` are None (unbound), ANY (bound, including to a partner in the
+    pattern) or WILD.
+    """
+    def __init__(self, cp):
+        cp = as_complex_pattern(cp)
+        if cp.compartment is not None or \
+                any(mp.compartment is not None for mp in cp.monomer_patterns):
+            raise NetworkGenerationError("Compartments are not supported")
+        self.monomers = [mp.monomer for mp in cp.monomer_patterns]
+        self.match_once = cp.match_once
+        self.conditions = []
+        self.partners = [[] for mp in cp.monomer_patterns]
+        bond_sites = collections.defaultdict(list)
+        for i, mp in enumerate(cp.monomer_patterns):
+            conditions = []
+            for site, condition in mp.site_conditions.items():
+                state, bond = _split_condition(condition)
+                if isinstance(bond, int):
+                    bond_sites[bond].append((i, site))
+                    bond = ANY
+                conditions.append((site, state, bond))
+            self.conditions.append(conditions)
+        for bond, sites in bond_sites.items():
+            if len(sites) == 2:
+                (i, site_i), (j, site_j) = sites
+                self.partners[i].append((site_i, j, site_j))
+                self.partners[j].append((site_j, i, site_i))
+            elif len(sites) > 2:
+                raise NetworkGenerationError("Bond %d appears more than "
+                                             "twice in %s" % (bond, cp))
+            # A bond with one end in the pattern is just a bound site
+
+        # Match monomer patterns in breadth-first order over bonds, so that
+        # bonded monomer patterns are located by following species bonds
+        self.order = []
+        seen = set()
+        for start in range(len(self.monomers)):
+            if start in seen:
+                continue
+            seen.add(start)
+            queue = collections.deque([(start, None)])
+            while queue:
+                i, anchor = queue.popleft()
+                self.order.append((i, anchor))
+                for site, j, site_j in self.partners[i]:
+                    if j not in seen:
+                        seen.add(j)
+                        queue.append((j, (i, site, site_j)))
+
+    def __len__(self):
+        return len(self.monomers)
+
+    def _compatible(self, i, species, m):
+        """Check monomer pattern `i` against molecule `m` of a species."""
+        if self.monomers[i].name != species.monomers[m].name:
+            return False
+        states = species.states[m]
+        bonds = species.bonds[m]
+        for site, state, bond in self.conditions[i]:
+            if state is not None and states.get(site) != state:
+                return False
+            if bond is None:
+                if site in bonds:
+                    return False
+            elif bond is ANY:
+                if site not in bonds:
+                    return False
+        return True
+
+    def embeddings(self, species):
+        """
+        Return all embeddings of the pattern into a species.
+
+        Each embedding is a tuple giving the species molecule index for each
+        monomer pattern.
+        """
+        n = len(self.monomers)
+        mapping = [None] * n
+        used = set()
+        results = []
+
+        def extend(k):
+            if k == n:
+                results.append(tuple(mapping))
+                return
+            i, anchor = self.order[k]
+            if anchor is None:
+                candidates = species.by_monomer.get(self.monomers[i].name, ())
+            else:
+                j, site_j, site_i = anchor
+                partner = species.bonds[mapping[j]].get(site_j)
+                if partner is None or partner[1] != site_i:
+                    return
+                candidates = (partner[0], )
+            for m in candidates:
+                if m in used or not self._compatible(i, species, m):
+                    continue
+                mapping[i] = m
+                if all(mapping[j] is None or
+                       species.bonds[m].get(site) == (mapping[j], site_j)
+                       for site, j, site_j in self.partners[i]):
+                    used.add(m)
+                    extend(k + 1)
+                    used.discard(m)
+                mapping[i] = None
+
+        extend(0)
+        if self.match_once:
+            return results[:1]
+        return results
+
+
+class _Species(object):
+    """
+    A species as a graph of molecules.
+
+    For each molecule, `states` maps sites to states and `bonds` maps bonded
+    sites to a (molecule index, site) tuple for the other end of the bond.
+    """
+    def __init__(self, monomers, states, bonds):
+        self.monomers = monomers
+        self.states = states
+        self.bonds = bonds
+        self.by_monomer = collections.defaultdict(list)
+        for m, monomer in enumerate(monomers):
+            self.by_monomer[monomer.name].append(m)
+
+    @classmethod
+    def from_pattern(cls, cp):
+        """Build a species from a concrete ComplexPattern."""
+        pattern = _Pattern(cp)
+        states = []
+        bonds = [{} for m in pattern.monomers]
+        for i, conditions in enumerate(pattern.conditions):
+            states.append(dict((site, state) for site, state, bond in
+                               conditions if state is not None))
+            for site, state, bond in conditions:
+                if bond is not None and \
+                        site not in [p[0] for p in pattern.partners[i]]:
+                    raise NetworkGenerationError(
+                        "Species %s is not concrete" % cp)
+            for site, j, site_j in pattern.partners[i]:
+                bonds[i][site] = (j, site_j)
+        return cls(pattern.monomers, states, bonds)
+
+    def to_pattern(self):
+        """Return the species as a ComplexPattern."""
+        bond_numbers = {}
+        mps = []
+        for m, monomer in enumerate(self.monomers):
+            site_conditions = {}
+            for site in monomer.sites:
+                state = self.states[m].get(site)
+                bond = None
+                if site in self.bonds[m]:
+                    ends = frozenset([(m, site), self.bonds[m][site]])
+                    bond = bond_numbers.setdefault(ends,
+                                                   len(bond_numbers) + 1)
+                if state is not None and bond is not None:
+                    site_conditions[site] = (state, bond)
+                elif state is not None:
+                    site_conditions[site] = state
+                else:
+                    site_conditions[site] = bond
+            mps.append(MonomerPattern(monomer, site_conditions, None))
+        return ComplexPattern(mps, None)
+
+
+class _RuleDirection(object):
+    """One direction of a rule, compiled into graph transformations."""
+    def __init__(self, rule, reactant_cps, product_cps, rate, reverse):
+        self.rule = rule
+        self.rate = rate
+        self.reverse = reverse
+        self.reactants = [_Pattern(cp) for cp in reactant_cps]
+        products = [_Pattern(cp) for cp in product_cps]
+        self.n_products = len(products)
+
+        # Global indices of the monomer patterns on each side
+        r_index = [(k, i) for k, pat in enumerate(self.reactants)
+                   for i in range(len(pat))]
+        p_index = [(k, i) for k, pat in enumerate(products)
+                   for i in range(len(pat))]
+        r_global = dict((ki, g) for g, ki in enumerate(r_index))
+        p_global = dict((ki, g) for g, ki in enumerate(p_index))
+        self.r_index = r_index
+
+        def r_pattern(g):
+            k, i = r_index[g]
+            return self.reactants[k], i
+
+        def p_pattern(g):
+            k, i = p_index[g]
+            return products[k], i
+
+        # Map each product monomer pattern to the first unmapped reactant
+        # monomer pattern of the same monomer; the rest are synthesized
+        correspondence = {}
+        mapped = set()
+        for pg in range(len(p_index)):
+            pat, i = p_pattern(pg)
+            for rg in range(len(r_index)):
+                rpat, j = r_pattern(rg)
+                if rg not in mapped and \
+                        rpat.monomers[j].name == pat.monomers[i].name:
+                    correspondence[pg] = rg
+                    mapped.add(rg)
+                    break
+        n_r = len(r_index)
+        created = [pg for pg in range(len(p_index))
+                   if pg not in correspondence]
+        # Product molecules are numbered as reactants, followed by the
+        # synthesized molecules
+        p_node = dict(correspondence)
+        for n, pg in enumerate(created):
+            p_node[pg] = n_r + n
+
+        def bond_set(patterns, global_index, node):
+            bonds = set()
+            for k, pat in enumerate(patterns):
+                for i, partners in enumerate(pat.partners):
+                    for site, j, site_j in partners:
+                        bonds.add(frozenset([
+                            (node(global_index[k, i]), site),
+                            (node(global_index[k, j]), site_j)]))
+            return bonds
+
+        r_bonds = bond_set(self.reactants, r_global, lambda g: g)
+        p_bonds = bond_set(products, p_global, p_node.__getitem__)
+
+        self.state_changes = []
+        self.breaks = [sorted(bond)[0] for bond in r_bonds - p_bonds]
+        self.forms = [tuple(sorted(bond)) for bond in p_bonds - r_bonds]
+        for pg, rg in correspondence.items():
+            pat, i = p_pattern(pg)
+            rpat, j = r_pattern(rg)
+            r_conditions = dict((site, (state, bond)) for site, state, bond in
+                                rpat.conditions[j])
+            r_partner_sites = set(p[0] for p in rpat.partners[j])
+            for site, state, bond in pat.conditions[i]:
+                r_state, r_bond = r_conditions.get(site, (None, WILD))
+                if state is not None and state != r_state:
+                    self.state_changes.append((rg, site, state))
+                # BioNetGen does not allow breaking a bond to an
+                # unspecified partner (ANY)
+                if bond is None and r_bond is ANY and \
+                        site not in r_partner_sites:
+                    raise NetworkGenerationError(
+                        "Rule %s breaks a wildcard bond on site %s" %
+                        (rule.name, site))
+
+        self.created = []
+        for pg in created:
+            pat, i = p_pattern(pg)
+            monomer = pat.monomers[i]
+            states = dict((site, state) for site, state, bond in
+                          pat.conditions[i] if state is not None)
+            for site, site_states in monomer.site_states.items():
+                if site not in states and site_states:
+                    states[site] = site_states[0]
+            self.created.append((monomer, states))
+
+        # Deleted reactant molecules: delete the whole species if an entire
+        # reactant pattern is deleted, unless delete_molecules is set
+        self.deleted_species = []
+        self.deleted_molecules = []
+        for k, pat in enumerate(self.reactants):
+            deleted = [r_global[k, i] for i in range(len(pat))
+                       if r_global[k, i] not in mapped]
+            if len(deleted) == len(pat) and not rule.delete_molecules:
+                self.deleted_species.append(k)
+            else:
+                self.deleted_molecules.extend(deleted)
+
+    def apply(self, species, embeddings):
+        """
+        Apply the rule to reactant species via the given embeddings.
+
+        Returns a list of product species and a description of the changes
+        made, or None if the rule cannot be applied. The changes are a tuple
+        of frozensets of state changes, broken bonds, formed bonds and deleted
+        molecules, in which molecules are identified by (reactant index,
+        molecule index) or ('new', index) for synthesized molecules.
+        """
+        monomers = []
+        states = []
+        bonds = []
+        offsets = []
+        for sp in species:
+            offset = len(monomers)
+            offsets.append(offset)
+            monomers.extend(sp.monomers)
+            states.extend(dict(s) for s in sp.states)
+            bonds.extend(dict((site, (m + offset, site_m)) for
+                              site, (m, site_m) in b.items())
+                         for b in sp.bonds)
+        node = [offsets[k] + embeddings[k][i] for k, i in self.r_index]
+        owner = [(k, m) for k, sp in enumerate(species)
+                 for m in range(len(sp.monomers))]
+        owner.extend(('new', c) for c in range(len(self.created)))
+
+        state_changes = []
+        broken = []
+        for rg, site, state in self.state_changes:
+            states[node[rg]][site] = state
+            state_changes.append((owner[node[rg]], site, state))
+        for rg, site in self.breaks:
+            partner = bonds[node[rg]].pop(site, None)
+            if partner is not None:
+                del bonds[partner[0]][partner[1]]
+                broken.append(frozenset([(owner[node[rg]], site),
+                                         (owner[partner[0]], partner[1])]))
+        for monomer, monomer_states in self.created:
+            node.append(len(monomers))
+            monomers.append(monomer)
+            states.append(dict(monomer_states))
+            bonds.append({})
+        for (a, site_a), (b, site_b) in self.forms:
+            m_a = node[a]
+            m_b = node[b]
+            if site_a in bonds[m_a] or site_b in bonds[m_b]:
+                return None
+            bonds[m_a][site_a] = (m_b, site_b)
+            bonds[m_b][site_b] = (m_a, site_a)
+        formed = [frozenset([(owner[node[a]], site_a),
+                             (owner[node[b]], site_b)])
+                  for (a, site_a), (b, site_b) in self.forms]
+
+        deleted = set(node[rg] for rg in self.deleted_molecules)
+        for k in self.deleted_species:
+            deleted.update(range(offsets[k],
+                                 offsets[k] + len(species[k].monomers)))
+        for m in deleted:
+            for site, (partner, site_p) in bonds[m].items():
+                if partner not in deleted:
+                    del bonds[partner][site_p]
+
+        # Split the remaining molecules into connected components
+        products = []
+        seen = set(deleted)
+        for start in range(len(monomers)):
+            if start in seen:
+                continue
+            seen.add(start)
+            component = [start]
+            for m in component:
+                for partner, site_p in bonds[m].values():
+                    if partner not in seen:
+                        seen.add(partner)
+                        component.append(partner)
+            component.sort()
+            renumber = dict((m, n) for n, m in enumerate(component))
+            products.append(_Species(
+                [monomers[m] for m in component],
+                [states[m] for m in component],
+                [dict((site, (renumber[partner], site_p)) for
+                      site, (partner, site_p) in bonds[m].items())
+                 for m in component]))
+
+        if len(products) != self.n_products and not (
+                self.deleted_molecules and self.rule.delete_molecules):
+            # The rule's product molecularity is not respected, e.g. a bond
+            # was broken within a ring or a deletion fragmented a species
+            return None
+        changes = (frozenset(state_changes), frozenset(broken),
+                   frozenset(formed), frozenset(owner[m] for m in deleted))
+        return products, changes
+
+
+def _instance_labellings(reactants):
+    """
+    Return the ways of labelling the reactant species of a reaction.
+
+    Repeated reactant species are distinct copies (instances) of the species.
+    Each labelling assigns an (species index, copy number) instance to each
+    reactant; there is one labelling per permutation of the copies of each
+    repeated species.
+    """
+    positions = collections.defaultdict(list)
+    for k, s in enumerate(reactants):
+        positions[s].append(k)
+    groups = list(positions.items())
+    labellings = []
+    for perms in itertools.product(*[itertools.permutations(range(len(ks)))
+                                     for s, ks in groups]):
+        labelling = [None] * len(reactants)
+        for (s, ks), perm in zip(groups, perms):
+            for k, copy in zip(ks, perm):
+                labelling[k] = (s, copy)
+        labellings.append(tuple(labelling))
+    return labellings
+
+
+def _permutations(reactants):
+    """Return the number of permutations of identical reactant species."""
+    count = 1
+    for s in set(reactants):
+        for n in range(2, reactants.count(s) + 1):
+            count *= n
+    return count
+
+
+def _relabel_changes(changes, labelling):
+    """Express reaction changes in terms of reactant species instances."""
+    def relabel(molecule):
+        k, m = molecule
+        return molecule if k == 'new' else (labelling[k], m)
+
+    state_changes, broken, formed, deleted = changes
+    return (frozenset((relabel(mol), site, state) for mol, site, state in
+                      state_changes),
+            frozenset(frozenset((relabel(mol), site) for mol, site in bond)
+                      for bond in broken),
+            frozenset(frozenset((relabel(mol), site) for mol, site in bond)
+                      for bond in formed),
+            frozenset(relabel(mol) for mol in deleted))
+
+
+def _rule_directions(model):
+    """Compile the rules of a model into _RuleDirection objects."""
+    directions = []
+    for rule in model.rules:
+        if rule.move_connected:
+            raise NetworkGenerationError("Compartments are not supported")
+        reactants = list(rule.reactant_pattern.complex_patterns)
+        products = list(rule.product_pattern.complex_patterns)
+        # Synthesis and degradation use the source and sink species, as in
+        # the BNGL generated for BioNetGen
+        if rule.is_synth():
+            source = as_complex_pattern(model.monomers['__source']())
+            reactants = [source]
+            products = products + [source]
+        if rule.is_deg():
+            products = [as_complex_pattern(model.monomers['__sink']())]
+        directions.append(_RuleDirection(rule, reactants, products,
+                                         rule.rate_forward, False))
+        if rule.is_reversible:
+            directions.append(_RuleDirection(rule, products, reactants,
+                                              rule.rate_reverse, True))
+    return directions
+
+
+def generate_equations(model, max_iter=100, max_agg=None, verbose=False):
+    """
+    Generate math expressions for reaction rates and species in a model.
+
+    This fills in the same pieces of the model as
+    :py:func:`pysb.bng.generate_equations` (species, odes, reactions,
+    reactions_bidirectional and the `species` and `coefficients` of each
+    observable), but expands the rules in-process rather than running
+    BioNetGen. As with that function, the equations are only regenerated if
+    the model has been structurally modified since they were last generated.
+
+    Parameters
+    ----------
+    model : Model
+        Model to generate the reaction network for.
+    max_iter : int or None, optional
+        Maximum number of rounds of rule application (default 100, as for
+        BioNetGen). Each round applies the rules to all combinations of
+        species that include a species found in the previous round. A warning
+        is issued if the network is still growing when the limit is reached.
+        None means no limit.
+    max_agg : int or None, optional
+        Maximum number of molecules in a species. Reactions which would
+        produce a larger species are discarded. None (default) means no
+        limit.
+    verbose : bool, optional
+        If True, print the size of the network after each round.
+    """
+    if not model.equations_outdated():
+        return
+    if not model.rules:
+        raise pysb.bng.NoRulesError()
+    if model.compartments:
+        raise NetworkGenerationError("Compartments are not supported")
+    if model.has_synth_deg():
+        model.enable_synth_deg()
+    if not model.initial_conditions:
+        raise pysb.bng.NoInitialConditionsError()
+    model.reset_equations()
+
+    species = []
+    species_cps = []
+    species_keys = {}
+
+    def add_species(sp, cp=None):
+        if cp is None:
+            cp = sp.to_pattern()
+        key = cp.canonical_key()
+        index = species_keys.get(key)
+        if index is None:
+            index = species_keys[key] = len(species)
+            species.append(sp)
+            species_cps.append(cp)
+        return index
+
+    for cp, value in model.initial_conditions:
+        cp = as_complex_pattern(cp)
+        add_species(_Species.from_pattern(cp), cp)
+
+    directions = _rule_directions(model)
+    # Embeddings of each reactant pattern of each rule, by species index
+    matches = [[{} for pat in rd.reactants] for rd in directions]
+    # Distinct reaction events, keyed by (rule direction, reactants,
+    # products)
+    reactions = collections.OrderedDict()
+    n_done = 0
+    iteration = 0
+    while n_done < len(species):
+        if max_iter is not None and iteration >= max_iter:
+            warn("Network generation stopped after max_iter=%d iterations "
+                 "with %d species not yet expanded" %
+                 (max_iter, len(species) - n_done))
+            break
+        iteration += 1
+        n_current = len(species)
+        for rd, rd_matches in zip(directions, matches):
+            for pat, pat_matches in zip(rd.reactants, rd_matches):
+                for s in range(n_done, n_current):
+                    embeddings = pat.embeddings(species[s])
+                    if embeddings:
+                        pat_matches[s] = embeddings
+
+        for r, (rd, rd_matches) in enumerate(zip(directions, matches)):
+            old = [sorted(s for s in m if s < n_done) for m in rd_matches]
+            new = [sorted(s for s in m if s >= n_done) for m in rd_matches]
+            every = [sorted(m) for m in rd_matches]
+            # Visit each combination of reactants including at least one new
+            # species exactly once: the first new species is at position j
+            for j in range(len(rd.reactants)):
+                pools = old[:j] + [new[j]] + every[j + 1:]
+                for reactants in itertools.product(*pools):
+                    labellings = _instance_labellings(reactants)
+                    for embeddings in itertools.product(
+                            *[rd_matches[k][s] for k, s in
+                              enumerate(reactants)]):
+                        result = rd.apply([species[s] for s in reactants],
+                                          embeddings)
+                        if result is None:
+                            continue
+                        products, changes = result
+                        if max_agg is not None and any(
+                                len(p.monomers) > max_agg for p in products):
+                            continue
+                        products = tuple(sorted(add_species(p)
+                                                for p in products))
+                        key = (r, tuple(sorted(reactants)), products)
+                        events = reactions.setdefault(key, set())
+                        for labelling in labellings:
+                            events.add(_relabel_changes(changes, labelling))
+        n_done = n_current
+        if verbose:
+            print("Iteration %d: %d species, %d reactions" %
+                  (iteration, len(species), len(reactions)))
+
+    model.species = species_cps
+    reaction_cache = {}
+    for (r, reactants, products), events in reactions.items():
+        rd = directions[r]
+        # Events were counted over labelled copies of the reactants, so
+        # divide by the permutations of identical reactant species
+        factor = sympy.Rational(len(events), _permutations(reactants))
+        combined_rate = sympy.Mul(*(
+            [sympy.Symbol('__s%d' % s) for s in reactants] + [factor] +
+            [sympy.Symbol(rd.rate.name)]))
+        pysb.bng._add_reaction(model, reaction_cache, reactants, products,
+                               combined_rate, (rd.rule.name, ),
+                               (rd.reverse, ))
+    pysb.bng._finish_reactions_bidirectional(model)
+    pysb.bng._build_odes(model, len(species))
+
+    for obs in model.observables:
+        patterns = [_Pattern(cp) for cp in
+                    obs.reaction_pattern.complex_patterns]
+        for s, sp in enumerate(species):
+            counts = [len(pat.embeddings(sp)) for pat in patterns]
+            if obs.match == 'species':
+                coefficient = 1 if any(counts) else 0
+            else:
+                coefficient = sum(counts)
+            if coefficient:
+                obs.species.append(s)
+                obs.coefficients.append(coefficient)
+
+    model._equations_revision = model.revision
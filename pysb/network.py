@@ -0,0 +1,359 @@
+"""
+Array representation of a model's reaction network.
+
+:py:class:`ReactionNetwork` compiles the reactions generated for a model
+(see :py:func:`pysb.bng.generate_equations`) into NumPy index arrays and a
+sparse stoichiometry matrix. For mass-action reactions, whose rates are a
+statistical factor times a parameter times the reactant amounts, the reaction
+rates and the ODE right-hand side can then be evaluated with vectorized
+array operations, without generating any code from the sympy equations::
+
+    from pysb.bng import generate_equations
+    from pysb.network import ReactionNetwork
+
+    generate_equations(model)
+    network = ReactionNetwork(model)
+    ydot = network.dydt(y)
+
+Reactions with other rate laws (e.g. rates given by expressions) are
+evaluated from their sympy rate expressions.
+
+"""
+
+from __future__ import division
+import collections
+import numpy as np
+import scipy.sparse
+import sympy
+import pysb.bng
+
+
+class ReactionNetwork(object):
+    """
+    Reaction network of a model as index arrays and a stoichiometry matrix.
+
+    Parameters
+    ----------
+    model : pysb.Model
+        Model whose equations have been generated (see
+        :py:func:`pysb.bng.generate_equations`).
+
+    Attributes
+    ----------
+    model : pysb.Model
+        The model.
+    n_species, n_reactions : int
+        Number of species and reactions.
+    reactants, products : numpy.ndarray of int
+        Species indices of the reactants and products of each reaction, with
+        shape (n_reactions, maximum number of reactants or products). Rows
+        are padded with the value `n_species`.
+    stoichiometry : scipy.sparse.csr_matrix
+        Net stoichiometry matrix, with shape (n_species, n_reactions).
+    mass_action : numpy.ndarray of bool
+        Whether each reaction follows mass-action kinetics with a parameter
+        as its rate constant.
+    rate_parameters : numpy.ndarray of int
+        Index in model.parameters of the rate constant of each mass-action
+        reaction, or -1 for other reactions.
+    rate_factors : numpy.ndarray of float
+        Statistical factor multiplying the rate constant of each mass-action
+        reaction (1 for other reactions).
+    """
+    def __init__(self, model):
+        if model.equations_outdated():
+            raise ValueError("The equations for model %s have not been "
+                             "generated or are out of date" % model.name)
+        self.model = model
+        self.n_species = len(model.species)
+        self._parameter_index = dict((p.name, i) for i, p in
+                                     enumerate(model.parameters))
+        netfile = model._pending_equations
+        if not (isinstance(netfile, pysb.bng._NetfileReactions) and
+                self._from_netfile(netfile)):
+            self._from_reactions(model.reactions)
+        self.n_reactions = len(self.rate_parameters)
+        self.stoichiometry = self._stoichiometry_matrix()
+        self._other_rates = None
+        self._repeats = None
+
+    def _from_netfile(self, netfile):
+        """
+        Build the arrays from reactions parsed from a BNG net file.
+
+        This avoids building the sympy equations altogether, but only works
+        if every reaction is a mass-action reaction. Returns False if not.
+        """
+        rate_constants = [self._parse_rate_term(term)
+                          for term in netfile.rate_terms]
+        if any(rc is None for rc in rate_constants):
+            return False
+        reactant_offsets = np.asarray(netfile.reactant_offsets)
+        product_offsets = np.asarray(netfile.product_offsets)
+        self.reactants = self._padded(np.asarray(netfile.reactants),
+                                      reactant_offsets)
+        self.products = self._padded(np.asarray(netfile.products),
+                                     product_offsets)
+        rate_ids = np.asarray(netfile.rate_ids, dtype=int)
+        parameters, factors = zip(*rate_constants)
+        self.rate_parameters = np.array(parameters, dtype=int)[rate_ids]
+        self.rate_factors = np.array(factors, dtype=float)[rate_ids]
+        self.mass_action = np.ones(len(rate_ids), dtype=bool)
+        self._rate_laws = None
+        return True
+
+    def _parse_rate_term(self, term):
+        """
+        Parse a net file rate term such as ``2*kf``.
+
+        Returns (parameter index, factor), or None if the term is not a
+        parameter times a number.
+        """
+        factor = 1.0
+        parameter = None
+        for token in term.split('*'):
+            if token in self._parameter_index and parameter is None:
+                parameter = self._parameter_index[token]
+            else:
+                try:
+                    factor *= float(token)
+                except ValueError:
+                    return None
+        if parameter is None:
+            return None
+        return parameter, factor
+
+    def _from_reactions(self, reactions):
+        """Build the arrays from the model's reaction dicts."""
+        reactants = [r['reactants'] for r in reactions]
+        products = [r['products'] for r in reactions]
+        self.reactants = self._padded_from_tuples(reactants)
+        self.products = self._padded_from_tuples(products)
+        self._rate_laws = [r['rate'] for r in reactions]
+        rate_constants = [self._mass_action_constant(r['rate'],
+                                                     r['reactants'])
+                          for r in reactions]
+        self.mass_action = np.array([rc is not None for rc in
+                                     rate_constants], dtype=bool)
+        self.rate_parameters = np.array(
+            [-1 if rc is None else rc[0] for rc in rate_constants], dtype=int)
+        self.rate_factors = np.array(
+            [1.0 if rc is None else rc[1] for rc in rate_constants],
+            dtype=float)
+
+    def _mass_action_constant(self, rate, reactants):
+        """
+        Return (parameter index, factor) if a rate is a mass-action rate.
+
+        Mass-action rates are the product of a number, a parameter and the
+        reactant species. Returns None for any other rate law.
+        """
+        factor, terms = rate.as_coeff_mul()
+        species = collections.Counter()
+        others = []
+        for term in terms:
+            if term.is_Number:
+                factor *= term
+                continue
+            base, exponent = term.as_base_exp()
+            if isinstance(base, sympy.Symbol) and \
+                    base.name.startswith('__s') and exponent.is_Integer and \
+                    exponent > 0:
+                species[int(base.name[3:])] += int(exponent)
+            else:
+                others.append(term)
+        if species != collections.Counter(reactants) or len(others) != 1 or \
+                not isinstance(others[0], sympy.Symbol) or \
+                others[0].name not in self._parameter_index:
+            return None
+        return self._parameter_index[others[0].name], float(factor)
+
+    def _padded(self, indices, offsets):
+        """Build a padded 2D array from flattened indices and offsets."""
+        lengths = np.diff(offsets)
+        width = lengths.max() if len(lengths) else 0
+        padded = np.full((len(lengths), width), self.n_species, dtype=int)
+        columns = np.arange(len(indices)) - np.repeat(offsets[:-1], lengths)
+        padded[np.repeat(np.arange(len(lengths)), lengths), columns] = indices
+        return padded
+
+    def _padded_from_tuples(self, index_tuples):
+        offsets = np.cumsum([0] + [len(t) for t in index_tuples])
+        indices = np.array([i for t in index_tuples for i in t], dtype=int)
+        return self._padded(indices, offsets)
+
+    def _stoichiometry_matrix(self):
+        """Return the net stoichiometry matrix as a sparse matrix."""
+        n = self.n_reactions
+        rows = np.concatenate([self.products.ravel(),
+                               self.reactants.ravel()])
+        columns = np.concatenate([
+            np.repeat(np.arange(n), self.products.shape[1]),
+            np.repeat(np.arange(n), self.reactants.shape[1])])
+        values = np.concatenate([np.ones(self.products.size),
+                                 -np.ones(self.reactants.size)])
+        # Drop the padding; duplicate entries are summed
+        keep = rows < self.n_species
+        return scipy.sparse.csr_matrix(
+            (values[keep], (rows[keep], columns[keep])),
+            shape=(self.n_species, n))
+
+    @property
+    def rate_laws(self):
+        """The sympy rate expression of each reaction."""
+        if self._rate_laws is None:
+            self._rate_laws = [r['rate'] for r in self.model.reactions]
+        return self._rate_laws
+
+    def _param_values(self, param_values):
+        if param_values is None:
+            return np.array([p.value for p in self.model.parameters])
+        return np.asarray(param_values, dtype=float)
+
+    def rate_constants(self, param_values=None):
+        """
+        Return the rate constant of each mass-action reaction.
+
+        The rate constants include the statistical factors. Entries for
+        reactions which are not mass-action reactions are NaN.
+
+        Parameters
+        ----------
+        param_values : vector-like or 2D array, optional
+            Values of the parameters, in the order of model.parameters.
+            Defaults to the parameter values in the model. A 2D array gives
+            one set of parameter values per row.
+        """
+        param_values = self._param_values(param_values)
+        k = np.full(param_values.shape[:-1] + (self.n_reactions, ), np.nan)
+        k[..., self.mass_action] = (
+            self.rate_factors[self.mass_action] *
+            param_values[..., self.rate_parameters[self.mass_action]])
+        return k
+
+    def rates(self, y, param_values=None):
+        """
+        Return the rate of each reaction.
+
+        Parameters
+        ----------
+        y : array-like
+            Species amounts, either a vector of length n_species or an array
+            with one row per time point (or simulation).
+        param_values : vector-like or 2D array, optional
+            Values of the parameters, in the order of model.parameters.
+            Defaults to the parameter values in the model. A 2D array gives
+            one set of parameter values per row of `y`.
+
+        Returns
+        -------
+        numpy.ndarray
+            Reaction rates, with shape y.shape[:-1] + (n_reactions,).
+        """
+        y = np.asarray(y, dtype=float)
+        param_values = self._param_values(param_values)
+        # Pad with a 1 so padding in the reactants array drops out
+        y_padded = np.concatenate([y, np.ones(y.shape[:-1] + (1, ))],
+                                  axis=-1)
+        v = np.prod(y_padded[..., self.reactants], axis=-1) * \
+            self.rate_constants(param_values)
+        if not self.mass_action.all():
+            other = ~self.mass_action
+            v[..., other] = np.transpose(
+                self._other_rates_function()(y.T, param_values.T))
+        return v
+
+    def propensities(self, y, param_values=None):
+        """
+        Return the stochastic propensity of each reaction.
+
+        Species amounts are interpreted as copy numbers. For mass-action
+        reactions with repeated reactants, the product of the reactant
+        amounts in the rate is replaced by the number of distinct
+        combinations of reactant molecules, e.g. x*(x-1) instead of x**2 for
+        a homodimerization (the statistical factor 1/2 is already part of the
+        rate constant). Reactions which are not mass-action reactions use
+        their rate law as the propensity.
+
+        Parameters are as for :py:meth:`rates`.
+        """
+        y = np.asarray(y, dtype=float)
+        param_values = self._param_values(param_values)
+        y_padded = np.concatenate([y, np.ones(y.shape[:-1] + (1, ))],
+                                  axis=-1)
+        combinations = y_padded[..., self.reactants] - \
+            self._repeated_reactants()
+        a = np.prod(np.maximum(combinations, 0), axis=-1) * \
+            self.rate_constants(param_values)
+        if not self.mass_action.all():
+            other = ~self.mass_action
+            a[..., other] = np.maximum(np.transpose(
+                self._other_rates_function()(y.T, param_values.T)), 0)
+        return a
+
+    def _repeated_reactants(self):
+        """
+        Return, for each reactant, how often its species occurs earlier in
+        the same reaction.
+        """
+        if self._repeats is None:
+            repeats = np.zeros(self.reactants.shape, dtype=int)
+            for j in range(1, self.reactants.shape[1]):
+                repeats[:, j] = np.sum(
+                    self.reactants[:, :j] == self.reactants[:, j:j + 1],
+                    axis=1)
+            repeats[self.reactants == self.n_species] = 0
+            self._repeats = repeats
+        return self._repeats
+
+    def _other_rates_function(self):
+        """Return a function evaluating the non-mass-action rates."""
+        if self._other_rates is None:
+            model = self.model
+            # Rate expressions may refer to observables and expressions,
+            # which are rewritten in terms of species and parameters
+            subs = _symbolic_substitutions(model)
+            rates = [_replace_symbols(self.rate_laws[i], subs) for i in
+                     np.flatnonzero(~self.mass_action)]
+            species = [sympy.Symbol('__s%d' % i)
+                       for i in range(self.n_species)]
+            parameters = [sympy.Symbol(p.name) for p in model.parameters]
+            rates = [_replace_symbols(r, dict((p.name, s) for p, s in
+                                              zip(model.parameters,
+                                                  parameters)))
+                     for r in rates]
+            fn = sympy.lambdify((species, parameters), rates, 'numpy')
+            self._other_rates = lambda y, p: np.array(
+                np.broadcast_arrays(*fn(y, p)))
+        return self._other_rates
+
+    def dydt(self, y, param_values=None):
+        """
+        Return the time derivative of each species.
+
+        Parameters are as for :py:meth:`rates`. The result has the same shape
+        as `y`.
+        """
+        v = self.rates(y, param_values)
+        return self.stoichiometry.dot(v.T).T
+
+
+def _symbolic_substitutions(model):
+    """
+    Return a dict mapping expression and observable names to equivalent
+    formulas in terms of parameters and species.
+    """
+    subs = dict((obs.name, sympy.Add(*[
+        c * sympy.Symbol('__s%d' % s) for s, c in
+        zip(obs.species, obs.coefficients)]))
+        for obs in model.observables)
+    subs.update((e.name, _replace_symbols(e.expand_expr(), subs))
+                for e in model.expressions)
+    return subs
+
+
+def _replace_symbols(expr, subs):
+    """Replace symbols in expr by name, using a dict of name => expression"""
+    return expr.replace(
+        lambda a: isinstance(a, sympy.Symbol) and a.name in subs,
+        lambda a: subs[a.name])
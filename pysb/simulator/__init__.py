@@ -1,4 +1,6 @@
 from .base import SimulatorException, SimulationResult
 from .scipyode import ScipyOdeSimulator
+from .ssa import SsaSimulator, TauLeapingSimulator
 
-__all__ = ['ScipyOdeSimulator', 'SimulationResult']
+__all__ = ['ScipyOdeSimulator', 'SsaSimulator', 'TauLeapingSimulator',
+           'SimulationResult']
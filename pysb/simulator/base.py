@@ -1,8 +1,10 @@
 from abc import ABCMeta, abstractmethod
 import numpy as np
-import itertools
+import scipy.sparse
 import sympy
 import collections
+import json
+import os
 from pysb.core import MonomerPattern, ComplexPattern, as_complex_pattern
 try:
     import pandas as pd
@@ -31,18 +33,20 @@ class Simulator(object):
         the simulation is interrupted for some reason, e.g., due to
         satisfaction
         of a logical stopping criterion (see 'tout' below).
-    initials : vector-like or dict, optional
+    initials : vector-like, 2D array or dict, optional
         Values to use for the initial condition of all species. Ordering is
         determined by the order of model.species. If not specified, initial
         conditions will be taken from model.initial_conditions (with
         initial condition parameter values taken from `param_values` if
-        specified).
-    param_values : vector-like or dict, optional
+        specified). A 2D array with one row per simulation may be supplied
+        to run a batch of simulations.
+    param_values : vector-like, 2D array or dict, optional
         Values to use for every parameter in the model. Ordering is
         determined by the order of model.parameters.
         If passed as a dictionary, keys must be parameter names.
         If not specified, parameter values will be taken directly from
-        model.parameters.
+        model.parameters. A 2D array with one row per simulation may be
+        supplied to run a batch of simulations (e.g. a parameter sweep).
     verbose : bool, optional (default: False)
         Verbose output.
 
@@ -85,6 +89,13 @@ class Simulator(object):
         self.initials = initials
         self._params = None
         self.param_values = param_values
+        self._expressions_evaluator = None
+        self._expressions_evaluator_revision = None
+        self._expression_derivatives = None
+        self._expression_derivatives_key = None
+        self._allocated_block = None
+        self._observables_matrix = None
+        self._observables_matrix_key = None
 
     @property
     def initials(self):
@@ -109,8 +120,10 @@ class Simulator(object):
                                                  'ComplexPattern' %
                                                  repr(cplx_pat))
                 self._initials = new_initials
-            # accept vector of species amounts as an argument
-            elif len(new_initials) != len(self._model.species):
+            # accept vector (or 2D array, one row per simulation) of species
+            # amounts as an argument
+            elif np.ndim(new_initials) not in (1, 2) or \
+                    np.shape(new_initials)[-1] != len(self._model.species):
                 raise ValueError("new_initials must be the same length as "
                                  "model.species")
             else:
@@ -121,14 +134,26 @@ class Simulator(object):
         """
         Returns the model's initial conditions as a list, with the order
         matching model.initial_conditions
+
+        If multiple sets of parameter values have been supplied, a 2D array
+        with one row of initial conditions per parameter set is returned.
         """
         # If we already have a list internally, just return that
         if isinstance(self._initials, np.ndarray):
             return self._initials
         # Otherwise, build the list from the model, and any overrides
         # specified in the self._initials dictionary
+        param_values = self.param_values
+        if param_values.ndim == 2:
+            return np.array([self._initials_for_params(pv)
+                             for pv in param_values])
+        return self._initials_for_params(param_values)
+
+    def _initials_for_params(self, param_vals):
+        """
+        Build the initial conditions vector for one set of parameter values
+        """
         y0 = np.zeros((len(self._model.species),))
-        param_vals = self.param_values
         subs = dict((p, param_vals[i]) for i, p in
                     enumerate(self._model.parameters))
 
@@ -192,8 +217,10 @@ class Simulator(object):
                                      "parameter name (%s)" % k)
             self._params = new_params
         else:
-            # accept vector of parameter values as an argument
-            if len(new_params) != len(self._model.parameters):
+            # accept vector (or 2D array, one row per simulation) of
+            # parameter values as an argument
+            if np.ndim(new_params) not in (1, 2) or \
+                    np.shape(new_params)[-1] != len(self._model.parameters):
                 raise ValueError("new_params must be the same length as "
                                  "model.parameters")
             if isinstance(new_params, np.ndarray):
@@ -201,6 +228,140 @@ class Simulator(object):
             else:
                 self._params = np.array(new_params)
 
+    def _run_initials_params(self):
+        """
+        Return the initial conditions and parameter values for a run
+
+        Both are returned as 2D arrays of floats with one row per
+        simulation. A single set of initial conditions or parameter values
+        is repeated to match the number of rows of the other.
+        """
+        initials = np.array(self.initials_list, dtype=float, ndmin=2)
+        param_values = np.array(self.param_values, dtype=float, ndmin=2)
+        n_sims = max(len(initials), len(param_values))
+        if len(initials) == 1:
+            initials = np.repeat(initials, n_sims, axis=0)
+        if len(param_values) == 1:
+            param_values = np.repeat(param_values, n_sims, axis=0)
+        if len(initials) != len(param_values):
+            raise SimulatorException("initials and param_values must have "
+                                     "the same number of rows")
+        return initials, param_values
+
+    def _observables_sparse_matrix(self):
+        """
+        Return a sparse matrix mapping species amounts to observable values
+
+        The matrix has one row per observable and one column per species,
+        built from each observable's `species` and `coefficients`, so the
+        observable trajectories are the product of the matrix with the
+        species trajectories. It is built once and cached until the model's
+        equations are regenerated.
+        """
+        key = (self._model.revision, len(self._model.species))
+        if self._observables_matrix is None or \
+                self._observables_matrix_key != key:
+            rows = []
+            cols = []
+            data = []
+            for i, obs in enumerate(self._model.observables):
+                rows.extend([i] * len(obs.species))
+                cols.extend(obs.species)
+                data.extend(obs.coefficients)
+            # duplicate (row, col) entries are summed
+            self._observables_matrix = scipy.sparse.csr_matrix(
+                (np.array(data, dtype=float), (rows, cols)),
+                shape=(len(self._model.observables),
+                       len(self._model.species)))
+            self._observables_matrix_key = key
+        return self._observables_matrix
+
+    def _expressions_function(self, names=None):
+        """
+        Return a function which evaluates the model's dynamic expressions
+
+        The function takes the observables followed by the parameters as
+        arguments (in model order) and returns a list with the value of each
+        dynamic expression, or of those given by name. It is generated once
+        and cached until the model is structurally modified. Arguments may
+        be numpy arrays of any mutually broadcastable shapes, so a batch of
+        simulations can be evaluated in a single call.
+        """
+        expressions = self._model.expressions_dynamic()
+        if names is not None:
+            expressions = [expressions[name] for name in names]
+            names = tuple(names)
+        key = (self._model.revision, names)
+        if self._expressions_evaluator is None or \
+                self._expressions_evaluator_revision != key:
+            exprs = [expr.expand_expr() for expr in expressions]
+            args = list(self._model.observables) + \
+                list(self._model.parameters)
+            self._expressions_evaluator = sympy.lambdify(args, exprs,
+                                                         'numpy')
+            self._expressions_evaluator_revision = key
+        return self._expressions_evaluator
+
+    def _expression_derivatives_function(self, parameter_names):
+        """
+        Return a function which evaluates the partial derivatives of the
+        model's dynamic expressions
+
+        The function takes the same arguments as the one returned by
+        :meth:`_expressions_function` and returns a list with, for each
+        dynamic expression, the list of its derivatives with respect to each
+        observable (in model order) followed by each of the named
+        parameters. It is cached until the model is structurally modified.
+        """
+        key = (self._model.revision, tuple(parameter_names))
+        if self._expression_derivatives is None or \
+                self._expression_derivatives_key != key:
+            variables = list(self._model.observables) + \
+                [self._model.parameters[name] for name in parameter_names]
+            derivatives = [[sympy.diff(expr.expand_expr(), v)
+                            for v in variables]
+                           for expr in self._model.expressions_dynamic()]
+            args = list(self._model.observables) + \
+                list(self._model.parameters)
+            self._expression_derivatives = sympy.lambdify(args, derivatives,
+                                                          'numpy')
+            self._expression_derivatives_key = key
+        return self._expression_derivatives
+
+    def _allocate_trajectories(self, n_sims, n_timepoints, path=None,
+                               save=None, keep_species=True, overwrite=False):
+        """
+        Return an array for the species trajectories of a set of simulations
+
+        The array is a view of the block of a :class:`SimulationResult`,
+        which also has room for the observables and expressions, so the
+        result can be built without copying the trajectories. With a
+        ``path``, the block is memory-mapped from a file there, so
+        trajectories are written to disk as they are simulated (see
+        :func:`_allocate_block` for ``overwrite``).
+
+        If the species aren't kept, the block itself is returned instead.
+        Assigning the trajectories of a simulation (or a slice of them) to
+        it then calculates and stores the saved observables and expressions
+        straight away, and the species are discarded.
+        """
+        block = _ResultBlock(self, [n_timepoints] * n_sims, path, save,
+                             keep_species, overwrite)
+        trajectories = block.species() if keep_species else block
+        self._allocated_block = (trajectories, block)
+        return trajectories
+
+    def _trajectory_block(self, trajectories):
+        """
+        Return the :class:`_ResultBlock` for trajectories, if they were
+        allocated by :meth:`_allocate_trajectories`, otherwise None
+        """
+        allocated = self._allocated_block
+        self._allocated_block = None
+        if allocated is not None and allocated[0] is trajectories:
+            return allocated[1]
+        return None
+
     @abstractmethod
     def run(self, tspan=None, param_values=None, initials=None):
         """Run a simulation.
@@ -210,6 +371,166 @@ class Simulator(object):
         return None
 
 
+# Number of rows of a SimulationResult's block processed at a time
+_CHUNK_ROWS = 65536
+
+
+def _output_names(model, save):
+    """
+    Return the names of the observables and dynamic expressions to save,
+    given a list of them (or their names), or None for all of them
+    """
+    obs_names = list(model.observables.keys())
+    expr_names = list(model.expressions_dynamic().keys())
+    if save is None:
+        return obs_names, expr_names
+    names = set()
+    for item in save:
+        name = getattr(item, 'name', item)
+        if name not in obs_names and name not in expr_names:
+            raise SimulatorException('"%s" is not an observable or dynamic '
+                                     'expression of the model' % name)
+        names.add(name)
+    return [name for name in obs_names if name in names], \
+        [name for name in expr_names if name in names]
+
+
+class _ResultBlock(object):
+    """
+    The block holding the trajectories of a :class:`SimulationResult`
+
+    Its columns are the species (if they are kept) followed by the saved
+    observables and dynamic expressions, with a row per time point of each
+    simulation. Assigning the species trajectories of a simulation, or a
+    slice of simulations, stores them and calculates the outputs for their
+    rows; only the observables needed for the saved outputs are calculated.
+    """
+    def __init__(self, simulator, lengths, path=None, save=None,
+                 keep_species=True, overwrite=False):
+        model = simulator._model
+        self.obs_names, self.expr_names = _output_names(model, save)
+        self.keep_species = keep_species
+        self.n_species = len(model.species)
+        self.n_kept = self.n_species if keep_species else 0
+        self.bounds = np.cumsum([0] + list(lengths))
+        self.block = _allocate_block(path, self.bounds[-1], self.n_kept +
+                                     len(self.obs_names) +
+                                     len(self.expr_names), overwrite)
+        # The observables to calculate include those used by the expressions
+        all_obs = list(model.observables.keys())
+        used = set(self.obs_names)
+        for name in self.expr_names:
+            used.update(symbol.name for symbol in
+                        model.expressions[name].expand_expr().free_symbols
+                        if symbol.name in all_obs)
+        self._obs_indices = [i for i, name in enumerate(all_obs)
+                             if name in used]
+        self._obs_matrix = simulator._observables_sparse_matrix()[
+            self._obs_indices]
+        self._saved_obs = [self._obs_indices.index(all_obs.index(name))
+                           for name in self.obs_names]
+        self._n_all_obs = len(all_obs)
+        self._expr_fn = simulator._expressions_function(self.expr_names) \
+            if self.expr_names else None
+        # one row of parameter values per simulation (stochastic simulators
+        # may run several consecutive simulations per row)
+        param_values = np.array(simulator.param_values, ndmin=2)
+        if len(param_values) != len(lengths):
+            param_values = np.repeat(param_values,
+                                     len(lengths) // len(param_values),
+                                     axis=0)
+        self.param_values = param_values
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def species(self):
+        """
+        Return the species columns as a 3D array (simulations, time points,
+        species), for simulations with the same number of time points
+        """
+        n_sims = len(self)
+        return self.block.reshape(n_sims, -1, self.block.shape[1])[
+            :, :, :self.n_species]
+
+    def __setitem__(self, index, species):
+        if isinstance(index, slice):
+            sims = range(len(self))[index]
+        else:
+            sims = [index]
+        if not len(sims):
+            return
+        rows = slice(self.bounds[sims[0]], self.bounds[sims[-1] + 1])
+        species = np.reshape(species, (-1, self.n_species))
+        if self.keep_species:
+            self.block[rows, :self.n_species] = species
+        self._calculate(rows, species)
+
+    def update(self):
+        """Calculate the outputs from the species stored in the block"""
+        for start in range(0, len(self.block), _CHUNK_ROWS):
+            rows = slice(start, min(start + _CHUNK_ROWS, len(self.block)))
+            self._calculate(rows, self.block[rows, :self.n_species])
+
+    def _calculate(self, rows, species):
+        """Calculate the outputs for rows of the block from their species"""
+        block = self.block
+        first = self.n_kept
+        n_obs = len(self.obs_names)
+        observables = self._obs_matrix.dot(species.T).T
+        block[rows, first:first + n_obs] = observables[:, self._saved_obs]
+        if self._expr_fn is not None:
+            sim_ids = np.searchsorted(self.bounds,
+                                      np.arange(rows.start, rows.stop),
+                                      side='right') - 1
+            # Observables which aren't used are left out
+            args = [0.0] * self._n_all_obs
+            for j, i in enumerate(self._obs_indices):
+                args[i] = observables[:, j]
+            args += list(self.param_values[sim_ids].T)
+            for i, value in enumerate(self._expr_fn(*args)):
+                block[rows, first + n_obs + i] = value
+
+
+_STORE_FILES = ('all.npy', 'tout.npy', 'metadata.json')
+
+
+def _allocate_block(path, n_rows, n_columns, overwrite=False):
+    """
+    Allocate the block of a :class:`SimulationResult`, in memory or as a
+    memory-mapped ``all.npy`` file in the directory ``path``
+
+    See :func:`_prepare_store` for ``overwrite``.
+    """
+    if path is None:
+        return np.ndarray((n_rows, n_columns))
+    _prepare_store(path, overwrite)
+    return np.lib.format.open_memmap(os.path.join(path, 'all.npy'),
+                                     mode='w+', dtype=float,
+                                     shape=(n_rows, n_columns))
+
+
+def _prepare_store(path, overwrite=False):
+    """
+    Create the directory for a result stored on disk, if needed
+
+    Raises ValueError if the directory already holds a stored result, unless
+    ``overwrite`` is True, in which case its files are removed first. They
+    are removed rather than truncated, so results which are still using
+    them (as memory-mapped files) keep their data.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+        return
+    existing = [os.path.join(path, name) for name in _STORE_FILES
+                if os.path.exists(os.path.join(path, name))]
+    if existing and not overwrite:
+        raise ValueError('%s already holds a stored simulation result; '
+                         'pass overwrite=True to replace it' % path)
+    for filename in existing:
+        os.remove(filename)
+
+
 class SimulationResult(object):
     """
     Results of a simulation with properties and methods to access them.
@@ -226,6 +547,15 @@ class SimulationResult(object):
 
     A list of trajectory sets contains a trajectory set for each simulation.
 
+    The species, observables and expressions are held side by side in a
+    single 2D array, with one row per time point of each simulation, and
+    the species trajectory sets, :attr:`all` and :attr:`dataframe` are
+    views of it. Species trajectories allocated by the simulator
+    (see :meth:`Simulator._allocate_trajectories`) are already part of it,
+    and other trajectories are copied into it. The observables and
+    expressions are packed record arrays, copied from the array the first
+    time they are accessed (unless they make up whole rows of it).
+
     Parameters
     ----------
     simulator : Simulator
@@ -233,6 +563,24 @@ class SimulationResult(object):
     trajectories : list or numpy.ndarray
         A set of species trajectories from a simulation. Should either be a
         list of 2D numpy arrays or a single 3D numpy array.
+    sensitivities : list or numpy.ndarray, optional
+        The sensitivities of the species to the simulator's
+        ``sensitivity_parameters``, with one 3D numpy array (time points,
+        species, parameters) per simulation.
+    path : str, optional
+        Directory in which to store the trajectories, instead of memory.
+        They are kept in a memory-mapped ``.npy`` file there, so results
+        larger than the available memory can be analysed, and the result
+        can be reopened later with :meth:`load`.
+    overwrite : bool, optional
+        Whether to replace a result already stored in ``path`` (default
+        False, in which case a ValueError is raised).
+    save : list, optional
+        The observables and dynamic expressions (or their names) to
+        calculate and keep. By default, all of them.
+    keep_species : bool, optional
+        Whether to keep the species trajectories (default True). Without
+        them, the result only holds the saved observables and expressions.
 
     Examples
     --------
@@ -301,14 +649,59 @@ class SimulationResult(object):
     8.888889   0.000138    4.995633
     13.333333  0.000002    4.999927
     """
-    def __init__(self, simulator, trajectories):
+    def __init__(self, simulator, trajectories, sensitivities=None,
+                 path=None, save=None, keep_species=True, overwrite=False):
         self.squeeze = True
         self.simulator = type(simulator).__name__
         self.tout = simulator.tout
         self._yfull = None
         self._model = simulator._model
-
-        # Validate incoming trajectories
+        lengths = [len(tout) for tout in self.tout]
+
+        # Species, observables and expressions are stored side by side in a
+        # single block, with one row per time point of each simulation
+        result_block = simulator._trajectory_block(trajectories)
+        if result_block is None:
+            self._validate_trajectories(trajectories)
+            result_block = _ResultBlock(simulator, lengths, path, save,
+                                        keep_species, overwrite)
+            if keep_species:
+                for n in range(self.nsims):
+                    result_block.block[result_block.bounds[n]:
+                                       result_block.bounds[n + 1],
+                                       :result_block.n_species] = self._y[n]
+                result_block.update()
+            else:
+                for n in range(self.nsims):
+                    result_block[n] = self._y[n]
+        elif result_block.keep_species:
+            result_block.update()
+        if len(result_block) != len(self.tout):
+            raise ValueError("Simulator tout should be the same length as "
+                             "trajectories")
+        self.nsims = len(result_block)
+        self._block = result_block.block
+        self._keep_species = result_block.keep_species
+        self._n_species = result_block.n_kept
+        self._obs_names = result_block.obs_names
+        self._expr_names = result_block.expr_names
+        self._set_views(lengths)
+        if path is not None:
+            self._save_index(path)
+
+        # sensitivities
+        self.sensitivity_parameters = None
+        self._sens = None
+        if sensitivities is not None:
+            if save is not None or not keep_species:
+                raise ValueError("Sensitivities need all the species, "
+                                 "observables and expressions")
+            self.sensitivity_parameters = simulator.sensitivity_parameters
+            self._sens = list(sensitivities)
+            self._calc_sensitivities(simulator, result_block.param_values)
+
+    def _validate_trajectories(self, trajectories):
+        """Check the species trajectories and set them as a list"""
         if hasattr(trajectories, 'ndim') and trajectories.ndim == 3:
             # trajectories is a 3D array, create a list of 2D arrays
             # This is just a view and doesn't copy the data
@@ -337,43 +730,161 @@ class SimulationResult(object):
                                  "should match length of "
                                  "model.species".format(i))
 
-        # Calculate ``yobs`` and ``yexpr`` based on values of ``y``
+    def _set_views(self, lengths):
+        """Set the trajectories of each simulation as views of the block"""
+        n_sp = self._n_species
+        n_obs = len(self._obs_names)
+        n_expr = len(self._expr_names)
+        bounds = np.cumsum([0] + list(lengths))
+        rows = [slice(bounds[n], bounds[n + 1]) for n in range(self.nsims)]
+        self._y = [self._block[r, :n_sp] for r in rows]
+        self._yobs_view = [self._block[r, n_sp:n_sp + n_obs] for r in rows]
+        self._yexpr_view = [self._block[r, n_sp + n_obs:n_sp + n_obs + n_expr]
+                            for r in rows]
+        # The observable and expression records are built when first used
+        self._yobs = None
+        self._yexpr = None
+        self._rows = rows
+
+    def _records(self, rows, names, first_column):
+        """
+        Return a packed record array of consecutive columns of the block,
+        with the given names, or a 2D float view if there are none
+
+        The records are a view if the columns make up whole rows of the
+        block, otherwise a copy.
+        """
+        block = self._block
+        columns = block[rows, first_column:first_column + len(names)]
+        if not names:
+            return columns
+        if len(names) != block.shape[1]:
+            columns = np.ascontiguousarray(columns)
+        return columns.view([(name, block.dtype) for name in names])[:, 0]
+
+    @property
+    def _column_names(self):
+        return ['__s%d' % i for i in range(self._n_species)] + \
+            self._obs_names + self._expr_names
+
+    def save(self, path, overwrite=False):
+        """
+        Save the trajectories to a directory, to be reopened with
+        :meth:`load`
+
+        The species, observables and expressions are saved side by side in
+        ``all.npy``, with one row per time point of each simulation, the
+        time points in ``tout.npy`` and the names of the species,
+        observables and expressions in ``metadata.json``. Sensitivities are
+        not saved.
+
+        Parameters
+        ----------
+        path : str
+            The directory, which is created if it doesn't exist.
+        overwrite : bool, optional
+            Whether to replace a result already stored in ``path`` (default
+            False, in which case a ValueError is raised).
+        """
+        _prepare_store(path, overwrite)
+        np.save(os.path.join(path, 'all.npy'), self._block)
+        self._save_index(path)
+
+    def _save_index(self, path):
+        """Save the time points and names of a result stored on disk"""
+        np.save(os.path.join(path, 'tout.npy'), np.concatenate(self.tout))
+        if not self._keep_species:
+            species = []
+        elif self._model is None:
+            species = self._species_names
+        else:
+            species = [str(sp) for sp in self._model.species]
+        with open(os.path.join(path, 'metadata.json'), 'w') as f:
+            json.dump({'simulator': self.simulator,
+                       'keep_species': self._keep_species,
+                       'species': species,
+                       'observables': self._obs_names,
+                       'expressions': self._expr_names,
+                       'lengths': [len(tout) for tout in self.tout]}, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reopen a result stored on disk, without simulating again
+
+        The trajectories are memory-mapped rather than read into memory.
+        The model isn't stored, so the result's ``simulator`` and species
+        are given by name.
+
+        Parameters
+        ----------
+        path : str
+            A directory written by :meth:`save`, or given as the ``path``
+            of a simulation.
+
+        Returns
+        -------
+        SimulationResult
+        """
+        with open(os.path.join(path, 'metadata.json')) as f:
+            metadata = json.load(f)
+        result = cls.__new__(cls)
+        result.squeeze = True
+        result.simulator = metadata['simulator']
+        result._model = None
+        result._yfull = None
+        result._keep_species = metadata.get('keep_species', True)
+        result._species_names = metadata['species']
+        result._n_species = len(metadata['species'])
+        # (NumPy field names can't be unicode on Python 2)
+        result._obs_names = [str(name) for name in metadata['observables']]
+        result._expr_names = [str(name) for name in
+                              metadata['expressions']]
+        result.sensitivity_parameters = None
+        result._sens = None
+        lengths = metadata['lengths']
+        result.nsims = len(lengths)
+        result.tout = np.split(np.load(os.path.join(path, 'tout.npy')),
+                               np.cumsum(lengths)[:-1])
+        result._block = np.load(os.path.join(path, 'all.npy'),
+                                mmap_mode='r')
+        result._set_views(lengths)
+        return result
+
+    def _calc_sensitivities(self, simulator, param_values):
+        """
+        Calculate the sensitivities of the observables and expressions from
+        those of the species, using the chain rule
+        """
+        n_params = len(self.sensitivity_parameters)
+        n_obs = len(self._model.observables)
         exprs = self._model.expressions_dynamic()
-        expr_names = [expr.name for expr in exprs]
-        model_obs = self._model.observables
-        obs_names = model_obs.keys()
-        yobs_dtype = zip(obs_names, itertools.repeat(float)) if obs_names \
-            else float
-        yexpr_dtype = zip(expr_names, itertools.repeat(float)) if expr_names \
-            else float
-
-        self._yobs = [np.ndarray((len(self.tout[n]),),
-                                 dtype=yobs_dtype) for n in range(self.nsims)]
-        self._yobs_view = [self._yobs[n].view(float).
-                           reshape(len(self._yobs[n]), -1) for n in range(
-            self.nsims)]
-        self._yexpr = [np.ndarray((len(self.tout[n]),),
-                                  dtype=yexpr_dtype) for n in range(
-            self.nsims)]
-        self._yexpr_view = [self._yexpr[n].view(float).reshape(len(
-            self._yexpr[n]), -1) for n in range(self.nsims)]
-        param_values = simulator.param_values
-
-        # loop over simulations
+        self._sobs = []
+        self._sexpr = []
+        obs_matrix = simulator._observables_sparse_matrix()
+        deriv_fn = None
+        if exprs:
+            deriv_fn = simulator._expression_derivatives_function(
+                self.sensitivity_parameters)
         for n in range(self.nsims):
-            # observables
-            for i, obs in enumerate(model_obs):
-                self._yobs_view[n][:, i] = (
-                    self._y[n][:, obs.species] * obs.coefficients).sum(axis=1)
-
-            # expressions
-            obs_dict = dict((k, self._yobs[n][k]) for k in obs_names)
-            subs = dict((p, param_values[i]) for i, p in
-                        enumerate(self._model.parameters))
-            for i, expr in enumerate(exprs):
-                expr_subs = expr.expand_expr().subs(subs)
-                func = sympy.lambdify(obs_names, expr_subs, "numpy")
-                self._yexpr_view[n][:, i] = func(**obs_dict)
+            n_times = len(self.tout[n])
+            s_species = self._sens[n].transpose(1, 0, 2).reshape(
+                self._sens[n].shape[1], -1)
+            sobs = obs_matrix.dot(s_species).reshape(
+                n_obs, n_times, n_params).transpose(1, 0, 2)
+            sexpr = np.zeros((n_times, len(exprs), n_params))
+            if exprs:
+                args = [self._yobs_view[n][:, i] for i in range(n_obs)] + \
+                    list(param_values[n])
+                for i, derivatives in enumerate(deriv_fn(*args)):
+                    # Derivatives which are constant in time are scalars
+                    derivatives = np.array([np.broadcast_to(d, (n_times,))
+                                            for d in derivatives]).T
+                    sexpr[:, i, :] = np.einsum(
+                        'tj,tjk->tk', derivatives[:, :n_obs], sobs) + \
+                        derivatives[:, n_obs:]
+            self._sobs.append(sobs)
+            self._sexpr.append(sexpr)
 
     def _squeeze_output(self, trajectories):
         """
@@ -393,28 +904,8 @@ class SimulationResult(object):
         a numpy.ndarray with record-style data-type for return to the user.
         """
         if self._yfull is None:
-            sp_names = ['__s%d' % i for i in range(len(self._model.species))]
-            yfull_dtype = zip(sp_names, itertools.repeat(float))
-            if len(self._model.observables):
-                yfull_dtype += zip(self._model.observables.keys(),
-                                   itertools.repeat(float))
-            if len(self._model.expressions_dynamic()):
-                yfull_dtype += zip(self._model.expressions_dynamic().keys(),
-                                   itertools.repeat(float))
-            yfull = len(self._y) * [None]
-            # loop over simulations
-            for n in range(self.nsims):
-                yfull[n] = np.ndarray(len(self.tout[n]), yfull_dtype)
-                yfull_view = yfull[n].view(float).reshape((len(yfull[n]), -1))
-                n_sp = self._y[n].shape[1]
-                n_ob = self._yobs_view[n].shape[1]
-                n_ex = self._yexpr_view[n].shape[1]
-                yfull_view[:, :n_sp] = self._y[n]
-                yfull_view[:, n_sp:n_sp + n_ob] = self._yobs_view[n]
-                yfull_view[:, n_sp + n_ob:n_sp + n_ob + n_ex] = \
-                    self._yexpr_view[n]
-            self._yfull = yfull
-
+            self._yfull = [self._records(rows, self._column_names, 0)
+                           for rows in self._rows]
         return self._squeeze_output(self._yfull)
 
     @property
@@ -426,23 +917,35 @@ class SimulationResult(object):
         """
         if pd is None:
             raise Exception('Please "pip install pandas" for this feature')
-        sim_ids = (np.repeat(range(self.nsims), [len(t) for t in self.tout]))
-        times = np.concatenate(self.tout)
+        lengths = [len(t) for t in self.tout]
+        sim_ids = np.repeat(np.arange(self.nsims), lengths)
         if self.nsims == 1 and self.squeeze:
-            idx = pd.Index(times, name='time')
+            idx = pd.Index(self.tout[0], name='time')
+        elif all(np.array_equal(t, self.tout[0]) for t in self.tout) and \
+                len(np.unique(self.tout[0])) == lengths[0]:
+            # Shared time points index each simulation's rows in turn, which
+            # saves factorizing them
+            idx = pd.MultiIndex(levels=[np.arange(self.nsims), self.tout[0]],
+                                codes=[sim_ids, np.tile(np.arange(lengths[0]),
+                                                        self.nsims)],
+                                names=['simulation', 'time'],
+                                verify_integrity=False)
         else:
-            idx = pd.MultiIndex.from_tuples(zip(sim_ids, times),
+            idx = pd.MultiIndex.from_arrays([sim_ids,
+                                             np.concatenate(self.tout)],
                                             names=['simulation', 'time'])
-        simdata = self.all
-        if not isinstance(simdata, np.ndarray):
-            simdata = np.concatenate(simdata)
-        return pd.DataFrame(simdata, index=idx)
+        # The data is the block holding all the trajectories, not a copy
+        return pd.DataFrame(self._block, index=idx,
+                            columns=self._column_names, copy=False)
 
     @property
     def species(self):
         """
         List of trajectory sets. The first dimension contains species.
         """
+        if not self._keep_species:
+            raise ValueError('Species trajectories were not kept for this '
+                             'simulation')
         return self._squeeze_output(self._y)
 
     @property
@@ -450,6 +953,10 @@ class SimulationResult(object):
         """
         List of trajectory sets. The first dimension contains observables.
         """
+        if self._yobs is None:
+            self._yobs = [self._records(rows, self._obs_names,
+                                        self._n_species)
+                          for rows in self._rows]
         return self._squeeze_output(self._yobs)
 
     @property
@@ -457,4 +964,43 @@ class SimulationResult(object):
         """
         List of trajectory sets. The first dimension contains expressions.
         """
+        if self._yexpr is None:
+            self._yexpr = [self._records(rows, self._expr_names,
+                                         self._n_species +
+                                         len(self._obs_names))
+                           for rows in self._rows]
         return self._squeeze_output(self._yexpr)
+
+    def _check_sensitivities(self):
+        if self._sens is None:
+            raise ValueError('Sensitivities were not calculated for this '
+                             'simulation')
+
+    @property
+    def species_sensitivities(self):
+        """
+        List of sensitivity arrays, one per simulation, with the partial
+        derivative of each species with respect to each of the
+        ``sensitivity_parameters`` at each time point (time points on the
+        first axis, species on the second and parameters on the third).
+        """
+        self._check_sensitivities()
+        return self._squeeze_output(self._sens)
+
+    @property
+    def observable_sensitivities(self):
+        """
+        List of sensitivity arrays, as :attr:`species_sensitivities` but for
+        the observables.
+        """
+        self._check_sensitivities()
+        return self._squeeze_output(self._sobs)
+
+    @property
+    def expression_sensitivities(self):
+        """
+        List of sensitivity arrays, as :attr:`species_sensitivities` but for
+        the dynamic expressions.
+        """
+        self._check_sensitivities()
+        return self._squeeze_output(self._sexpr)
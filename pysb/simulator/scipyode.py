@@ -1,15 +1,34 @@
-from pysb.simulator.base import Simulator, SimulatorException, SimulationResult
+from __future__ import division
+from pysb.simulator.base import Simulator, SimulatorException, \
+    SimulationResult, _prepare_store
 import scipy.integrate
+import scipy.sparse
 try:
     # weave is not available under Python 3.
     from scipy.weave import inline as weave_inline
     import scipy.weave.build_tools
 except ImportError:
     weave_inline = None
+import __future__
 import distutils
+import distutils.ccompiler
+import distutils.errors
+import distutils.sysconfig
 import pysb.bng
+from pysb.core import as_complex_pattern
+from pysb.network import ReactionNetwork, _replace_symbols, \
+    _symbolic_substitutions
+from pysb.util import get_cache_dir
 import sympy
+from sympy.printing.lambdarepr import NumPyPrinter
 import re
+import os
+import shutil
+import tempfile
+import hashlib
+import itertools
+import ctypes
+import multiprocessing
 import numpy as np
 import warnings
 
@@ -20,6 +39,135 @@ def _exec(code, locals):
     exec(code, locals)
 
 
+_CTYPES_HEADER = """#include <math.h>
+#ifdef _WIN32
+#define PYSB_EXPORT __declspec(dllexport)
+#else
+#define PYSB_EXPORT
+#endif
+"""
+
+
+class _ArrayPrinter(NumPyPrinter):
+    """
+    Print sympy expressions as NumPy code over species and parameter arrays.
+
+    Species symbols ``__s<i>`` are printed as ``y[<i>]`` and any names in
+    ``symbol_map`` (e.g. parameters) are printed as their mapped value.
+    """
+    def __init__(self, symbol_map, settings=None):
+        super(_ArrayPrinter, self).__init__(settings)
+        self._symbol_map = symbol_map
+
+    def _print_Symbol(self, expr):
+        species_match = re.match(r'__s(\d+)$', expr.name)
+        if species_match:
+            return 'y[%s]' % species_match.group(1)
+        return self._symbol_map.get(expr.name, expr.name)
+
+
+# Namespace for executing generated NumPy code (populated on first use)
+_numpy_namespace = None
+
+
+def _fill_pattern(pattern, values):
+    """Return a copy of a CSC matrix pattern holding the given values"""
+    return scipy.sparse.csc_matrix(
+        (np.array(values, dtype=float)[:pattern.nnz], pattern.indices,
+         pattern.indptr), shape=pattern.shape)
+
+
+def _python_name(model):
+    """Return the model name made safe for use as a Python identifier"""
+    return re.sub(r'\W', '_', model.name or 'model')
+
+
+def _numpy_function(name, exprs, parameters):
+    """
+    Generate a Python function evaluating a list of expressions with NumPy.
+
+    The function has the signature ``f(t, y, p)``, where ``y`` and ``p`` are
+    the species and parameter arrays, and returns a tuple with the value of
+    each expression. Common subexpressions are only evaluated once.
+    """
+    global _numpy_namespace
+    if _numpy_namespace is None:
+        # Borrow the namespace sympy.lambdify builds for NumPy, which maps
+        # printed function names to their NumPy equivalents
+        _numpy_namespace = sympy.lambdify([], 0, 'numpy').__globals__
+    printer = _ArrayPrinter(dict((p.name, 'p[%d]' % i)
+                                 for i, p in enumerate(parameters)))
+    replacements, reduced_exprs = sympy.cse(
+        exprs, symbols=sympy.numbered_symbols('__cse'))
+    code = ['def %s(t, y, p):' % name]
+    code += ['    %s = %s' % (sym, printer.doprint(expr))
+             for sym, expr in replacements]
+    code.append('    return (%s)' % ''.join(printer.doprint(expr) + ', '
+                                          for expr in reduced_exprs))
+    code_obj = compile('\n'.join(code), '<%s>' % name, 'exec',
+                       __future__.division.compiler_flag, True)
+    namespace = dict(_numpy_namespace)
+    _exec(code_obj, namespace)
+    return namespace[name]
+
+
+def _ctypes_library(source, verbose=False):
+    """
+    Compile C source code into a shared library and load it with ctypes.
+
+    Libraries are cached in the ``ctypes`` subdirectory of the PySB cache
+    directory under a name derived from a hash of the source code, so each
+    distinct piece of code is only ever compiled once.
+    """
+    compiler = distutils.ccompiler.new_compiler(verbose=verbose)
+    distutils.sysconfig.customize_compiler(compiler)
+    lib_name = 'pysb_%s' % hashlib.sha1(source.encode('utf-8')).hexdigest()
+    cache_dir = get_cache_dir('ctypes')
+    lib_filename = os.path.join(cache_dir, compiler.library_filename(
+        lib_name, lib_type='shared'))
+    if not os.path.exists(lib_filename):
+        build_dir = tempfile.mkdtemp(prefix='build_', dir=cache_dir)
+        try:
+            src_filename = os.path.join(build_dir, lib_name + '.c')
+            with open(src_filename, 'w') as src_file:
+                src_file.write(source)
+            objects = compiler.compile([src_filename], output_dir=build_dir,
+                                       extra_preargs=['-O2'] if
+                                       compiler.compiler_type == 'unix'
+                                       else None)
+            tmp_lib_filename = os.path.join(build_dir,
+                                            os.path.basename(lib_filename))
+            compiler.link_shared_object(objects, tmp_lib_filename)
+            # Rename is atomic, so concurrent processes compiling the same
+            # code can't see a partially written library
+            os.rename(tmp_lib_filename, lib_filename)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+    return ctypes.CDLL(lib_filename)
+
+
+# Simulator used by each worker process when running simulations in a process
+# pool (see ScipyOdeSimulator.run)
+_pool_simulator = None
+
+
+def _pool_initializer(model, tspan, kwargs):
+    """Set up a worker process' simulator, compiling the model once"""
+    global _pool_simulator
+    _pool_simulator = ScipyOdeSimulator(model, tspan=tspan, **kwargs)
+
+
+def _pool_integrate(args):
+    """Run one simulation in a worker process"""
+    n, y0, param_values = args
+    if _pool_simulator.integrator == 'solve_ivp':
+        return n, _pool_simulator._solve_ivp(y0, param_values)
+    trajectory = np.ndarray((len(_pool_simulator.tspan),
+                             len(_pool_simulator._model.species)))
+    _pool_simulator._integrate(y0, param_values, trajectory)
+    return n, trajectory
+
+
 class ScipyOdeSimulator(Simulator):
     """
     Simulate a model using SciPy ODE integration
@@ -40,18 +188,20 @@ class ScipyOdeSimulator(Simulator):
         the time range. Returned trajectories are sampled at every value unless
         the simulation is interrupted for some reason, e.g., due to
         satisfaction of a logical stopping criterion (see 'tout' below).
-    initials : vector-like or dict, optional
+    initials : vector-like, 2D array or dict, optional
         Values to use for the initial condition of all species. Ordering is
         determined by the order of model.species. If not specified, initial
         conditions will be taken from model.initial_conditions (with
         initial condition parameter values taken from `param_values` if
-        specified).
-    param_values : vector-like or dict, optional
+        specified). A 2D array with one row per simulation may be supplied
+        to run a batch of simulations.
+    param_values : vector-like, 2D array or dict, optional
         Values to use for every parameter in the model. Ordering is
         determined by the order of model.parameters.
         If passed as a dictionary, keys must be parameter names.
         If not specified, parameter values will be taken directly from
-        model.parameters.
+        model.parameters. A 2D array with one row per simulation may be
+        supplied to run a batch of simulations (e.g. a parameter sweep).
     verbose : bool, optional (default: False)
         Verbose output.
     **kwargs : dict
@@ -60,10 +210,54 @@ class ScipyOdeSimulator(Simulator):
         * ``integrator``: Choice of integrator, including ``vode`` (default),
           ``zvode``, ``lsoda``, ``dopri5`` and ``dop853``. See
           :func:`scipy.integrate.ode` for further information.
+          ``solve_ivp`` integrates each simulation in a single call to
+          :func:`scipy.integrate.solve_ivp` (SciPy 1.0 or later), which
+          supports events and dense output.
         * ``integrator_options``: A dictionary of keyword arguments to
-          supply to the integrator. See :func:`scipy.integrate.ode`.
+          supply to the integrator. See :func:`scipy.integrate.ode`. For
+          ``solve_ivp``, these are passed to
+          :func:`scipy.integrate.solve_ivp`, e.g. ``method`` (default
+          ``LSODA``; ``BDF`` and ``Radau`` make use of the sparse
+          Jacobian), ``t_eval`` (the time points to record, by default
+          ``tspan``; None records every solver step) and ``dense_output``
+          (if True, the continuous solution of each simulation of the last
+          run is kept in the ``ode_solutions`` attribute).
+        * ``events``: List of events to track during the integration, for
+          the ``solve_ivp`` integrator only. An event is either a tuple
+          ``(name, threshold)``, which stops the simulation when the
+          observable or expression ``name`` crosses ``threshold``, or a
+          function ``event(t, y, p)`` of time, species amounts and
+          parameter values, with optional ``terminal`` and ``direction``
+          attributes as described for :func:`scipy.integrate.solve_ivp`.
+          A simulation stopped by a terminal event ends at the event, so
+          its ``tout`` is shorter than ``tspan``.
+        * ``sensitivities``: True, or a list of parameters (or their
+          names), to calculate the forward sensitivities of the species,
+          observables and expressions with respect to all or the listed
+          parameters, for the ``solve_ivp`` integrator only (its method then
+          defaults to ``BDF``). The ODEs are augmented with the sensitivity
+          equations, derived symbolically, and the sensitivities are
+          returned in the :class:`SimulationResult` (see
+          :attr:`SimulationResult.species_sensitivities`).
+        * ``use_analytic_jacobian``: Boolean, whether to supply the
+          integrator with a Jacobian derived symbolically from the ODEs
+          (default False). Only its nonzero entries are derived and
+          evaluated (see :attr:`jac_sparsity`), and a banded Jacobian is
+          passed to the ``lsoda``, ``vode`` and ``zvode`` integrators in
+          banded form.
         * ``cleanup``: Boolean, `cleanup` argument used for
           :func:`pysb.bng.generate_equations` call
+        * ``compiler``: Backend used to evaluate the ODE right-hand side and
+          Jacobian. ``weave`` uses :func:`scipy.weave.inline` (Python 2
+          only), ``ctypes`` compiles the equations into a shared library
+          with the system C compiler, ``lambdify`` evaluates them with a
+          single generated NumPy function (with common subexpressions
+          eliminated), ``network`` evaluates the reaction rates with
+          vectorized array operations on the reaction network (see
+          :class:`pysb.network.ReactionNetwork`), which avoids generating
+          any code for mass-action models, and ``python`` executes the
+          equations statement by statement as Python code. If not specified,
+          the fastest backend available is chosen.
 
     Notes
     -----
@@ -109,9 +303,17 @@ class ScipyOdeSimulator(Simulator):
         },
         'lsoda': {
             'mxstep': 2**31-1,
-        }
+        },
+        'solve_ivp': {
+            'method': 'LSODA',
+            'rtol': 1e-6,
+            'atol': 1e-12,
+        },
     }
 
+    _supported_compilers = ('weave', 'ctypes', 'lambdify', 'network',
+                            'python')
+
     def __init__(self, model, tspan=None, initials=None, param_values=None,
                  verbose=False, **kwargs):
         super(ScipyOdeSimulator, self).__init__(model,
@@ -123,141 +325,61 @@ class ScipyOdeSimulator(Simulator):
         # We'll need to know if we're using the Jacobian when we get to run()
         self._use_analytic_jacobian = kwargs.get('use_analytic_jacobian',
                                                  False)
+        # Keep our options for creating simulators in worker processes
+        self._init_kwargs = kwargs
         self.cleanup = kwargs.get('cleanup', True)
         integrator = kwargs.get('integrator', 'vode')
+        compiler = kwargs.get('compiler', None)
+        self._compiler_autoselected = compiler is None
+        if compiler is None:
+            compiler = self._autoselect_compiler()
+        elif compiler not in self._supported_compilers:
+            raise SimulatorException('Unknown compiler "%s", must be one of '
+                                     '%s' % (compiler,
+                                             self._supported_compilers))
+        elif compiler == 'weave' and weave_inline is None:
+            raise SimulatorException('weave is not available on this system')
+        self._compiler = compiler
         # Generate the equations for the model
         pysb.bng.generate_equations(self._model, self.cleanup, self.verbose)
 
-        def _eqn_substitutions(eqns):
-            """String substitutions on the sympy C code for the ODE RHS and
-            Jacobian functions to use appropriate terms for variables and
-            parameters."""
-            # Substitute expanded parameter formulas for any named expressions
-            for e in self._model.expressions:
-                eqns = re.sub(r'\b(%s)\b' % e.name, '(' + sympy.ccode(
-                    e.expand_expr()) + ')', eqns)
-
-            # Substitute sums of observable species that could've been added
-            # by expressions
-            for obs in self._model.observables:
-                obs_string = ''
-                for i in range(len(obs.coefficients)):
-                    if i > 0:
-                        obs_string += "+"
-                    if obs.coefficients[i] > 1:
-                        obs_string += str(obs.coefficients[i]) + "*"
-                    obs_string += "__s" + str(obs.species[i])
-                if len(obs.coefficients) > 1:
-                    obs_string = '(' + obs_string + ')'
-                eqns = re.sub(r'\b(%s)\b' % obs.name, obs_string, eqns)
-
-            # Substitute 'y[i]' for 'si'
-            eqns = re.sub(r'\b__s(\d+)\b',
-                          lambda m: 'y[%s]' % (int(m.group(1))),
-                          eqns)
-
-            # Substitute 'p[i]' for any named parameters
-            for i, p in enumerate(self._model.parameters):
-                eqns = re.sub(r'\b(%s)\b' % p.name, 'p[%d]' % i, eqns)
-            return eqns
-
-        # ODE RHS -----------------------------------------------
-        # Prepare the string representations of the RHS equations
-        code_eqs = '\n'.join(['ydot[%d] = %s;' %
-                              (i, sympy.ccode(self._model.odes[i]))
-                              for i in range(len(self._model.odes))])
-        code_eqs = _eqn_substitutions(code_eqs)
-
-        self._test_inline()
-
-        # If we can't use weave.inline to run the C code, compile it as
-        # Python code instead for use with
-        # exec. Note: C code with array indexing, basic math operations,
-        # and pow() just happens to also
-        # be valid Python.  If the equations ever have more complex things
-        # in them, this might fail.
-        if not self._use_inline:
-            code_eqs_py = compile(code_eqs, '<%s odes>' % self._model.name,
-                                  'exec')
-        else:
-            for arr_name in ('ydot', 'y', 'p'):
-                macro = arr_name.upper() + '1'
-                code_eqs = re.sub(r'\b%s\[(\d+)\]' % arr_name,
-                                  '%s(\\1)' % macro, code_eqs)
-
-        def rhs(t, y, p):
-            ydot = self.ydot
-            # note that the evaluated code sets ydot as a side effect
-            if self._use_inline:
-                weave_inline(code_eqs, ['ydot', 't', 'y', 'p'])
-            else:
-                _exec(code_eqs_py, locals())
-            return ydot
-
         # JACOBIAN -----------------------------------------------
-        # We'll keep the code for putting together the matrix in Sympy
-        # in case we want to do manipulations of the matrix later (e.g., to
-        # put together the sensitivity matrix)
-        jac_fn = None
+        # The Jacobian of a reaction network is very sparse, so each ODE is
+        # only differentiated with respect to the species it depends on, and
+        # the values are held in a sparse matrix whose data array is
+        # updated in place by the backend's Jacobian function
+        jac_entries = None
         if self._use_analytic_jacobian:
-            species_names = ['__s%d' % i for i in
-                             range(len(self._model.species))]
-            jac_matrix = []
-            # Rows of jac_matrix are by equation f_i:
-            # [[df1/x1, df1/x2, ..., df1/xn],
-            #  [   ...                     ],
-            #  [dfn/x1, dfn/x2, ..., dfn/xn],
-            for eqn in self._model.odes:
-                # Derivatives for f_i...
-                jac_row = []
-                for species_name in species_names:
-                    # ... with respect to s_j
-                    d = sympy.diff(eqn, species_name)
-                    jac_row.append(d)
-                jac_matrix.append(jac_row)
-
-            # Next, prepare the stringified Jacobian equations
-            jac_eqs_list = []
-            for i, row in enumerate(jac_matrix):
-                for j, entry in enumerate(row):
-                    # Skip zero entries in the Jacobian
-                    if entry == 0:
-                        continue
-                    jac_eq_str = 'jac[%d, %d] = %s;' % (
-                    i, j, sympy.ccode(entry))
-                    jac_eqs_list.append(jac_eq_str)
-            jac_eqs = _eqn_substitutions('\n'.join(jac_eqs_list))
-
-            # Try to inline the Jacobian if possible (as above for RHS)
-            if not self._use_inline:
-                jac_eqs_py = compile(jac_eqs,
-                                     '<%s jacobian>' % self._model.name, 'exec')
-            else:
-                # Substitute array refs with calls to the JAC1 macro for inline
-                jac_eqs = re.sub(r'\bjac\[(\d+), (\d+)\]',
-                                 r'JAC2(\1, \2)', jac_eqs)
-                # Substitute calls to the Y1 and P1 macros
-                for arr_name in ('y', 'p'):
-                    macro = arr_name.upper() + '1'
-                    jac_eqs = re.sub(r'\b%s\[(\d+)\]' % arr_name,
-                                     '%s(\\1)' % macro, jac_eqs)
-
-            def jacobian(t, y, p):
-                jac = self.jac
-                # note that the evaluated code sets jac as a side effect
-                if self._use_inline:
-                    weave_inline(jac_eqs, ['jac', 't', 'y', 'p']);
-                else:
-                    _exec(jac_eqs_py, locals())
-                return jac
+            jac_entries = self._jac_entries()
+            self.jac = self._csc_pattern([(i, j) for i, j, _ in jac_entries])
+            self._jac_sparsity = self.jac.copy()
+            self._jac_sparsity.data[:] = 1
 
-            # Initialize the jacobian argument to None if we're not going to
-            #  use it
-            # jac = self.jac as defined in jacobian() earlier
-            # Initialization of matrix for storing the Jacobian
-            self.jac = np.zeros(
-                (len(self._model.odes), len(self._model.species)))
-            jac_fn = jacobian
+        if self._compiler == 'lambdify':
+            rhs, jac_fn = self._lambdify_functions(jac_entries)
+        elif self._compiler == 'network':
+            rhs, jac_fn = self._network_functions(jac_entries)
+        else:
+            # The remaining backends all work from the sympy C code
+            code_eqs = self._code_eqs()
+            jac_eqs = None
+            if jac_entries is not None:
+                jac_eqs = self._jac_eqs(jac_entries)
+            if self._compiler == 'ctypes':
+                try:
+                    rhs, jac_fn = self._ctypes_functions(code_eqs, jac_eqs)
+                except (distutils.errors.CompileError,
+                        distutils.errors.LinkError, OSError) as e:
+                    if not self._compiler_autoselected:
+                        raise
+                    warnings.warn('Compiling the model with a C compiler '
+                                  'failed, falling back to lambdify: %s' % e)
+                    self._compiler = 'lambdify'
+                    rhs, jac_fn = self._lambdify_functions(jac_entries)
+            elif self._compiler == 'weave':
+                rhs, jac_fn = self._weave_functions(code_eqs, jac_eqs)
+            else:
+                rhs, jac_fn = self._python_functions(code_eqs, jac_eqs)
 
         # build integrator options list from our defaults and any kwargs
         # passed to this function
@@ -270,6 +392,19 @@ class ScipyOdeSimulator(Simulator):
         # defaults
         self.opts = options
         self.ydot = np.ndarray(len(self._model.species))
+        self.sensitivity_parameters = None
+        self._sensitivity_fns = None
+        self._adjoint_fns = None
+        sensitivities = kwargs.get('sensitivities', False)
+        if sensitivities is not False and sensitivities is not None:
+            if integrator != 'solve_ivp':
+                raise SimulatorException('Sensitivities are only supported '
+                                         'by the solve_ivp integrator')
+            if 'method' not in kwargs.get('integrator_options', {}):
+                options['method'] = 'BDF'
+            self._setup_sensitivities(sensitivities, jac_entries)
+        if jac_fn is not None:
+            jac_fn = self._solver_jacobian(jac_fn, integrator, options)
 
         # Integrator
         if integrator == 'lsoda':
@@ -287,6 +422,18 @@ class ScipyOdeSimulator(Simulator):
                 self.jac_fn = None
             else:
                 self.jac_fn = lambda t, y, p: jac_fn(y, t, p)
+        elif integrator == 'solve_ivp':
+            if not hasattr(scipy.integrate, 'solve_ivp'):
+                raise SimulatorException('The solve_ivp integrator requires '
+                                         'SciPy 1.0 or later')
+            self.integrator = integrator
+            self.func = rhs
+            self.jac_fn = jac_fn
+            if jac_fn is None and options.get('method') in ('BDF', 'Radau') \
+                    and 'jac_sparsity' not in options:
+                # Finite difference Jacobians need far fewer evaluations
+                # when the solver knows which entries are nonzero
+                options['jac_sparsity'] = self.jac_sparsity
         else:
             # The scipy.integrate.ode integrators on the other hand are object
             # oriented and hold the functions and such internally. Once we set
@@ -296,6 +443,139 @@ class ScipyOdeSimulator(Simulator):
             with warnings.catch_warnings():
                 warnings.filterwarnings('error', 'No integrator name match')
                 self.integrator.set_integrator(integrator, **options)
+        self._events = self._compile_events(kwargs.get('events', []))
+        if self._events and integrator != 'solve_ivp':
+            raise SimulatorException('Events are only supported by the '
+                                     'solve_ivp integrator')
+        self.ode_solutions = None
+
+    def _setup_sensitivities(self, parameters, jac_entries):
+        """
+        Generate the functions evaluating the terms of the forward
+        sensitivity equations, dS/dt = J S + df/dp, for the given
+        parameters (True for all of them).
+        """
+        model_parameters = self._model.parameters
+        if parameters is True:
+            parameters = list(model_parameters)
+        names = [getattr(p, 'name', p) for p in parameters]
+        for name in names:
+            if name not in model_parameters.keys():
+                raise SimulatorException('Unknown sensitivity parameter "%s"'
+                                         % name)
+        self.sensitivity_parameters = names
+        self._sensitivity_fns = self._derivative_functions(names,
+                                                           jac_entries)
+
+    def _derivative_functions(self, parameter_names, jac_entries=None):
+        """
+        Generate functions evaluating the Jacobian of the ODEs and their
+        partial derivatives with respect to the given parameters.
+
+        Returns a tuple of the Jacobian's CSC pattern, the function giving
+        its data, the rows and columns of the nonzero partial derivatives
+        and the function giving their values.
+        """
+        model_parameters = self._model.parameters
+        if jac_entries is None:
+            jac_entries = self._jac_entries()
+        jac_pattern = self._csc_pattern([(i, j) for i, j, _ in jac_entries])
+        dfdp_entries = self._parameter_derivative_entries(parameter_names)
+        name = _python_name(self._model)
+        jac_fn = _numpy_function('%s_sens_jacobian' % name,
+                                 [e for _, _, e in jac_entries] or [0],
+                                 model_parameters)
+        dfdp_fn = _numpy_function('%s_sens_dfdp' % name,
+                                  [e for _, _, e in dfdp_entries] or [0],
+                                  model_parameters)
+        return (jac_pattern, jac_fn,
+                np.array([i for i, _, _ in dfdp_entries], dtype=int),
+                np.array([k for _, k, _ in dfdp_entries], dtype=int),
+                dfdp_fn)
+
+    def _parameter_derivative_entries(self, parameter_names):
+        """
+        Return the nonzero partial derivatives of the ODEs with respect to
+        the given parameters, as a list of (ODE index, index in
+        parameter_names, sympy expression).
+        """
+        subs = _symbolic_substitutions(self._model)
+        # Refer to the parameters by plain symbols, so each one is a single
+        # free symbol
+        subs.update((p.name, sympy.Symbol(p.name))
+                    for p in self._model.parameters)
+        index = dict((name, k) for k, name in enumerate(parameter_names))
+        entries = []
+        for i, ode in enumerate(self._model.odes):
+            ode = _replace_symbols(_replace_symbols(sympy.sympify(ode), subs),
+                                   subs)
+            for symbol in ode.free_symbols:
+                if symbol.name in index:
+                    derivative = sympy.diff(ode, symbol)
+                    if derivative != 0:
+                        entries.append((i, index[symbol.name], derivative))
+        return entries
+
+    def _initial_sensitivities(self, param_values, parameter_names):
+        """
+        Return the derivatives of the initial species amounts with respect
+        to the given parameters, with shape (n_species, n_parameters).
+        """
+        model = self._model
+        s0 = np.zeros((len(model.species), len(parameter_names)))
+        if isinstance(self._initials, np.ndarray):
+            # Initial amounts given explicitly don't depend on parameters
+            return s0
+        index = dict((name, k) for k, name in enumerate(parameter_names))
+        subs = dict((p, param_values[i]) for i, p in
+                    enumerate(model.parameters))
+        sources = list(model.initial_conditions)
+        if isinstance(self._initials, dict):
+            sources = list(self._initials.items()) + sources
+        seen = set()
+        for cp, value_obj in sources:
+            si = model.get_species_index(as_complex_pattern(cp))
+            # Overrides take precedence over the model's initial conditions
+            if si in seen:
+                continue
+            seen.add(si)
+            if isinstance(value_obj, (int, float)):
+                continue
+            elif value_obj in model.parameters:
+                if value_obj.name in index:
+                    s0[si, index[value_obj.name]] = 1
+            elif value_obj in model.expressions:
+                expr = value_obj.expand_expr()
+                for symbol in expr.free_symbols:
+                    if symbol.name in index:
+                        s0[si, index[symbol.name]] = float(
+                            sympy.diff(expr, symbol).evalf(subs=subs))
+        return s0
+
+    def _compile_events(self, events):
+        """
+        Return a list of (function(t, y, p), terminal, direction) for the
+        events given in the constructor.
+        """
+        compiled = []
+        subs = None
+        for event in events:
+            if callable(event):
+                compiled.append((event, getattr(event, 'terminal', False),
+                                 getattr(event, 'direction', 0)))
+                continue
+            name, threshold = event
+            if subs is None:
+                subs = _symbolic_substitutions(self._model)
+            if name not in subs:
+                raise SimulatorException('Event refers to unknown observable '
+                                         'or expression "%s"' % name)
+            value_fn = _numpy_function('%s_event' % _python_name(self._model),
+                                       [subs[name] - threshold],
+                                       self._model.parameters)
+            compiled.append((lambda t, y, p, value_fn=value_fn:
+                             value_fn(t, y, p)[0], True, 0))
+        return compiled
 
     @classmethod
     def _test_inline(cls):
@@ -310,7 +590,358 @@ class ScipyOdeSimulator(Simulator):
                     distutils.errors.CompileError, ImportError):
                 pass
 
-    def run(self, tspan=None, param_values=None, initials=None):
+    @classmethod
+    def _test_ctypes(cls):
+        """Detect whether a C compiler is available for the ctypes backend."""
+        if not hasattr(cls, '_use_ctypes'):
+            cls._use_ctypes = False
+            try:
+                _ctypes_library('int pysb_test(void) { return 0; }')
+                cls._use_ctypes = True
+            except (distutils.errors.CompileError,
+                    distutils.errors.LinkError,
+                    distutils.errors.DistutilsPlatformError, OSError):
+                pass
+
+    @classmethod
+    def _autoselect_compiler(cls):
+        """Return the fastest compiler backend available on this system."""
+        cls._test_inline()
+        if cls._use_inline:
+            return 'weave'
+        cls._test_ctypes()
+        if cls._use_ctypes:
+            return 'ctypes'
+        return 'lambdify'
+
+    def _eqn_substitutions(self, eqns):
+        """String substitutions on the sympy C code for the ODE RHS and
+        Jacobian functions to use appropriate terms for variables and
+        parameters."""
+        # Substitute expanded parameter formulas for any named expressions
+        for e in self._model.expressions:
+            eqns = re.sub(r'\b(%s)\b' % e.name, '(' + sympy.ccode(
+                e.expand_expr()) + ')', eqns)
+
+        # Substitute sums of observable species that could've been added
+        # by expressions
+        for obs in self._model.observables:
+            obs_string = ''
+            for i in range(len(obs.coefficients)):
+                if i > 0:
+                    obs_string += "+"
+                if obs.coefficients[i] > 1:
+                    obs_string += str(obs.coefficients[i]) + "*"
+                obs_string += "__s" + str(obs.species[i])
+            if len(obs.coefficients) > 1:
+                obs_string = '(' + obs_string + ')'
+            eqns = re.sub(r'\b(%s)\b' % obs.name, obs_string, eqns)
+
+        # Substitute 'y[i]' for 'si'
+        eqns = re.sub(r'\b__s(\d+)\b',
+                      lambda m: 'y[%s]' % (int(m.group(1))),
+                      eqns)
+
+        # Substitute 'p[i]' for any named parameters
+        for i, p in enumerate(self._model.parameters):
+            eqns = re.sub(r'\b(%s)\b' % p.name, 'p[%d]' % i, eqns)
+        return eqns
+
+    def _code_eqs(self):
+        """Return C code statements setting ydot from the model ODEs."""
+        code_eqs = '\n'.join(['ydot[%d] = %s;' %
+                              (i, sympy.ccode(self._model.odes[i]))
+                              for i in range(len(self._model.odes))])
+        return self._eqn_substitutions(code_eqs)
+
+    def _jac_species_symbols(self):
+        """
+        Yield (ODE index, species index, species symbol, expanded ODE) for
+        each species on which an ODE depends.
+
+        Expressions and observables are expanded first, so dependencies via
+        them are included.
+        """
+        subs = _symbolic_substitutions(self._model)
+        for i, ode in enumerate(self._model.odes):
+            ode = _replace_symbols(sympy.sympify(ode), subs)
+            for symbol in ode.free_symbols:
+                species_match = re.match(r'__s(\d+)$', symbol.name)
+                if species_match:
+                    yield i, int(species_match.group(1)), symbol, ode
+
+    def _jac_entries(self):
+        """
+        Return the nonzero entries of the analytic Jacobian as a list of
+        (row, column, sympy expression), in compressed sparse column order.
+        """
+        entries = []
+        for i, j, symbol, ode in self._jac_species_symbols():
+            derivative = sympy.diff(ode, symbol)
+            if derivative != 0:
+                entries.append((i, j, derivative))
+        entries.sort(key=lambda entry: (entry[1], entry[0]))
+        return entries
+
+    def _csc_pattern(self, positions):
+        """
+        Return a zero-valued CSC matrix with entries at the given (row,
+        column) positions, which must be in compressed sparse column order.
+        """
+        n_species = len(self._model.species)
+        rows = np.array([i for i, _ in positions], dtype=np.int32)
+        cols = np.array([j for _, j in positions], dtype=np.int32)
+        indptr = np.searchsorted(cols, np.arange(n_species + 1)).astype(
+            np.int32)
+        return scipy.sparse.csc_matrix(
+            (np.zeros(len(positions)), rows, indptr),
+            shape=(len(self._model.odes), n_species))
+
+    @property
+    def jac_sparsity(self):
+        """
+        Sparsity pattern of the Jacobian of the ODEs
+
+        A :class:`scipy.sparse.csc_matrix` with a one wherever an ODE (row)
+        depends on a species (column), e.g. for the ``jac_sparsity`` option
+        of :func:`scipy.integrate.solve_ivp`. It is available whether or not
+        the analytic Jacobian is used.
+        """
+        if getattr(self, '_jac_sparsity', None) is None:
+            positions = sorted(set((i, j) for i, j, _, _ in
+                                   self._jac_species_symbols()),
+                               key=lambda position: (position[1],
+                                                     position[0]))
+            self._jac_sparsity = self._csc_pattern(positions)
+            self._jac_sparsity.data[:] = 1
+        return self._jac_sparsity
+
+    def _solver_jacobian(self, jac_fn, integrator, options):
+        """
+        Wrap a function computing the Jacobian values (self.jac.data) into
+        the Jacobian function expected by the integrator.
+
+        The integrators only accept dense or banded matrices. If the
+        Jacobian is banded, and much narrower than the full matrix, the
+        integrator is set up to use banded matrices (unless the band limits
+        were given as integrator options), otherwise a dense matrix is used.
+        """
+        jac = self.jac
+        if integrator == 'solve_ivp':
+            if options.get('method') in ('BDF', 'Radau'):
+                # These solvers work with sparse matrices directly
+                def sparse_jacobian(t, y, p):
+                    return scipy.sparse.csc_matrix(
+                        (jac_fn(t, y, p).copy(), jac.indices, jac.indptr),
+                        shape=jac.shape)
+                return sparse_jacobian
+            elif options.get('method') != 'LSODA':
+                # Explicit methods don't use a Jacobian
+                return None
+            integrator = 'solve_ivp_lsoda'
+        rows = jac.indices
+        cols = np.repeat(np.arange(jac.shape[1]), np.diff(jac.indptr))
+        band_options = {'lsoda': ('ml', 'mu'),
+                        'vode': ('lband', 'uband'),
+                        'zvode': ('lband', 'uband'),
+                        'solve_ivp_lsoda': ('lband', 'uband')}.get(integrator)
+        if band_options is not None and (band_options[0] in options or
+                                         band_options[1] in options):
+            lower = options.get(band_options[0]) or 0
+            upper = options.get(band_options[1]) or 0
+        elif band_options is not None:
+            lower = max(0, np.max(rows - cols)) if len(rows) else 0
+            upper = max(0, np.max(cols - rows)) if len(rows) else 0
+            if lower + upper + 1 > jac.shape[1] // 2:
+                band_options = None
+            else:
+                options[band_options[0]] = lower
+                options[band_options[1]] = upper
+        if band_options is None:
+            dense = np.zeros(jac.shape)
+
+            def jacobian(t, y, p):
+                dense[rows, cols] = jac_fn(t, y, p)
+                return dense
+        else:
+            # Banded storage: packed[i - j + upper, j] = jac[i, j]
+            packed = np.zeros((lower + upper + 1, jac.shape[1]))
+            in_band = (rows - cols <= lower) & (cols - rows <= upper)
+            packed_rows = (rows - cols + upper)[in_band]
+            packed_cols = cols[in_band]
+
+            def jacobian(t, y, p):
+                packed[packed_rows, packed_cols] = jac_fn(t, y, p)[in_band]
+                return packed
+        return jacobian
+
+    def _jac_eqs(self, jac_entries):
+        """
+        Return C code statements setting the values of the nonzero
+        Jacobian entries, i.e. the data array of the sparse Jacobian.
+        """
+        jac_eqs_list = ['jac[%d] = %s;' % (k, sympy.ccode(entry))
+                        for k, (_, _, entry) in enumerate(jac_entries)]
+        return self._eqn_substitutions('\n'.join(jac_eqs_list))
+
+    def _weave_functions(self, code_eqs, jac_eqs):
+        """Build RHS and Jacobian functions which use weave.inline."""
+        for arr_name in ('ydot', 'y', 'p'):
+            macro = arr_name.upper() + '1'
+            code_eqs = re.sub(r'\b%s\[(\d+)\]' % arr_name,
+                              '%s(\\1)' % macro, code_eqs)
+
+        def rhs(t, y, p):
+            ydot = self.ydot
+            # note that the evaluated code sets ydot as a side effect
+            weave_inline(code_eqs, ['ydot', 't', 'y', 'p'])
+            return ydot
+
+        if jac_eqs is None:
+            return rhs, None
+
+        # Substitute calls to the JAC1, Y1 and P1 macros
+        for arr_name in ('jac', 'y', 'p'):
+            macro = arr_name.upper() + '1'
+            jac_eqs = re.sub(r'\b%s\[(\d+)\]' % arr_name,
+                             '%s(\\1)' % macro, jac_eqs)
+
+        def jacobian(t, y, p):
+            jac = self.jac.data
+            # note that the evaluated code sets jac as a side effect
+            weave_inline(jac_eqs, ['jac', 't', 'y', 'p'])
+            return jac
+
+        return rhs, jacobian
+
+    def _ctypes_functions(self, code_eqs, jac_eqs):
+        """
+        Build RHS and Jacobian functions from a compiled shared library.
+
+        The C code is compiled once and cached on disk (see
+        :func:`pysb.util.get_cache_dir`), keyed by a hash of its source, so
+        subsequent simulators for the same model just load the library.
+        """
+        source = [_CTYPES_HEADER,
+                  'PYSB_EXPORT void rhs(double t, const double *y, '
+                  'const double *p, double *ydot)\n{\n%s\n}\n' % code_eqs]
+        if jac_eqs is not None:
+            source.append('PYSB_EXPORT void jacobian(double t, '
+                          'const double *y, const double *p, double *jac)'
+                          '\n{\n%s\n}\n' % jac_eqs)
+        library = _ctypes_library('\n'.join(source), verbose=self.verbose)
+
+        array_arg = np.ctypeslib.ndpointer(dtype=np.float64,
+                                           flags='C_CONTIGUOUS')
+        arg_types = [ctypes.c_double, array_arg, array_arg, array_arg]
+        c_rhs = library.rhs
+        c_rhs.argtypes = arg_types
+        c_rhs.restype = None
+
+        def rhs(t, y, p):
+            ydot = self.ydot
+            c_rhs(t, y, p, ydot)
+            return ydot
+
+        if jac_eqs is None:
+            return rhs, None
+
+        c_jacobian = library.jacobian
+        c_jacobian.argtypes = arg_types
+        c_jacobian.restype = None
+
+        def jacobian(t, y, p):
+            jac = self.jac.data
+            c_jacobian(t, y, p, jac)
+            return jac
+
+        return rhs, jacobian
+
+    def _lambdify_functions(self, jac_entries):
+        """
+        Build RHS and Jacobian functions from generated NumPy code.
+
+        All equations are evaluated by a single generated function taking the
+        species and parameter arrays as arguments, with common subexpressions
+        shared via sympy.cse.
+        """
+        subs = _symbolic_substitutions(self._model)
+        odes = [_replace_symbols(ode, subs) for ode in self._model.odes]
+        rhs_fn = _numpy_function('%s_odes' % _python_name(self._model),
+                                 odes, self._model.parameters)
+
+        def rhs(t, y, p):
+            ydot = self.ydot
+            ydot[:] = rhs_fn(t, y, p)
+            return ydot
+
+        if jac_entries is None:
+            return rhs, None
+
+        if not jac_entries:
+            # Jacobian is identically zero
+            return rhs, lambda t, y, p: self.jac.data
+        jac_fn = _numpy_function('%s_jacobian' % _python_name(self._model),
+                                 [entry for _, _, entry in jac_entries],
+                                 self._model.parameters)
+
+        def jacobian(t, y, p):
+            jac = self.jac.data
+            jac[:] = jac_fn(t, y, p)
+            return jac
+
+        return rhs, jacobian
+
+    def _network_functions(self, jac_entries):
+        """
+        Build an RHS function which evaluates the reaction network arrays.
+
+        The Jacobian, if requested, is evaluated with generated NumPy code as
+        for the ``lambdify`` backend.
+        """
+        network = ReactionNetwork(self._model)
+
+        def rhs(t, y, p):
+            ydot = self.ydot
+            ydot[:] = network.dydt(y, p)
+            return ydot
+
+        jac_fn = None
+        if jac_entries is not None:
+            jac_fn = self._lambdify_functions(jac_entries)[1]
+        return rhs, jac_fn
+
+    def _python_functions(self, code_eqs, jac_eqs):
+        """Build RHS and Jacobian functions which exec the equations."""
+        # Note: C code with array indexing, basic math operations, and pow()
+        # just happens to also be valid Python. If the equations ever have
+        # more complex things in them, this might fail.
+        code_eqs_py = compile(code_eqs, '<%s odes>' % self._model.name,
+                              'exec')
+
+        def rhs(t, y, p):
+            ydot = self.ydot
+            # note that the evaluated code sets ydot as a side effect
+            _exec(code_eqs_py, locals())
+            return ydot
+
+        if jac_eqs is None:
+            return rhs, None
+
+        jac_eqs_py = compile(jac_eqs, '<%s jacobian>' % self._model.name,
+                             'exec')
+
+        def jacobian(t, y, p):
+            jac = self.jac.data
+            # note that the evaluated code sets jac as a side effect
+            _exec(jac_eqs_py, locals())
+            return jac
+
+        return rhs, jacobian
+
+    def run(self, tspan=None, param_values=None, initials=None,
+            num_processors=1, path=None, save=None, keep_species=True,
+            overwrite=False):
         """
         Run a simulation and returns the result (trajectories)
 
@@ -323,7 +954,31 @@ class ScipyOdeSimulator(Simulator):
         tspan
         param_values
         initials
-            See parameter definitions in :class:`ScipyOdeSimulator`.
+            See parameter definitions in :class:`ScipyOdeSimulator`. If
+            ``param_values`` and/or ``initials`` are 2D arrays, one
+            simulation is run for each row.
+        num_processors : int, optional
+            Number of worker processes over which to spread the simulations
+            when more than one is being run. Each worker compiles the model
+            once and then runs its share of the simulations. Default is 1,
+            i.e. run everything in the current process.
+        path : str, optional
+            Directory in which to store the trajectories as they are
+            simulated, instead of memory (see :class:`SimulationResult`).
+            With the ``solve_ivp`` integrator, they are stored once all the
+            simulations have finished.
+        save : list, optional
+            The observables and dynamic expressions (or their names) to
+            calculate and keep. By default, all of them.
+        keep_species : bool, optional
+            Whether to keep the species trajectories (default True). If
+            not, each simulation is reduced to the saved observables and
+            expressions as soon as it finishes (or, with the ``solve_ivp``
+            integrator, once all of them have finished), so large ensembles
+            only need memory for the outputs of interest.
+        overwrite : bool, optional
+            Whether to replace a result already stored in ``path`` (default
+            False, in which case a ValueError is raised).
 
         Returns
         -------
@@ -334,21 +989,377 @@ class ScipyOdeSimulator(Simulator):
         if self.tspan is None:
             raise SimulatorException("tspan must be defined before "
                                      "simulation can run")
-        trajectories = np.ndarray((1, len(self.tspan),
-                                  len(self._model.species)))
         if param_values is not None:
             self.param_values = param_values
         if initials is not None:
             self.initials = initials
-        y0 = self.initials_list
-        param_values = self.param_values
+        initials, param_values = self._run_initials_params()
+        n_sims = len(param_values)
+        if self.integrator == 'solve_ivp':
+            if path is not None:
+                # Check the path before running the simulations
+                _prepare_store(path, overwrite)
+            # Collects (tout, trajectory, dense output, sensitivities) for
+            # each simulation, since they may end at different times
+            trajectories = [None] * n_sims
+        else:
+            trajectories = self._allocate_trajectories(
+                n_sims, len(self.tspan), path, save, keep_species, overwrite)
+        if num_processors > 1 and n_sims > 1:
+            self._integrate_pool(initials, param_values, trajectories,
+                                 num_processors)
+        else:
+            for n in range(n_sims):
+                if self.verbose and n_sims > 1:
+                    print("Simulation %d of %d" % (n + 1, n_sims))
+                if self.integrator == 'solve_ivp':
+                    trajectories[n] = self._solve_ivp(initials[n],
+                                                      param_values[n])
+                elif keep_species:
+                    self._integrate(initials[n], param_values[n],
+                                    trajectories[n])
+                else:
+                    trajectory = np.zeros((len(self.tspan),
+                                           len(self._model.species)))
+                    self._integrate(initials[n], param_values[n], trajectory)
+                    trajectories[n] = trajectory
+        sensitivities = None
+        if self.integrator == 'solve_ivp':
+            self.tout, trajectories, self.ode_solutions, sensitivities = \
+                [list(a) for a in zip(*trajectories)]
+            if self._sensitivity_fns is None:
+                sensitivities = None
+        else:
+            self.tout = [self.tspan] * n_sims
+        return SimulationResult(self, trajectories,
+                                sensitivities=sensitivities, path=path,
+                                save=save, keep_species=keep_species,
+                                overwrite=overwrite)
+
+    def gradient(self, loss, tspan=None, param_values=None, initials=None):
+        """
+        Calculate a loss over the observables and its gradient with respect
+        to the model parameters, using the adjoint method
+
+        The ODEs are solved forward, keeping their dense output, and then
+        the adjoint equations are solved backward from the last time point,
+        so the gradient with respect to all the parameters costs about as
+        much as two simulations. The adjoint equations use the symbolic
+        Jacobian and partial derivatives of the ODEs with respect to the
+        parameters. Only the ``solve_ivp`` integrator is supported.
+
+        .. note::
+            As for :func:`run`, ``tspan``, ``param_values`` and ``initials``
+            values supplied to this method will persist to future calls.
+
+        Parameters
+        ----------
+        loss : callable
+            Function taking the observables of a simulation, as a record
+            array like :attr:`SimulationResult.observables`, and returning
+            a tuple of the value of the loss and its derivatives with
+            respect to the observables at each time point. The derivatives
+            may be a record array like the observables or a 2D array with
+            the time points on the first axis and the observables on the
+            second.
+        tspan
+        param_values
+        initials
+            See parameter definitions in :class:`ScipyOdeSimulator`. If
+            ``param_values`` and/or ``initials`` are 2D arrays, the loss
+            and gradient are calculated for each row.
+
+        Returns
+        -------
+        tuple
+            The loss and its gradient, an array with the derivative with
+            respect to each of ``model.parameters``. For several
+            simulations, arrays with one loss or gradient per simulation.
+
+        Examples
+        --------
+        Calculate the sum of squared differences between an observable and
+        some data, and its gradient:
+
+        >>> from pysb.examples.expression_observables import model
+        >>> from pysb.simulator import ScipyOdeSimulator
+        >>> import numpy as np
+        >>> tspan = np.linspace(0, 40, 10)
+        >>> data = np.exp(-tspan)
+        >>> def sum_of_squares(observables):
+        ...     residuals = observables['Bax_c0'] - data
+        ...     derivatives = np.zeros_like(observables)
+        ...     derivatives['Bax_c0'] = 2 * residuals
+        ...     return np.sum(residuals ** 2), derivatives
+        >>> sim = ScipyOdeSimulator(model, tspan=tspan,
+        ...                         integrator='solve_ivp')
+        >>> loss, gradient = sim.gradient(sum_of_squares)
+        >>> len(gradient) == len(model.parameters)
+        True
+        """
+        if self.integrator != 'solve_ivp':
+            raise SimulatorException('Gradients are only supported by the '
+                                     'solve_ivp integrator')
+        if tspan is not None:
+            self.tspan = tspan
+        if self.tspan is None:
+            raise SimulatorException("tspan must be defined before "
+                                     "simulation can run")
+        if param_values is not None:
+            self.param_values = param_values
+        if initials is not None:
+            self.initials = initials
+        initials, param_values = self._run_initials_params()
+        if self._adjoint_fns is None:
+            self._adjoint_fns = self._derivative_functions(
+                self._model.parameters.keys())
+        results = [self._adjoint_gradient(loss, initials[n], param_values[n])
+                   for n in range(len(param_values))]
+        if len(results) == 1:
+            return results[0]
+        losses, gradients = zip(*results)
+        return np.array(losses), np.array(gradients)
+
+    def _adjoint_gradient(self, loss, y0, param_values):
+        """
+        Calculate the loss and its gradient for one simulation
+        """
+        jac_pattern, jac_fn, dfdp_rows, dfdp_cols, dfdp_fn = \
+            self._adjoint_fns
+        n_species = len(y0)
+        n_params = len(param_values)
+        tspan = np.asarray(self.tspan, dtype=float)
+        options = dict(self.opts)
+        options.pop('t_eval', None)
+        options['dense_output'] = True
+        if self.jac_fn is not None:
+            options['jac'] = lambda t, y: self.jac_fn(t, y, param_values)
+        forward = scipy.integrate.solve_ivp(
+            lambda t, y: self.func(t, y, param_values).copy(),
+            (tspan[0], tspan[-1]), y0, t_eval=tspan, **options)
+        if not forward.success:
+            raise SimulatorException('Integration failed: %s' %
+                                     forward.message)
+
+        # Derivatives of the loss with respect to the species
+        obs_matrix = self._observables_sparse_matrix()
+        obs_names = self._model.observables.keys()
+        observables = np.ndarray(len(tspan), dtype=list(zip(
+            obs_names, itertools.repeat(float))))
+        observables.view(float).reshape(len(tspan), -1)[:] = \
+            obs_matrix.dot(forward.y).T
+        value, dloss = loss(observables)
+        dloss = np.asarray(dloss)
+        if dloss.dtype.names:
+            dloss = dloss.view(float).reshape(len(tspan), -1)
+        dloss = obs_matrix.T.dot(np.asarray(dloss, dtype=float).T).T
+
+        # The adjoint equations are linear, with the negated transpose of
+        # the Jacobian as their matrix
+        jac_rows = jac_pattern.indices
+        jac_cols = np.repeat(np.arange(n_species), np.diff(jac_pattern.indptr))
+        n_jac = len(jac_rows)
+        method = options.get('method')
+
+        def jac_values(t):
+            return np.array(jac_fn(t, forward.sol(t), param_values),
+                            dtype=float)[:n_jac]
+
+        def adjoint_rhs(t, adjoint):
+            return -np.bincount(jac_cols, jac_values(t) * adjoint[jac_rows],
+                                minlength=n_species)
+
+        def adjoint_jac(t, adjoint):
+            if method == 'LSODA':
+                matrix = np.zeros((n_species, n_species))
+                matrix[jac_cols, jac_rows] = -jac_values(t)
+                return matrix
+            return scipy.sparse.csc_matrix(
+                (-jac_values(t), (jac_cols, jac_rows)),
+                shape=(n_species, n_species))
+
+        # The implicit methods are given the adjoint's Jacobian instead
+        options.pop('jac_sparsity', None)
+        options.pop('jac', None)
+        if method in ('BDF', 'Radau', 'LSODA'):
+            options['jac'] = adjoint_jac
+
+        # The gradient is the integral of the adjoint's product with the
+        # partial derivatives with respect to the parameters, which is
+        # calculated by Gauss-Legendre quadrature over each step of the
+        # adjoint solution rather than as part of the stiff system
+        nodes, weights = np.polynomial.legendre.leggauss(3)
+        adjoint = dloss[-1]
+        gradient = np.zeros(n_params)
+        for i in range(len(tspan) - 1, 0, -1):
+            backward = scipy.integrate.solve_ivp(
+                adjoint_rhs, (tspan[i], tspan[i - 1]), adjoint, **options)
+            if not backward.success:
+                raise SimulatorException('Adjoint integration failed: %s' %
+                                         backward.message)
+            if len(dfdp_rows):
+                start, end = backward.t[:-1], backward.t[1:]
+                t = np.ravel((start + end) / 2 +
+                             np.outer(nodes, end - start) / 2)
+                step_weights = np.ravel(np.outer(weights, start - end) / 2)
+                dfdp = np.array([np.broadcast_to(value, t.shape) for value
+                                 in dfdp_fn(t, forward.sol(t), param_values)])
+                gradient += np.bincount(
+                    dfdp_cols, np.dot(dfdp * backward.sol(t)[dfdp_rows],
+                                      step_weights), minlength=n_params)
+            adjoint = backward.y[:, -1] + dloss[i - 1]
+        return value, gradient + self._initial_sensitivities(
+            param_values, self._model.parameters.keys()).T.dot(adjoint)
+
+    def _integrate_pool(self, initials, param_values, trajectories,
+                        num_processors):
+        """
+        Run a batch of simulations in a pool of worker processes, storing
+        the results in the 3D array ``trajectories``.
+        """
+        n_sims = len(trajectories)
+        kwargs = dict(self._init_kwargs)
+        # Workers should use the same backend we ended up with, without
+        # repeating the auto-selection process
+        kwargs['compiler'] = self._compiler
+        pool = multiprocessing.Pool(num_processors,
+                                    initializer=_pool_initializer,
+                                    initargs=(self._model, self.tspan,
+                                              kwargs))
+        try:
+            chunksize = max(1, n_sims // (num_processors * 4))
+            jobs = ((n, initials[n], param_values[n]) for n in range(n_sims))
+            for n, trajectory in pool.imap_unordered(_pool_integrate, jobs,
+                                                     chunksize):
+                trajectories[n] = trajectory
+                if self.verbose:
+                    print("Finished simulation %d of %d" % (n + 1, n_sims))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _solve_ivp(self, y0, param_values):
+        """
+        Integrate the model for a single set of initial conditions and
+        parameter values with :func:`scipy.integrate.solve_ivp`.
+
+        Returns the output time points, the trajectory, the dense output
+        (None unless requested with the ``dense_output`` option) and the
+        species sensitivities (None unless requested).
+        """
+        options = dict(self.opts)
+        t_eval = options.pop('t_eval', self.tspan)
+        n_species = len(y0)
+        if self._sensitivity_fns is None:
+            # The RHS function fills and returns the same array on every
+            # call, but the solvers keep derivatives from earlier steps
+            fun = lambda t, y: self.func(t, y, param_values).copy()
+            jac = None
+            if self.jac_fn is not None:
+                jac = lambda t, y: self.jac_fn(t, y, param_values)
+        else:
+            fun, jac = self._sensitivity_system(param_values, options)
+            y0 = np.concatenate([y0, self._initial_sensitivities(
+                param_values, self.sensitivity_parameters).T.ravel()])
+        events = []
+        for event_fn, terminal, direction in self._events:
+            event = (lambda t, y, event_fn=event_fn:
+                     event_fn(t, y[:n_species], param_values))
+            event.terminal = terminal
+            event.direction = direction
+            events.append(event)
+        if jac is not None:
+            # Only the implicit methods accept a Jacobian
+            options['jac'] = jac
+        sol = scipy.integrate.solve_ivp(
+            fun, (self.tspan[0], self.tspan[-1]), y0, t_eval=t_eval,
+            events=events or None, **options)
+        if sol.status < 0:
+            warnings.warn('Integration failed at t=%g: %s' %
+                          (sol.t[-1] if len(sol.t) else self.tspan[0],
+                           sol.message))
+        tout = sol.t
+        trajectory = sol.y.T
+        if sol.status == 1:
+            # Terminated by an event; record the state at the event, unless
+            # the solver's steps are being recorded and it's already there
+            t_event = max(t_events[-1] for t_events in sol.t_events
+                          if len(t_events))
+            if not len(tout) or tout[-1] < t_event:
+                # y_events is only available from SciPy 1.4
+                y_events = getattr(sol, 'y_events', None)
+                if y_events is not None:
+                    y_event = [y[-1] for t_events, y in
+                               zip(sol.t_events, y_events)
+                               if len(t_events) and t_events[-1] == t_event]
+                    y_event = y_event[0]
+                elif sol.sol is not None:
+                    y_event = sol.sol(t_event)
+                else:
+                    y_event = None
+                if y_event is not None:
+                    tout = np.append(tout, t_event)
+                    trajectory = np.vstack([trajectory, y_event])
+        sensitivities = None
+        if self._sensitivity_fns is not None:
+            # The state holds the sensitivities to each parameter in turn
+            sensitivities = trajectory[:, n_species:].reshape(
+                len(tout), -1, n_species).transpose(0, 2, 1)
+            trajectory = trajectory[:, :n_species]
+        return tout, trajectory, sol.sol, sensitivities
+
+    def _sensitivity_system(self, param_values, options):
+        """
+        Return the RHS and Jacobian functions of the ODEs augmented with the
+        forward sensitivity equations, for solve_ivp.
+
+        The augmented state is the species amounts followed by their
+        sensitivities to each parameter in turn. The Jacobian, only
+        supplied to the BDF and Radau methods, approximates that of the
+        augmented system by its block diagonal (as in the simultaneous
+        corrector method of CVODES), leaving out the derivatives of the
+        sensitivity equations with respect to the species.
+        """
+        jac_pattern, jac_fn, dfdp_rows, dfdp_cols, dfdp_fn = \
+            self._sensitivity_fns
+        n_species = jac_pattern.shape[0]
+        n_params = len(self.sensitivity_parameters)
+
+        def jacobian_matrix(t, y):
+            return _fill_pattern(jac_pattern, jac_fn(t, y, param_values))
+
+        def fun(t, z):
+            y = z[:n_species]
+            s = z[n_species:].reshape(n_params, n_species).T
+            ds = jacobian_matrix(t, y).dot(s)
+            if len(dfdp_rows):
+                ds[dfdp_rows, dfdp_cols] += dfdp_fn(t, y, param_values)
+            return np.concatenate([self.func(t, y, param_values),
+                                   ds.T.ravel()])
+
+        jac = None
+        if options.get('method') in ('BDF', 'Radau'):
+            def jac(t, z):
+                return scipy.sparse.block_diag(
+                    [jacobian_matrix(t, z[:n_species])] * (n_params + 1),
+                    format='csc')
+        return fun, jac
+
+    def _integrate(self, y0, param_values, trajectory):
+        """
+        Integrate the model for a single set of initial conditions and
+        parameter values, storing the result in the 2D array ``trajectory``.
+        """
         if self.integrator == 'lsoda':
-            trajectories[0] = scipy.integrate.odeint(self.func,
-                                                y0,
-                                                self.tspan,
-                                                Dfun=self.jac_fn,
-                                                args=(param_values,),
-                                                **self.opts)
+            trajectory[:] = scipy.integrate.odeint(self.func,
+                                                   y0,
+                                                   self.tspan,
+                                                   Dfun=self.jac_fn,
+                                                   args=(param_values,),
+                                                   **self.opts)
         else:
             # perform the actual integration
             self.integrator.set_initial_value(y0, self.tspan[0])
@@ -357,7 +1368,7 @@ class ScipyOdeSimulator(Simulator):
             self.integrator.set_f_params(param_values)
             if self._use_analytic_jacobian:
                 self.integrator.set_jac_params(param_values)
-            trajectories[0][0] = y0
+            trajectory[0] = y0
             i = 1
             if self.verbose:
                 print("Integrating...")
@@ -366,11 +1377,9 @@ class ScipyOdeSimulator(Simulator):
                 print("\t%g" % self.integrator.t)
             while self.integrator.successful() and self.integrator.t < \
                     self.tspan[-1]:
-                trajectories[0][i] = self.integrator.integrate(self.tspan[i])
+                trajectory[i] = self.integrator.integrate(self.tspan[i])
                 i += 1
                 if self.verbose: print("\t%g" % self.integrator.t)
             if self.verbose: print("...Done.")
             if self.integrator.t < self.tspan[-1]:
-                trajectories[0, i:, :] = 'nan'
-        self.tout = [self.tspan, ]
-        return SimulationResult(self, trajectories)
+                trajectory[i:, :] = 'nan'
@@ -0,0 +1,453 @@
+from pysb.simulator.base import Simulator, SimulatorException, \
+    SimulationResult, _CHUNK_ROWS
+import pysb.bng
+from pysb.network import ReactionNetwork
+import numpy as np
+import scipy.sparse
+
+
+class SsaSimulator(Simulator):
+    """
+    Simulate a model stochastically with Gillespie's direct method
+
+    The model's reaction network is generated once and compiled into a
+    :class:`pysb.network.ReactionNetwork`; the simulation itself runs
+    in-process, without calling BioNetGen. All simulations of a batch
+    (every row of ``initials``/``param_values`` times ``n_runs``) are
+    advanced together, one reaction event per simulation per step, so
+    propensities, waiting times and reaction choices are computed with array
+    operations over the whole batch.
+
+    Species amounts are copy numbers, and initial amounts are rounded to the
+    nearest integer. See :meth:`pysb.network.ReactionNetwork.propensities`
+    for how propensities are derived from the rate laws.
+
+    .. warning::
+        The interface for this class is considered experimental and may
+        change without warning as PySB is updated.
+
+    Parameters
+    ----------
+    model : pysb.Model
+        Model to simulate.
+    tspan : vector-like, optional
+        Time values at which the state of each simulation is sampled. The
+        first and last values define the time range.
+    initials : vector-like, 2D array or dict, optional
+        Values to use for the initial condition of all species. See
+        :class:`pysb.simulator.ScipyOdeSimulator`.
+    param_values : vector-like, 2D array or dict, optional
+        Values to use for every parameter in the model. See
+        :class:`pysb.simulator.ScipyOdeSimulator`.
+    verbose : bool, optional (default: False)
+        Verbose output.
+    **kwargs : dict
+        Extra keyword arguments, including:
+
+        * ``seed``: Seed for the random number generator, for reproducible
+          simulations.
+        * ``cleanup``: Boolean, `cleanup` argument used for
+          :func:`pysb.bng.generate_equations` call
+
+    Examples
+    --------
+    Run 100 realisations of a model and average an observable over them:
+
+    >>> from pysb.examples.robertson import model
+    >>> import numpy as np
+    >>> sim = SsaSimulator(model, tspan=np.linspace(0, 40, 10), seed=1)
+    >>> result = sim.run(n_runs=100)
+    >>> len(result.observables)
+    100
+    """
+    def __init__(self, model, tspan=None, initials=None, param_values=None,
+                 verbose=False, **kwargs):
+        super(SsaSimulator, self).__init__(model,
+                                           tspan=tspan,
+                                           initials=initials,
+                                           param_values=param_values,
+                                           verbose=verbose,
+                                           **kwargs)
+        self.cleanup = kwargs.get('cleanup', True)
+        pysb.bng.generate_equations(self._model, self.cleanup, self.verbose)
+        self._network = ReactionNetwork(self._model)
+        self._random_state = np.random.RandomState(kwargs.get('seed'))
+
+    def run(self, tspan=None, param_values=None, initials=None, n_runs=1,
+            path=None, save=None, keep_species=True, overwrite=False):
+        """
+        Run stochastic simulations and return the result (trajectories)
+
+        .. note::
+            ``tspan``, ``param_values`` and ``initials`` values supplied to
+            this method will persist to future :func:`run` calls.
+
+        Parameters
+        ----------
+        tspan
+        param_values
+        initials
+            See parameter definitions in :class:`SsaSimulator`. If
+            ``param_values`` and/or ``initials`` are 2D arrays, simulations
+            are run for each row.
+        n_runs : int, optional
+            Number of independent simulations to run for each set of initial
+            conditions and parameter values (default 1). The simulations for
+            one row are consecutive in the result.
+        path : str, optional
+            Directory in which to store the trajectories as they are
+            simulated, instead of memory (see :class:`SimulationResult`).
+        save : list, optional
+            The observables and dynamic expressions (or their names) to
+            calculate and keep. By default, all of them.
+        keep_species : bool, optional
+            Whether to keep the species trajectories (default True). If
+            not, the simulations are run in batches, each of which is
+            reduced to the saved observables and expressions before the
+            next one starts, so large ensembles only need memory for the
+            outputs of interest.
+        overwrite : bool, optional
+            Whether to replace a result already stored in ``path`` (default
+            False, in which case a ValueError is raised).
+
+        Returns
+        -------
+        A :class:`SimulationResult` object
+        """
+        if tspan is not None:
+            self.tspan = tspan
+        if self.tspan is None:
+            raise SimulatorException("tspan must be defined before "
+                                     "simulation can run")
+        if param_values is not None:
+            self.param_values = param_values
+        if initials is not None:
+            self.initials = initials
+        if n_runs < 1:
+            raise SimulatorException("n_runs must be at least 1")
+        initials, param_values = self._run_initials_params()
+        initials = np.repeat(np.round(initials), n_runs, axis=0)
+        param_values = np.repeat(param_values, n_runs, axis=0)
+        tspan = np.asarray(self.tspan, dtype=float)
+        trajectories = self._allocate_trajectories(
+            len(initials), len(tspan), path, save, keep_species, overwrite)
+        if keep_species:
+            self._simulate(tspan, initials, param_values, trajectories)
+        else:
+            batch = max(1, _CHUNK_ROWS // len(tspan))
+            for start in range(0, len(initials), batch):
+                end = min(start + batch, len(initials))
+                trajectories[start:end] = self._simulate(
+                    tspan, initials[start:end], param_values[start:end],
+                    np.zeros((end - start, len(tspan), initials.shape[1])))
+        self.tout = [self.tspan] * len(initials)
+        return SimulationResult(self, trajectories, path=path, save=save,
+                                keep_species=keep_species,
+                                overwrite=overwrite)
+
+    def _simulate(self, tspan, initials, param_values, trajectories):
+        """
+        Simulate a batch with Gillespie's direct method.
+
+        Records the species amounts at each time point in ``trajectories``,
+        a 3D array with shape (n_sims, len(tspan), n_species), and returns
+        it.
+        """
+        network = self._network
+        random_state = self._random_state
+        n_sims, n_species = initials.shape
+        n_times = len(tspan)
+        x = initials.copy()
+        t = np.full(n_sims, tspan[0])
+        # Index of the next time point to record for each simulation
+        next_time = np.ones(n_sims, dtype=int)
+        trajectories[:, 0] = x
+        active = np.arange(n_sims)
+        n_steps = 0
+        while len(active):
+            a = network.propensities(x[active], param_values[active])
+            a_cumulative = np.cumsum(a, axis=1)
+            a_total = a_cumulative[:, -1] if a.shape[1] else \
+                np.zeros(len(active))
+            r = random_state.random_sample((2, len(active)))
+            with np.errstate(divide='ignore'):
+                t_next = t[active] - np.log(r[0]) / a_total
+            # The state holds until the next event, so record it at every
+            # time point before then (all remaining ones if no reaction can
+            # fire)
+            passed = np.searchsorted(tspan, t_next, side='left')
+            self._record(trajectories, x, active, next_time, passed)
+            next_time[active] = np.maximum(next_time[active], passed)
+            running = passed < n_times
+            active = active[running]
+            if not len(active):
+                break
+            # Fire one reaction in each remaining simulation
+            targets = r[1, running] * a_total[running]
+            reactions = np.sum(a_cumulative[running] <= targets[:, None],
+                               axis=1)
+            # Guard against the cumulative sum rounding below the target
+            reactions = np.minimum(reactions, network.n_reactions - 1)
+            self._fire(x, active, reactions)
+            t[active] = t_next[running]
+            n_steps += 1
+        if self.verbose:
+            print("Simulated %d reaction event steps for %d simulations" %
+                  (n_steps, n_sims))
+        return trajectories
+
+    @staticmethod
+    def _record(trajectories, x, sims, next_time, passed):
+        """Copy the state of sims into their time points up to passed."""
+        counts = np.maximum(passed - next_time[sims], 0)
+        if not counts.any():
+            return
+        rows = np.repeat(sims, counts)
+        starts = np.repeat(next_time[sims], counts)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts,
+                                                   counts)
+        trajectories[rows, starts + offsets] = x[rows]
+
+    def _fire(self, x, sims, reactions):
+        """Apply one occurrence of reactions[i] to simulation sims[i]."""
+        network = self._network
+        for species, change in ((network.reactants, -1),
+                                (network.products, 1)):
+            indices = species[reactions]
+            rows = np.repeat(sims, indices.shape[1])
+            indices = indices.ravel()
+            # Drop the padding
+            keep = indices < network.n_species
+            np.add.at(x, (rows[keep], indices[keep]), change)
+
+
+class TauLeapingSimulator(SsaSimulator):
+    """
+    Simulate a model stochastically with adaptive tau-leaping
+
+    Each step leaps over a time interval ``tau`` in which every reaction
+    fires a Poisson-distributed number of times. ``tau`` is chosen so that
+    the expected relative change in the propensities stays below
+    ``epsilon`` [Cao2006]_. Reactions that are within ``n_critical`` firings
+    of exhausting one of their reactants are critical: they fire at most
+    once per leap, with exact waiting times, so copy numbers don't become
+    negative. When the leap would be shorter than a few exact SSA steps, an
+    exact SSA step is taken instead. A leap which still makes an amount
+    negative is rejected and retried with half the step size.
+
+    Optionally, the simulation can be hybrid stochastic/deterministic: at
+    each step, reactions whose reactants all have at least
+    ``hybrid_threshold`` molecules are fast reactions, which change the
+    amounts deterministically by their expected number of firings instead
+    of by a Poisson sample. The fluctuations of the fast reactions then no
+    longer limit the size of a leap, which helps with fast reversible
+    reactions between abundant species. Amounts may take non-integer values
+    in a hybrid simulation.
+
+    Batches of simulations are advanced together as in
+    :class:`SsaSimulator`, whose ``run`` method this class shares.
+
+    .. warning::
+        The interface for this class is considered experimental and may
+        change without warning as PySB is updated.
+
+    Parameters
+    ----------
+    model
+    tspan
+    initials
+    param_values
+    verbose
+        See parameter definitions in :class:`SsaSimulator`.
+    **kwargs : dict
+        Extra keyword arguments, including those for :class:`SsaSimulator`
+        and:
+
+        * ``epsilon``: Error control parameter bounding the relative change
+          in propensities during a leap (default 0.03).
+        * ``n_critical``: Reactions which can fire fewer than this number of
+          times before exhausting a reactant are critical (default 10).
+        * ``hybrid_threshold``: Copy number from which reactions are treated
+          deterministically. If not given (the default), every reaction is
+          stochastic.
+
+    References
+    ----------
+    .. [Cao2006] Cao Y, Gillespie DT, Petzold LR. Efficient step size
+        selection for the tau-leaping simulation method. J Chem Phys.
+        2006;124:044109.
+    """
+    def __init__(self, model, tspan=None, initials=None, param_values=None,
+                 verbose=False, **kwargs):
+        super(TauLeapingSimulator, self).__init__(model,
+                                                  tspan=tspan,
+                                                  initials=initials,
+                                                  param_values=param_values,
+                                                  verbose=verbose,
+                                                  **kwargs)
+        self.epsilon = kwargs.get('epsilon', 0.03)
+        self.n_critical = kwargs.get('n_critical', 10)
+        self.hybrid_threshold = kwargs.get('hybrid_threshold', None)
+        network = self._network
+        stoichiometry = network.stoichiometry
+        self._stoichiometry_squared = stoichiometry.multiply(stoichiometry)
+        reactants = network.reactants
+        padding = reactants == network.n_species
+        # Which species each reaction consumes
+        self._reactant_matrix = scipy.sparse.csr_matrix(
+            (np.ones(np.sum(~padding)),
+             (reactants[~padding], np.nonzero(~padding)[0])),
+            shape=(network.n_species, network.n_reactions))
+        # Number of molecules of the species of each reactant consumed
+        # by one firing of the reaction
+        self._consumed = np.sum(reactants[:, :, None] ==
+                                reactants[:, None, :], axis=2)
+        self._consumed[padding] = 1
+        # Highest order of the reactions consuming each species, and
+        # whether a reaction of that order consumes two molecules of it
+        order = np.sum(~padding, axis=1)
+        species_order = np.zeros(network.n_species + 1)
+        np.maximum.at(species_order, reactants,
+                      np.broadcast_to(order[:, None], reactants.shape))
+        species_dimer = np.zeros(network.n_species + 1, dtype=bool)
+        species_dimer[reactants[(self._consumed == 2) &
+                                (order[:, None] == 2)]] = True
+        self._species_order = species_order[:-1]
+        self._species_dimer = species_dimer[:-1] & (self._species_order == 2)
+
+    def _simulate(self, tspan, initials, param_values, trajectories):
+        """
+        Simulate a batch with adaptive tau-leaping.
+
+        Records the species amounts at each time point in ``trajectories``,
+        a 3D array with shape (n_sims, len(tspan), n_species), and returns
+        it.
+        """
+        network = self._network
+        random_state = self._random_state
+        n_sims, n_species = initials.shape
+        n_times = len(tspan)
+        x = initials.copy()
+        t = np.full(n_sims, tspan[0])
+        next_time = np.ones(n_sims, dtype=int)
+        trajectories[:, 0] = x
+        # Upper bound on the next leap after a rejected one
+        max_tau = np.full(n_sims, np.inf)
+        active = np.flatnonzero(next_time < n_times)
+        n_steps = 0
+        n_rejected = 0
+        while len(active):
+            x_active = x[active]
+            a = network.propensities(x_active, param_values[active])
+            fast = self._fast(x_active)
+            critical = self._critical(x_active, a) & ~fast
+            tau_leap = np.minimum(self._leap_size(x_active, a, critical,
+                                                  fast),
+                                  max_tau[active])
+            # Fire the slow reactions exactly when a leap wouldn't gain much
+            with np.errstate(divide='ignore'):
+                exact = tau_leap < 10.0 / np.sum(np.where(fast, 0, a),
+                                                 axis=1)
+            critical[exact] |= ~fast[exact]
+            # Without fast reactions, an exact step is a plain SSA step
+            ssa_step = exact & ~fast.any(axis=1)
+            # Leaps end at the next time point, where the state is recorded
+            t_point = tspan[next_time[active]]
+            tau_leap = np.minimum(tau_leap, t_point - t[active])
+            a_critical = np.where(critical, a, 0)
+            a_critical_cumulative = np.cumsum(a_critical, axis=1)
+            a_critical_total = a_critical.sum(axis=1)
+            r = random_state.random_sample((2, len(active)))
+            with np.errstate(divide='ignore'):
+                tau_critical = -np.log(r[0]) / a_critical_total
+            tau = np.where(ssa_step, tau_critical,
+                           np.minimum(tau_leap, tau_critical))
+            firings = self._leap_firings(
+                np.where(critical, 0, a) *
+                np.where(ssa_step, 0, tau)[:, None], fast)
+            # At most one critical reaction fires in a step
+            fire_critical = tau_critical <= tau
+            if fire_critical.any():
+                targets = r[1, fire_critical] * \
+                    a_critical_total[fire_critical]
+                reactions = np.minimum(np.sum(
+                    a_critical_cumulative[fire_critical] <= targets[:, None],
+                    axis=1), network.n_reactions - 1)
+                firings[np.flatnonzero(fire_critical), reactions] += 1
+            x_next = x_active + network.stoichiometry.dot(firings.T).T
+            t_next = np.where(~ssa_step & (tau == t_point - t[active]),
+                              t_point, t[active] + tau)
+            rejected = np.any(x_next < 0, axis=1) & ~ssa_step
+            max_tau[active[rejected]] = tau_leap[rejected] / 2
+            max_tau[active[~rejected]] = np.inf
+            n_rejected += np.sum(rejected)
+            sims = active[~rejected]
+            t_next = t_next[~rejected]
+            # Record the state before the step at the time points it skips,
+            # and the state after it at a time point it ends on
+            passed = np.searchsorted(tspan, t_next, side='left')
+            self._record(trajectories, x, sims, next_time, passed)
+            next_time[sims] = np.maximum(next_time[sims], passed)
+            x[sims] = x_next[~rejected]
+            t[sims] = t_next
+            reached = np.searchsorted(tspan, t_next, side='right')
+            self._record(trajectories, x, sims, next_time, reached)
+            next_time[sims] = np.maximum(next_time[sims], reached)
+            active = active[next_time[active] < n_times]
+            n_steps += 1
+        if self.verbose:
+            print("Simulated %d steps (%d leaps rejected) for %d simulations"
+                  % (n_steps, n_rejected, n_sims))
+        return trajectories
+
+    def _reactant_amounts(self, x):
+        """Return the amount of each reactant of each reaction."""
+        x_padded = np.concatenate([x, np.full(x.shape[:-1] + (1, ), np.inf)],
+                                  axis=-1)
+        return x_padded[..., self._network.reactants]
+
+    def _fast(self, x):
+        """Return which reactions are treated deterministically."""
+        if self.hybrid_threshold is None:
+            return np.zeros((len(x), self._network.n_reactions), dtype=bool)
+        return np.all(self._reactant_amounts(x) >= self.hybrid_threshold,
+                      axis=-1)
+
+    def _critical(self, x, a):
+        """Return which reactions are critical in each simulation."""
+        max_firings = np.min(np.floor(self._reactant_amounts(x) /
+                                      self._consumed), axis=-1)
+        return (max_firings < self.n_critical) & (a > 0)
+
+    def _leap_size(self, x, a, critical, fast):
+        """
+        Return the largest leap keeping the relative change in the
+        propensities of the non-critical reactions below epsilon.
+        """
+        a_noncritical = np.where(critical, 0, a)
+        mean = self._network.stoichiometry.dot(a_noncritical.T).T
+        # Fast reactions don't fluctuate
+        variance = self._stoichiometry_squared.dot(
+            np.where(fast, 0, a_noncritical).T).T
+        order = np.broadcast_to(self._species_order, x.shape)
+        # Only the reactants of non-critical reactions limit the leap
+        limiting = self._reactant_matrix.dot((a_noncritical > 0).T).T > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Consuming two molecules in a reaction makes its propensity
+            # more sensitive to the amount of the species
+            order = np.where(self._species_dimer & (x > 1),
+                             2 + 1 / (x - 1), order)
+            bound = np.maximum(self.epsilon * x / order, 1)
+            tau = np.minimum(bound / np.abs(mean), bound ** 2 / variance)
+        tau[~limiting | np.isnan(tau)] = np.inf
+        return np.min(tau, axis=1) if tau.shape[1] else \
+            np.full(len(x), np.inf)
+
+    def _leap_firings(self, expected, fast):
+        """
+        Return the number of firings of each reaction in a leap, given their
+        expected numbers.
+        """
+        firings = self._random_state.poisson(expected).astype(float)
+        firings[fast] = expected[fast]
+        return firings
@@ -0,0 +1,35 @@
+"""Run EARM and Robertson example models and compare runtimes of the
+ScipyOdeSimulator compiler backends."""
+
+import timeit
+from pysb.simulator import ScipyOdeSimulator
+from pysb.examples import robertson, earm_1_0
+import numpy as np
+
+def check_runtime(model, tspan, iterations, compiler):
+    sim = ScipyOdeSimulator(model, tspan, compiler=compiler)
+    start_time = timeit.default_timer()
+    for i in range(iterations):
+        sim.run()
+    elapsed = timeit.default_timer() - start_time
+    print("compiler=%s, %d iterations" % (compiler, iterations))
+    print("Time: %f sec\n" % elapsed)
+
+if __name__ == '__main__':
+    ScipyOdeSimulator._test_inline()
+    ScipyOdeSimulator._test_ctypes()
+    compilers = ['python', 'lambdify']
+    if ScipyOdeSimulator._use_ctypes:
+        compilers.append('ctypes')
+    if ScipyOdeSimulator._use_inline:
+        compilers.append('weave')
+
+    print("-- EARM --")
+    earm_tspan = np.linspace(0, 1e4, 1000)
+    for compiler in compilers:
+        check_runtime(earm_1_0.model, earm_tspan, 10, compiler)
+
+    print("-- Robertson --")
+    rob_tspan = np.linspace(0, 100)
+    for compiler in compilers:
+        check_runtime(robertson.model, rob_tspan, 100, compiler)
@@ -1,6 +1,11 @@
 from pysb.testing import *
 from pysb import *
 from pysb.bng import *
+import pysb.bng
+import os
+import shutil
+import sympy
+import tempfile
 
 @with_model
 def test_generate_network():
@@ -14,6 +19,43 @@ def test_generate_network():
     Rule('degrade', A() >> None, k)
     ok_(generate_network(model))
 
+@with_model
+def test_generate_network_cache():
+    Monomer('A')
+    Parameter('A_0', 1)
+    Initial(A(), A_0)
+    Parameter('k', 1)
+    Rule('degrade', A() >> None, k)
+    # Use a temporary cache directory, rather than the user's cache
+    cache_dir = tempfile.mkdtemp()
+    old_cache_dir = os.environ.get('PYSB_CACHE_DIR')
+    os.environ['PYSB_CACHE_DIR'] = cache_dir
+    try:
+        net_uncached = generate_network(model, use_cache=False)
+        net_first = generate_network(model)
+        with BngFileInterface(model) as bngfile:
+            cache_filename = pysb.bng._network_cache_filename(
+                bngfile.generator.get_content())
+        ok_(cache_filename.startswith(cache_dir))
+        ok_(os.path.exists(cache_filename))
+        # No temporary files are left behind
+        eq_(os.listdir(os.path.dirname(cache_filename)),
+            [os.path.basename(cache_filename)])
+        net_cached = generate_network(model)
+        eq_(net_first, net_cached)
+        eq_(net_uncached, net_cached)
+        # Changing a parameter value changes the network file, so must not
+        # hit the cached network
+        k.value = 2
+        net_modified = generate_network(model)
+        ok_(net_modified != net_cached)
+    finally:
+        if old_cache_dir is None:
+            del os.environ['PYSB_CACHE_DIR']
+        else:
+            os.environ['PYSB_CACHE_DIR'] = old_cache_dir
+        shutil.rmtree(cache_dir)
+
 @with_model
 def test_simulate_network_console():
     Monomer('A')
@@ -106,3 +148,105 @@ def test_unicode_strs():
     Rule(u'rule1', A(b=u'y') >> B(), Parameter(u'k', 1))
     Initial(A(b=u'y'), Parameter(u'A_0', 100))
     generate_equations(model)
+
+@with_model
+def test_generate_equations_revision():
+    Monomer('A')
+    Monomer('B')
+    Parameter('A_0', 1)
+    Initial(A(), A_0)
+    Parameter('k', 1)
+    Rule('A_to_B', A() >> B(), k)
+    generate_equations(model)
+    eq_(len(model.reactions), 1)
+    odes = model.odes
+    # Parameter value changes must not regenerate the equations
+    revision = model.revision
+    k.value = 2
+    eq_(model.revision, revision)
+    generate_equations(model)
+    ok_(model.odes is odes)
+    # Adding a rule must regenerate the equations
+    Rule('B_deg', B() >> None, k)
+    ok_(model.equations_outdated())
+    generate_equations(model)
+    eq_(len(model.reactions), 2)
+    ok_(not model.equations_outdated())
+
+@with_model
+def test_parse_netfile():
+    Monomer('A', ['b'])
+    Monomer('B', ['a'])
+    Parameter('kf', 1)
+    Parameter('kr', 1)
+    Rule('bind', A(b=None) + B(a=None) <> A(b=1) % B(a=1), kf, kr)
+    Rule('dimerize', A(b=None) + A(b=None) >> A(b=1) % A(b=1), kf)
+    Observable('A_free', A(b=None))
+    netfile = """# Created by BioNetGen 2.2.6-stable
+begin species
+    1 A(b) 1
+    2 B(a) 1
+    3 A(b!1).B(a!1) 0
+    4 A(b!1).A(b!1) 0
+end species
+begin reactions
+    1 1,2 3 kf #bind
+    2 3 1,2 kr #bind(reverse)
+    3 1,1 4 0.5*kf #dimerize unit_conversion=1
+end reactions
+begin groups
+    1 A_free 1
+end groups
+"""
+    pysb.bng._parse_netfile(model, netfile.split('\n'))
+    eq_(len(model.species), 4)
+    eq_(model.observables['A_free'].species, [0])
+    # The reactions and odes are built on first access
+    ok_(model._pending_equations is not None)
+    eq_(len(model.reactions), 3)
+    ok_(model._pending_equations is None)
+    s = [sympy.Symbol('__s%d' % i) for i in range(4)]
+    k_f, k_r = sympy.symbols('kf kr')
+    eq_(model.reactions[1]['rule'], ('bind', ))
+    eq_(model.reactions[1]['reverse'], (True, ))
+    eq_(model.reactions[2]['rate'], 0.5 * s[0] ** 2 * k_f)
+    eq_(model.reactions[2]['reactants'], (0, 0))
+    eq_(len(model.reactions_bidirectional), 2)
+    ok_(model.reactions_bidirectional[0]['reversible'])
+    eq_(model.reactions_bidirectional[0]['rate'],
+        s[0] * s[1] * k_f - s[2] * k_r)
+    eq_(model.odes[0], -s[0] * s[1] * k_f + s[2] * k_r - 1.0 * s[0] ** 2 * k_f)
+    eq_(model.odes[3], 0.5 * s[0] ** 2 * k_f)
+
+@with_model
+def test_console_pool():
+    Monomer('A')
+    Parameter('A_0', 100)
+    Initial(A(), A_0)
+    Parameter('k', 1)
+    Rule('degrade', A() >> None, k)
+    with BngConsolePool(suppress_warnings=True) as pool:
+        yfull1 = run_ssa(model, t_end=1, n_steps=10, pool=pool)
+        eq_(yfull1['__s0'][0], 100)
+        with pool.console(model) as bng:
+            console = bng
+        # Parameter changes are sent to the console on checkout, and the
+        # concentrations are reset after each use
+        A_0.value = 50
+        yfull2 = run_ssa(model, t_end=1, n_steps=10, pool=pool)
+        eq_(yfull2['__s0'][0], 50)
+        with pool.console(model) as bng:
+            ok_(bng is console)
+            # Only one console may run, so checking out a console for
+            # another model must time out
+            pool.checkout_timeout = 0.1
+            assert_raises(BngInterfaceError, pool._checkout,
+                          Model(_export=False))
+        # A console which stopped responding is replaced
+        console.console.terminate(force=True)
+        with pool.console(model) as bng:
+            ok_(bng is not console)
+        # Structural changes require a new console
+        Rule('degrade2', A() >> None, k)
+        with pool.console(model) as bng2:
+            ok_(bng2 is not bng)
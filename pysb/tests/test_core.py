@@ -1,6 +1,9 @@
 from pysb.testing import *
 from pysb.core import *
+from pysb.bng import generate_equations
+import pysb.examples.robertson
 from functools import partial
+import copy
 
 def test_component_names_valid():
     for name in 'a', 'B', 'AbC', 'dEf', '_', '_7', '__a01b__999x_x___':
@@ -62,6 +65,13 @@ def test_model_pickle():
     assert_equal(len(model.all_components()), 7)
     model2 = pickle.loads(pickle.dumps(model))
     check_model_against_component_list(model, model2.all_components())
+    # The equations are built lazily after network generation, so the
+    # model must also be picklable before they are first accessed
+    robertson = copy.deepcopy(pysb.examples.robertson.model)
+    generate_equations(robertson)
+    robertson2 = pickle.loads(pickle.dumps(robertson))
+    assert_equal(robertson2.odes, robertson.odes)
+    assert_equal(robertson2.reactions, robertson.reactions)
 
 @with_model
 def test_monomer_as_reaction_pattern():
@@ -132,5 +142,45 @@ def test_complex_pattern_call():
 def test_monomer_unicode():
     Monomer(u'A', [u's'], {u's': [u's1', u's2']})
 
+@with_model
+def test_canonical_key():
+    Monomer('A', ['l', 'r', 's'], {'s': ['u', 'p']})
+
+    def ring(states, bonds, order):
+        # Ring of A monomers with the given states, bond numbers and
+        # monomer pattern order
+        n = len(states)
+        mps = [A(l=bonds[i - 1], r=bonds[i], s=states[i]) for i in range(n)]
+        return ComplexPattern([mps[i] for i in order], None)
+
+    cp = ring(['u', 'p', 'u', 'p'], [1, 2, 3, 4], [0, 1, 2, 3])
+    same = ring(['u', 'p', 'u', 'p'], [8, 5, 7, 6], [2, 0, 3, 1])
+    rotated = ring(['p', 'u', 'p', 'u'], [1, 2, 3, 4], [3, 1, 0, 2])
+    different = ring(['u', 'u', 'p', 'p'], [1, 2, 3, 4], [0, 1, 2, 3])
+    eq_(cp.canonical_key(), same.canonical_key())
+    eq_(cp.canonical_key(), rotated.canonical_key())
+    ok_(cp.is_equivalent_to(rotated))
+    ok_(cp.canonical_key() != different.canonical_key())
+    ok_(not cp.is_equivalent_to(different))
+    # Keys are hashable
+    eq_(len(set([cp.canonical_key(), same.canonical_key(),
+                 different.canonical_key()])), 2)
+
+@with_model
+def test_get_species_index():
+    Monomer('A', ['b', 's'], {'s': ['u', 'p']})
+    Monomer('B', ['a'])
+    model.species = [as_complex_pattern(A(b=None, s='u')),
+                     as_complex_pattern(A(b=None, s='p')),
+                     A(b=1, s='u') % B(a=1),
+                     as_complex_pattern(B(a=None))]
+    # Bond numbering and monomer pattern order must not matter
+    eq_(model.get_species_index(B(a=3) % A(b=3, s='u')), 2)
+    eq_(model.get_species_index(A(b=None, s='p')), 1)
+    ok_(model.get_species_index(A(b=1, s='p') % B(a=1)) is None)
+    # The index must follow changes to the species list
+    model.species.append(A(b=1, s='p') % B(a=1))
+    eq_(model.get_species_index(B(a=2) % A(b=2, s='p')), 4)
+
 if __name__ == '__main__':
     test_monomer_unicode()
@@ -5,6 +5,7 @@ from pysb.bng import generate_network
 import subprocess 
 from re import split
 import pygraphviz as pgv
+import numpy as np
 
 _KAPPA_SEED = 123456
 
@@ -26,6 +27,29 @@ def test_kappa_simulation_results():
     ok_(kres['time'][0] == 0)
     ok_(sorted(kres['time'])[-1] == 100)
 
+@with_model
+def test_kappa_ensemble():
+    Monomer('A', ['b'])
+    Monomer('B', ['b'])
+    Initial(A(b=None), Parameter('A_0', 100))
+    Initial(B(b=None), Parameter('B_0', 100))
+    Rule('A_binds_B', A(b=None) + B(b=None) >> A(b=1) % B(b=1),
+         Parameter('kf', 1))
+    Rule('A_binds_B_rev', A(b=1) % B(b=1) >> A(b=None) + B(b=None),
+         Parameter('kr', 1))
+    Observable('AB', A(b=1) % B(b=1))
+    npts = 50
+    res = run_ensemble(model, n_runs=4, time=10, points=npts,
+                       seed=_KAPPA_SEED, num_processors=2)
+    eq_(res.timecourses.shape, (4, npts + 1))
+    eq_(res.seeds, [_KAPPA_SEED + i for i in range(4)])
+    ok_(np.allclose(res.mean['AB'], np.mean(res.timecourses['AB'], axis=0)))
+    ok_(np.allclose(res.variance['AB'],
+                    np.var(res.timecourses['AB'], axis=0)))
+    # Each run matches a single simulation with its seed
+    kres = run_simulation(model, time=10, points=npts, seed=res.seeds[2])
+    ok_(np.array_equal(res.timecourses['AB'][2], kres['AB'].ravel()))
+
 @with_model
 def test_kappa_expressions():
     Monomer('A',['site'],{'site': ['u']})
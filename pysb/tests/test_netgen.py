@@ -0,0 +1,124 @@
+from pysb.testing import *
+from pysb import *
+from pysb.netgen import generate_equations, NetworkGenerationError
+from pysb.core import SelfExporter
+import pysb.bng
+import copy
+import importlib
+import sympy
+
+# Example models which netgen can expand (no compartments, finite network)
+example_models = ['bax_pore', 'bax_pore_sequential', 'earm_1_0', 'earm_1_3',
+                  'explicit', 'expression_observables',
+                  'fricker_2010_apoptosis', 'hello_pysb', 'kinase_cascade',
+                  'robertson', 'synth_deg', 'tutorial_a', 'tyson_oscillator']
+
+
+def test_examples_match_bng():
+    """Compare netgen against BioNetGen on the example models"""
+    for name in example_models:
+        module = importlib.import_module('pysb.examples.' + name)
+        # Reset do_export to the default in case the model changed it.
+        SelfExporter.do_export = True
+        yield (check_matches_bng, module.model)
+
+
+def check_matches_bng(model):
+    model_bng = copy.deepcopy(model)
+    model_ng = copy.deepcopy(model)
+    pysb.bng.generate_equations(model_bng)
+    generate_equations(model_ng)
+
+    keys_bng = [cp.canonical_key() for cp in model_bng.species]
+    keys_ng = [cp.canonical_key() for cp in model_ng.species]
+    eq_(set(keys_bng), set(keys_ng))
+    eq_(len(model_bng.reactions), len(model_ng.reactions))
+
+    # Rename netgen's species symbols to BioNetGen's numbering
+    index_bng = dict((key, i) for i, key in enumerate(keys_bng))
+    subs = dict((sympy.Symbol('__s%d' % i),
+                 sympy.Symbol('__s%d' % index_bng[key]))
+                for i, key in enumerate(keys_ng))
+    for i, key in enumerate(keys_ng):
+        ode_ng = sympy.sympify(model_ng.odes[i]).xreplace(subs)
+        ode_bng = sympy.sympify(model_bng.odes[index_bng[key]])
+        eq_(sympy.simplify(ode_ng - ode_bng), 0)
+
+    for obs_bng, obs_ng in zip(model_bng.observables, model_ng.observables):
+        eq_(dict(zip(obs_bng.species, obs_bng.coefficients)),
+            dict((index_bng[keys_ng[s]], c) for s, c in
+                 zip(obs_ng.species, obs_ng.coefficients)))
+
+
+@with_model
+def test_symmetry_factors():
+    Monomer('A', ['a', 's'], {'s': ['u', 'p']})
+    Parameter('kf', 1)
+    Parameter('kr', 1)
+    Parameter('A_0', 1)
+    Initial(A(a=None, s='u'), A_0)
+    Rule('dimerize', A(a=None) + A(a=None) <> A(a=1) % A(a=1), kf, kr)
+    Rule('phosphorylate', A(s='u') >> A(s='p'), kf)
+    Rule('degrade', A(a=1) % A(a=1) >> None, kr)
+    generate_equations(model)
+    eq_(len(model.species), 7)
+
+    def factor(reaction):
+        return reaction['rate'].as_coeff_Mul()[0]
+
+    def reactions(rule_name, reverse=False):
+        return [r for r in model.reactions if r['rule'] == (rule_name,)
+                and r['reverse'] == (reverse,)]
+
+    # Homodimerization of identical monomers
+    ok_(any(factor(r) == sympy.Rational(1, 2) for r in reactions('dimerize')))
+    # Dissociation of a symmetric dimer happens once
+    ok_(all(factor(r) == 1 for r in reactions('dimerize', reverse=True)))
+    # Either monomer of an unphosphorylated dimer can be phosphorylated
+    ok_(any(factor(r) == 2 for r in reactions('phosphorylate')))
+    # Degrading a whole dimer happens once, even though both monomers match
+    degrade = reactions('degrade')
+    eq_(len(degrade), 3)
+    ok_(all(factor(r) == 1 for r in degrade))
+
+
+@with_model
+def test_max_agg():
+    Monomer('A', ['l', 'r'])
+    Parameter('k', 1)
+    Parameter('A_0', 1)
+    Initial(A(l=None, r=None), A_0)
+    Rule('polymerize', A(r=None) + A(l=None) >> A(r=1) % A(l=1), k)
+    generate_equations(model, max_agg=3)
+    eq_(len(model.species), 3)
+    eq_(max(len(cp.monomer_patterns) for cp in model.species), 3)
+
+
+@with_model
+def test_equations_reused():
+    Monomer('A')
+    Parameter('k', 1)
+    Parameter('A_0', 1)
+    Initial(A(), A_0)
+    Rule('degrade', A() >> None, k)
+    generate_equations(model)
+    odes = model.odes
+    generate_equations(model)
+    ok_(model.odes is odes)
+    Monomer('B')
+    generate_equations(model)
+    ok_(model.odes is not odes)
+
+
+@with_model
+def test_unsupported():
+    Monomer('A', ['b'])
+    Parameter('k', 1)
+    Parameter('A_0', 1)
+    Initial(A(b=None), A_0)
+    Rule('unbind', A(b=ANY) >> A(b=None), k)
+    # BioNetGen rejects breaking a bond to an unspecified partner
+    assert_raises(NetworkGenerationError, generate_equations, model)
+    Parameter('V', 1)
+    Compartment('c', size=V)
+    assert_raises(NetworkGenerationError, generate_equations, model)
@@ -0,0 +1,90 @@
+from pysb.testing import *
+from pysb import *
+from pysb.bng import generate_equations
+from pysb.network import ReactionNetwork, _replace_symbols, \
+    _symbolic_substitutions
+from pysb.examples import earm_1_0, expression_observables
+import copy
+import numpy as np
+import sympy
+
+
+def _odes_function(model):
+    """Evaluate the model's sympy ODEs, for comparison"""
+    subs = _symbolic_substitutions(model)
+    subs.update((p.name, sympy.Float(p.value)) for p in model.parameters)
+    species = [sympy.Symbol('__s%d' % i) for i in range(len(model.species))]
+    odes = [_replace_symbols(_replace_symbols(sympy.sympify(ode), subs), subs)
+            for ode in model.odes]
+    return sympy.lambdify([species], odes)
+
+
+def test_dydt_matches_odes():
+    for model in (earm_1_0.model, expression_observables.model):
+        yield (check_dydt_matches_odes, model)
+
+
+def check_dydt_matches_odes(model):
+    model = copy.deepcopy(model)
+    generate_equations(model)
+    network = ReactionNetwork(model)
+    y = np.random.RandomState(0).uniform(0, 100, len(model.species))
+    ok_(np.allclose(network.dydt(y), _odes_function(model)(y)))
+    # Rows of y are evaluated independently
+    y_2d = np.array([y, 2 * y])
+    ydot_2d = network.dydt(y_2d)
+    eq_(ydot_2d.shape, y_2d.shape)
+    ok_(np.allclose(ydot_2d[1], network.dydt(2 * y)))
+
+
+def test_netfile_arrays():
+    """The arrays built from the net file match those from the reactions."""
+    model = copy.deepcopy(earm_1_0.model)
+    model.reset_equations()
+    generate_equations(model)
+    ok_(model._pending_equations is not None)
+    network_netfile = ReactionNetwork(model)
+    # Building from the net file doesn't need the sympy equations
+    ok_(model._pending_equations is not None)
+    model.reactions
+    network = ReactionNetwork(model)
+    ok_(np.all(network.mass_action))
+    for attr in ('reactants', 'products', 'rate_parameters',
+                 'rate_factors'):
+        ok_(np.array_equal(getattr(network, attr),
+                           getattr(network_netfile, attr)))
+    eq_((network.stoichiometry != network_netfile.stoichiometry).nnz, 0)
+
+
+@with_model
+def test_reaction_arrays():
+    Monomer('A', ['a'])
+    Monomer('B')
+    Parameter('kf', 2)
+    Parameter('kd', 3)
+    Parameter('A_0', 10)
+    Initial(A(a=None), A_0)
+    Observable('A_total', A())
+    Expression('kexpr', kd * A_total)
+    Rule('dimerize', A(a=None) + A(a=None) >> A(a=1) % A(a=1), kf)
+    Rule('degrade', A(a=1) % A(a=1) >> B(), kexpr)
+    generate_equations(model)
+    network = ReactionNetwork(model)
+    eq_(network.n_reactions, 2)
+    ok_(np.array_equal(network.reactants, [[0, 0], [1, 3]]))
+    ok_(np.array_equal(network.mass_action, [True, False]))
+    eq_(network.rate_parameters[0], 0)
+    eq_(network.rate_factors[0], 0.5)
+    ok_(np.array_equal(network.stoichiometry.toarray(),
+                       [[-2, 0], [1, -1], [0, 1]]))
+    y = np.array([4., 1., 0.])
+    ok_(np.allclose(network.rates(y), [0.5 * 2 * 16, 3 * (4 + 2) * 1]))
+    ok_(np.isnan(network.rate_constants()[1]))
+
+
+@with_model
+def test_equations_not_generated():
+    Monomer('A')
+    Parameter('k', 1)
+    Rule('degrade', A() >> None, k)
+    assert_raises(ValueError, ReactionNetwork, model)
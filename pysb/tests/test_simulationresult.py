@@ -1,7 +1,11 @@
-from pysb.simulator import ScipyOdeSimulator
+from pysb.simulator import ScipyOdeSimulator, SimulatorException
 from pysb.simulator.base import SimulationResult
-from pysb.examples import tyson_oscillator
+from nose.tools import assert_raises, eq_
+from pysb.examples import tyson_oscillator, expression_observables
 import numpy as np
+import os
+import shutil
+import tempfile
 
 
 def test_simres_dataframe():
@@ -39,3 +43,108 @@ def test_simres_dataframe():
 
     assert df2.shape == (len(tspan1) + len(tspan3),
                          len(model.species) + len(model.observables))
+
+
+def test_simres_on_disk():
+    """ Test storing a SimulationResult on disk and loading it again """
+    model = expression_observables.model
+    sim = ScipyOdeSimulator(model, tspan=np.linspace(0, 40, 10))
+    param_values = [[p.value for p in model.parameters]] * 3
+    simres = sim.run(param_values=param_values)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'run')
+        simres_disk = sim.run(path=path)
+        # The trajectories are written to disk as they are simulated
+        assert isinstance(simres_disk.species[0], np.memmap)
+        assert np.allclose(simres_disk.species, simres.species)
+        for n in range(3):
+            assert np.array_equal(simres_disk.all[n], simres.all[n])
+
+        simres_loaded = SimulationResult.load(path)
+        assert simres_loaded.nsims == 3
+        assert isinstance(simres_loaded.all[0], np.memmap)
+        assert np.array_equal(simres_loaded.tout, simres.tout)
+        for n in range(3):
+            assert np.array_equal(simres_loaded.observables[n],
+                                  simres.observables[n])
+            assert np.array_equal(simres_loaded.expressions[n],
+                                  simres.expressions[n])
+            assert np.array_equal(simres_loaded.all[n], simres.all[n])
+        assert simres_loaded.dataframe.equals(simres.dataframe)
+
+        # An existing result isn't replaced unless asked to, and results
+        # still using the old files keep their data
+        assert_raises(ValueError, sim.run, path=path)
+        observables = np.array(simres_disk.observables)
+        sim.run(path=path, param_values=param_values[:1], overwrite=True)
+        assert np.array_equal(simres_disk.observables, observables)
+        assert SimulationResult.load(path).nsims == 1
+        assert_raises(ValueError, simres.save, path)
+
+        # Results simulated in memory can be saved too
+        simres.save(os.path.join(directory, 'saved'))
+        simres_saved = SimulationResult.load(os.path.join(directory,
+                                                          'saved'))
+        assert np.array_equal(simres_saved.species, simres.species)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_simres_views():
+    """ Test the trajectories and dataframe share the result's data """
+    model = expression_observables.model
+    tspan = np.linspace(0, 40, 10)
+    sim = ScipyOdeSimulator(model, tspan=tspan)
+    simres = sim.run(param_values=[[p.value for p in model.parameters]] * 2)
+    df = simres.dataframe
+    assert np.shares_memory(df.values, simres.species[1])
+    assert np.shares_memory(simres.species[0], simres.all[0])
+    # The observables and expressions are packed arrays of their own
+    obs = simres.observables[0]
+    assert not np.shares_memory(obs, simres.all[0])
+    eq_(obs.view(float).reshape(len(obs), -1).shape,
+        (len(tspan), len(model.observables)))
+    assert list(df.index) == [(n, t) for n in range(2) for t in tspan]
+    assert np.array_equal(df.loc[1]['Bax_c0'], simres.observables[1]['Bax_c0'])
+    assert np.array_equal(df.loc[0]['NBD_signal'],
+                          simres.expressions[0]['NBD_signal'])
+
+
+def test_simres_selective_output():
+    """ Test keeping only some observables and expressions """
+    model = expression_observables.model
+    tspan = np.linspace(0, 40, 10)
+    param_values = [[p.value for p in model.parameters]] * 2
+    for integrator in ('lsoda', 'solve_ivp'):
+        sim = ScipyOdeSimulator(model, tspan=tspan, integrator=integrator)
+        simres = sim.run(param_values=param_values)
+        simres_sel = sim.run(param_values=param_values,
+                             save=['Bax_c0', model.expressions['NBD_signal']],
+                             keep_species=False)
+        assert simres_sel.observables[0].dtype.names == ('Bax_c0', )
+        assert simres_sel.expressions[0].dtype.names == ('NBD_signal', )
+        assert list(simres_sel.dataframe.columns) == ['Bax_c0', 'NBD_signal']
+        for n in range(2):
+            assert np.allclose(simres_sel.observables[n]['Bax_c0'],
+                               simres.observables[n]['Bax_c0'])
+            assert np.allclose(simres_sel.expressions[n]['NBD_signal'],
+                               simres.expressions[n]['NBD_signal'])
+        assert_raises(ValueError, lambda: simres_sel.species)
+    assert_raises(SimulatorException, sim.run, save=['not_an_output'])
+
+    # Species can be kept along with the selection
+    simres_sel = sim.run(save=['Bax_c2'])
+    assert np.allclose(simres_sel.species, simres.species)
+    assert simres_sel.expressions[0].dtype.names is None
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'run')
+        sim.run(path=path, save=['NBD_signal'], keep_species=False)
+        simres_loaded = SimulationResult.load(path)
+        assert np.allclose(simres_loaded.expressions[1]['NBD_signal'],
+                           simres.expressions[1]['NBD_signal'])
+        assert_raises(ValueError, lambda: simres_loaded.species)
+    finally:
+        shutil.rmtree(directory)
@@ -2,7 +2,7 @@ from pysb.testing import *
 import numpy as np
 from pysb import Monomer, Parameter, Initial, Observable, Rule, Expression
 from pysb.simulator import ScipyOdeSimulator, SimulatorException
-from pysb.examples import robertson, earm_1_0
+from pysb.examples import robertson, earm_1_0, expression_observables
 
 
 class TestScipySimulator(object):
@@ -133,6 +133,49 @@ class TestScipySimulator(object):
         """Test param_values with non-numeric value."""
         self.sim.run(param_values={'ksynthA': 'eggs'})
 
+    def test_param_values_2d(self):
+        """Test a batch of simulations with a 2D param_values array."""
+        param_values = np.array([p.value for p in self.model.parameters])
+        param_values = np.repeat([param_values], 3, axis=0)
+        # kbindAB=0 should ensure no AB_complex is produced.
+        param_values[1, 2] = 0
+        # Initial amounts of A and B are taken from each parameter set
+        param_values[2, 3:5] = 10
+        simres = self.sim.run(param_values=param_values)
+        assert simres.nsims == 3
+        assert simres.species[0].shape == (len(self.time),
+                                           len(self.model.species))
+        assert np.allclose(simres.observables[1]['AB_complex'], 0)
+        assert not np.allclose(simres.observables[0]['AB_complex'], 0)
+        assert np.allclose(simres.observables[2]['A_free'][0], 10)
+
+    def test_initials_2d(self):
+        """Test a batch of simulations with a 2D initials array."""
+        initials = [[10, 20, 0, 0], [30, 40, 0, 0]]
+        simres = self.sim.run(initials=initials)
+        assert simres.nsims == 2
+        assert np.allclose(simres.observables[0]['A_free'][0], 10)
+        assert np.allclose(simres.observables[1]['A_free'][0], 30)
+
+    def test_num_processors(self):
+        """Test a batch of simulations spread over a process pool."""
+        param_values = np.array([p.value for p in self.model.parameters])
+        param_values = np.repeat([param_values], 4, axis=0)
+        param_values[:, 2] = [0, 10, 100, 1000]
+        simres = self.sim.run(param_values=param_values)
+        simres_pool = self.sim.run(param_values=param_values,
+                                   num_processors=2)
+        assert simres_pool.nsims == 4
+        for n in range(4):
+            assert np.allclose(simres_pool.species[n], simres.species[n])
+
+    @raises(SimulatorException)
+    def test_initials_param_values_2d_mismatch(self):
+        """Test 2D initials and param_values with different row counts."""
+        param_values = np.array([p.value for p in self.model.parameters])
+        self.sim.run(initials=np.zeros((2, len(self.model.species))),
+                     param_values=np.repeat([param_values], 3, axis=0))
+
     def test_result_dataframe(self):
         df = self.sim.run().dataframe
 
@@ -200,6 +243,85 @@ def test_earm_integration():
         ScipyOdeSimulator._use_inline = True
 
 
+def test_compiler_backends():
+    """Ensure the available compiler backends give the same results."""
+    t = np.linspace(0, 100)
+    sim = ScipyOdeSimulator(robertson.model, tspan=t, compiler='python',
+                            use_analytic_jacobian=True)
+    simres = sim.run()
+    sim_lambdify = ScipyOdeSimulator(robertson.model, tspan=t,
+                                     compiler='lambdify',
+                                     use_analytic_jacobian=True)
+    assert np.allclose(sim_lambdify.run().species, simres.species)
+    ScipyOdeSimulator._test_ctypes()
+    if ScipyOdeSimulator._use_ctypes:
+        sim_ctypes = ScipyOdeSimulator(robertson.model, tspan=t,
+                                       compiler='ctypes',
+                                       use_analytic_jacobian=True)
+        assert np.allclose(sim_ctypes.run().species, simres.species)
+
+
+def test_lambdify_expressions():
+    """Ensure the lambdify backend handles expressions and observables."""
+    t = np.linspace(0, 1e3)
+    simres = ScipyOdeSimulator(earm_1_0.model, tspan=t,
+                               compiler='python').run()
+    simres_lambdify = ScipyOdeSimulator(earm_1_0.model, tspan=t,
+                                        compiler='lambdify').run()
+    assert np.allclose(simres_lambdify.species, simres.species)
+
+
+def test_network_backend():
+    """Ensure the network backend matches the generated code backends."""
+    for model, t in ((earm_1_0.model, np.linspace(0, 1e3)),
+                     (expression_observables.model, np.linspace(0, 40))):
+        simres = ScipyOdeSimulator(model, tspan=t,
+                                   compiler='python').run()
+        simres_network = ScipyOdeSimulator(model, tspan=t,
+                                           compiler='network').run()
+        assert np.allclose(simres_network.species, simres.species)
+
+
+def test_expressions_param_values_2d():
+    """Ensure expressions use each simulation's parameter values."""
+    model = expression_observables.model
+    t = np.linspace(0, 40, 10)
+    param_values = np.array([p.value for p in model.parameters])
+    param_values = np.repeat([param_values], 4, axis=0)
+    param_values[:, 0] *= np.arange(1, 5)
+    sim = ScipyOdeSimulator(model, tspan=t)
+    simres = sim.run(param_values=param_values)
+    for n in range(4):
+        single = sim.run(param_values=param_values[n])
+        for expr in model.expressions_dynamic():
+            assert np.allclose(simres.expressions[n][expr.name],
+                               single.expressions[expr.name])
+
+
+@with_model
+def test_observables_coefficients():
+    """Ensure observables account for species coefficients."""
+    Monomer('A', ['a'])
+    Parameter('A_0', 100)
+    Parameter('kf', 1e-2)
+    Initial(A(a=None), A_0)
+    Observable('A_total', A())
+    Observable('A_dimer', A(a=1) % A(a=1), match='species')
+    Rule('dimerize', A(a=None) + A(a=None) >> A(a=1) % A(a=1), kf)
+    simres = ScipyOdeSimulator(model, tspan=np.linspace(0, 10)).run(
+        param_values=[[100, 1e-2], [50, 1e-3]])
+    for n in range(2):
+        y = simres.species[n]
+        assert np.allclose(simres.observables[n]['A_total'],
+                           y[:, 0] + 2 * y[:, 1])
+        assert np.allclose(simres.observables[n]['A_dimer'], y[:, 1])
+
+
+@raises(SimulatorException)
+def test_unknown_compiler():
+    ScipyOdeSimulator(robertson.model, compiler='does_not_exist')
+
+
 @raises(SimulatorException)
 def test_simulation_no_tspan():
     ScipyOdeSimulator(robertson.model).run()
@@ -210,3 +332,220 @@ def test_nonexistent_integrator():
     """Ensure nonexistent integrator raises."""
     ScipyOdeSimulator(robertson.model, tspan=np.linspace(0, 1, 2),
                       integrator='does_not_exist')
+
+
+@with_model
+def test_banded_jacobian():
+    """A banded analytic Jacobian is passed to the integrators as bands."""
+    Monomer('A', ['s'], {'s': [str(i) for i in range(20)]})
+    Parameter('k', 1)
+    Parameter('A_0', 100)
+    Initial(A(s='0'), A_0)
+    for i in range(19):
+        Rule('step%d' % i, A(s=str(i)) >> A(s=str(i + 1)), k)
+    t = np.linspace(0, 20)
+    # 19 decay terms on the diagonal and 19 production terms below it
+    eq_(ScipyOdeSimulator(model).jac_sparsity.nnz, 38)
+    for integrator, bands in (('vode', ('lband', 'uband')),
+                              ('lsoda', ('ml', 'mu'))):
+        sim = ScipyOdeSimulator(model, tspan=t, integrator=integrator,
+                                use_analytic_jacobian=True)
+        eq_((sim.opts[bands[0]], sim.opts[bands[1]]), (1, 0))
+        eq_(sim.jac.shape, (20, 20))
+        eq_((sim.jac_sparsity != sim.jac_sparsity.astype(bool)).nnz, 0)
+        simres = ScipyOdeSimulator(model, tspan=t,
+                                   integrator=integrator).run()
+        assert np.allclose(sim.run().species, simres.species, atol=1e-4)
+
+
+def test_sparse_jacobian_expressions():
+    """The sparse analytic Jacobian includes dependencies via expressions"""
+    model = expression_observables.model
+    sim = ScipyOdeSimulator(model, integrator='dopri5', compiler='lambdify',
+                            use_analytic_jacobian=True)
+    p = np.array([param.value for param in model.parameters])
+    y = np.linspace(1, 2, len(model.species))
+    jac = sim.integrator.jac(0, y, p)
+    eps = 1e-6
+    for j in range(len(y)):
+        dy = np.zeros(len(y))
+        dy[j] = eps
+        fd = (np.array(sim.integrator.f(0, y + dy, p)) -
+              np.array(sim.integrator.f(0, y - dy, p))) / (2 * eps)
+        assert np.allclose(jac[:, j], fd, rtol=1e-4, atol=1e-6)
+
+
+def test_solve_ivp():
+    """The solve_ivp integrator matches vode, with sparse Jacobians too"""
+    t = np.linspace(0, 100)
+    simres = ScipyOdeSimulator(earm_1_0.model, tspan=t).run()
+    for method in ('LSODA', 'BDF'):
+        for jacobian in (False, True):
+            sim = ScipyOdeSimulator(earm_1_0.model, tspan=t,
+                                    integrator='solve_ivp',
+                                    integrator_options={'method': method},
+                                    use_analytic_jacobian=jacobian)
+            simres_ivp = sim.run()
+            assert np.array_equal(simres_ivp.tout[0], t)
+            assert np.allclose(simres_ivp.species, simres.species,
+                               rtol=1e-3, atol=1e-3)
+
+
+@with_model
+def test_solve_ivp_events():
+    """Terminal events end each simulation when an observable crosses"""
+    Monomer('A')
+    Parameter('k', 1)
+    Parameter('A_0', 100)
+    Initial(A(), A_0)
+    Observable('A_total', A())
+    Rule('degrade', A() >> None, k)
+    t = np.linspace(0, 10, 101)
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options={'dense_output': True},
+                            events=[('A_total', 50)])
+    simres = sim.run(param_values=[[1, 100, 1], [2, 100, 1]])
+    for n, rate in enumerate((1, 2)):
+        t_half = np.log(2) / rate
+        assert np.isclose(simres.tout[n][-1], t_half, rtol=1e-5)
+        assert np.isclose(simres.observables[n]['A_total'][-1], 50)
+        eq_(len(simres.tout[n]), np.sum(t < t_half) + 1)
+        assert np.isclose(sim.ode_solutions[n](0.5 * t_half)[0],
+                          100 / np.sqrt(2), rtol=1e-4)
+    # Record each solver step instead of tspan
+    simres = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                               integrator_options={'t_eval': None}).run()
+    ok_(len(simres.tout[0]) < len(t))
+    assert_raises(SimulatorException, ScipyOdeSimulator, model,
+                  events=[('A_total', 50)])
+    assert_raises(SimulatorException, ScipyOdeSimulator, model,
+                  integrator='solve_ivp', events=[('B', 50)])
+
+
+@with_model
+def test_sensitivities():
+    """Forward sensitivities match the analytic derivatives"""
+    Monomer('A')
+    Parameter('k', 0.5)
+    Parameter('A_0', 100)
+    Initial(A(), A_0)
+    Observable('A_total', A())
+    Expression('loss_rate', k * A_total)
+    Rule('degrade', A() >> None, k)
+    t = np.linspace(0, 10, 11)
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options={'rtol': 1e-8},
+                            sensitivities=[k, 'A_0'])
+    eq_(sim.opts['method'], 'BDF')
+    simres = sim.run()
+    eq_(simres.sensitivity_parameters, ['k', 'A_0'])
+    a = 100 * np.exp(-0.5 * t)
+    sens = simres.observable_sensitivities
+    eq_(sens.shape, (len(t), 1, 2))
+    assert np.allclose(sens[:, 0, 0], -t * a, rtol=1e-4, atol=1e-6)
+    assert np.allclose(sens[:, 0, 1], a / 100, rtol=1e-4, atol=1e-8)
+    assert np.allclose(simres.species_sensitivities[:, 0, :], sens[:, 0, :])
+    assert np.allclose(simres.expression_sensitivities[:, 0, 0],
+                       a - 0.5 * t * a, rtol=1e-4, atol=1e-3)
+    # Explicitly given initial amounts don't depend on A_0
+    initials = np.zeros((1, len(model.species)))
+    initials[0, 0] = 100
+    simres = sim.run(initials=initials)
+    assert np.allclose(simres.observable_sensitivities[:, 0, 1], 0)
+    assert_raises(ValueError, lambda: ScipyOdeSimulator(
+        model, tspan=t).run().species_sensitivities)
+    assert_raises(SimulatorException, ScipyOdeSimulator, model,
+                  sensitivities=True)
+    assert_raises(SimulatorException, ScipyOdeSimulator, model,
+                  integrator='solve_ivp', sensitivities=['B_0'])
+
+
+def test_sensitivities_earm():
+    """Observable sensitivities match finite differences"""
+    model = earm_1_0.model
+    t = np.linspace(0, 20000, 21)
+    param = model.parameters['kf1']
+    opts = {'rtol': 1e-8, 'atol': 1e-10}
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options=opts, sensitivities=[param])
+    sens = sim.run().observable_sensitivities[:, :, 0]
+    param_values = np.array([p.value for p in model.parameters])
+    index = model.parameters.index(param)
+    eps = param.value * 1e-4
+    up, down = param_values.copy(), param_values.copy()
+    up[index] += eps
+    down[index] -= eps
+    simres = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                               integrator_options=dict(
+                                   opts, method='BDF')).run(
+        param_values=[up, down])
+    fd = (simres.observables[0].view(float).reshape(len(t), -1) -
+          simres.observables[1].view(float).reshape(len(t), -1)) / (2 * eps)
+    scale = np.abs(fd).max(axis=0) + 1e-12
+    assert np.allclose(sens / scale, fd / scale, atol=1e-3)
+
+
+def _sum_of_squares(name, data):
+    def loss(observables):
+        residuals = observables[name] - data
+        derivatives = np.zeros_like(observables)
+        derivatives[name] = 2 * residuals
+        return np.sum(residuals ** 2), derivatives
+    return loss
+
+
+@with_model
+def test_gradient():
+    """Adjoint gradients match those from forward sensitivities"""
+    Monomer('A')
+    Parameter('k', 0.5)
+    Parameter('A_0', 100)
+    Initial(A(), A_0)
+    Observable('A_total', A())
+    Rule('degrade', A() >> None, k)
+    t = np.linspace(0, 10, 11)
+    loss = _sum_of_squares('A_total', 90 * np.exp(-0.4 * t))
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options={'rtol': 1e-8},
+                            sensitivities=True)
+    simres = sim.run()
+    residuals = simres.observables['A_total'] - 90 * np.exp(-0.4 * t)
+    expected = np.dot(2 * residuals,
+                      simres.observable_sensitivities[:, 0, :])
+    for method in ('LSODA', 'BDF', 'RK45'):
+        sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                                integrator_options={'method': method,
+                                                    'rtol': 1e-8})
+        value, gradient = sim.gradient(loss)
+        assert np.isclose(value, np.sum(residuals ** 2), rtol=1e-5)
+        eq_(gradient.shape, (len(model.parameters),))
+        assert np.allclose(gradient, expected, rtol=1e-5)
+    # One loss and gradient per parameter set
+    values, gradients = sim.gradient(loss, param_values=[[0.5, 100, 1],
+                                                         [0.4, 90, 1]])
+    assert np.allclose(gradients[0], expected, rtol=1e-5)
+    assert np.allclose(values[1], 0, atol=1e-8)
+    assert np.allclose(gradients[1], 0, atol=1e-3)
+    assert_raises(SimulatorException, ScipyOdeSimulator(model, tspan=t)
+                  .gradient, loss)
+
+
+def test_gradient_earm():
+    """Adjoint gradients match those from forward sensitivities"""
+    model = earm_1_0.model
+    t = np.linspace(0, 20000, 21)
+    opts = {'method': 'BDF', 'rtol': 1e-8, 'atol': 1e-10}
+    params = ['kf1', 'kc9', 'L_0']
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options=opts, sensitivities=params)
+    simres = sim.run()
+    data = simres.observables['cSmac_total'] * 1.1
+    residuals = simres.observables['cSmac_total'] - data
+    index = model.observables.keys().index('cSmac_total')
+    expected = np.dot(2 * residuals,
+                      simres.observable_sensitivities[:, index, :])
+    sim = ScipyOdeSimulator(model, tspan=t, integrator='solve_ivp',
+                            integrator_options=opts)
+    gradient = sim.gradient(_sum_of_squares('cSmac_total', data))[1]
+    indices = [model.parameters.keys().index(p) for p in params]
+    assert np.allclose(gradient[indices], expected, rtol=1e-4)
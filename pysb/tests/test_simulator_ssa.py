@@ -0,0 +1,117 @@
+from pysb.testing import *
+import numpy as np
+from pysb import Monomer, Parameter, Initial, Observable, Rule
+from pysb.simulator import SsaSimulator, TauLeapingSimulator, \
+    ScipyOdeSimulator, SimulatorException
+from pysb.examples import expression_observables
+
+
+@with_model
+def test_dimerization_mean():
+    """Average of many realisations approaches the ODE solution"""
+    Monomer('A', ['a'])
+    Parameter('kf', 0.005)
+    Parameter('kdeg', 0.1)
+    Parameter('A_0', 100)
+    Initial(A(a=None), A_0)
+    Observable('A_free', A(a=None))
+    Observable('AA', A(a=1) % A(a=1))
+    Rule('dimerize', A(a=None) + A(a=None) >> A(a=1) % A(a=1), kf)
+    Rule('degrade', A(a=None) >> None, kdeg)
+    tspan = np.linspace(0, 10, 11)
+    result = SsaSimulator(model, tspan=tspan, seed=0).run(n_runs=1000)
+    eq_(result.nsims, 1000)
+    species = np.array(result.species)
+    eq_(species.shape, (1000, 11, len(model.species)))
+    # Copy numbers stay integral and are conserved by dimerization
+    ok_(np.all(species == np.round(species)))
+    # (AA counts both monomers of each dimer)
+    ok_(np.all(np.diff(result.observables[0]['A_free'] +
+                       result.observables[0]['AA']) <= 0))
+    ode = ScipyOdeSimulator(model, tspan=tspan).run()
+    mean = np.mean([obs['AA'] for obs in result.observables], axis=0)
+    ok_(np.allclose(mean, ode.observables['AA'], atol=1))
+
+
+@with_model
+def test_seed_and_batches():
+    Monomer('A')
+    Parameter('k', 1)
+    Parameter('A_0', 10)
+    Initial(A(), A_0)
+    Rule('degrade', A() >> None, k)
+    tspan = np.linspace(0, 5, 6)
+    run1 = SsaSimulator(model, tspan=tspan, seed=1).run(n_runs=3)
+    run2 = SsaSimulator(model, tspan=tspan, seed=1).run(n_runs=3)
+    ok_(np.array_equal(np.array(run1.species), np.array(run2.species)))
+    # Two parameter sets with two runs each; consecutive runs share a row
+    # (generating the network adds the __source_0 parameter)
+    result = SsaSimulator(model, tspan=tspan, seed=1).run(
+        param_values=[[0, 10, 1], [1, 20, 1]], n_runs=2)
+    eq_(result.nsims, 4)
+    ok_(np.all(result.species[0][:, 0] == 10))
+    ok_(np.all(result.species[1][:, 0] == 10))
+    eq_(result.species[2][0, 0], 20)
+    assert_raises(SimulatorException, SsaSimulator(model).run)
+
+
+def test_expression_observables():
+    model = expression_observables.model
+    result = SsaSimulator(model, tspan=np.linspace(0, 5, 6), seed=2).run(
+        n_runs=2)
+    eq_(len(result.expressions), 2)
+
+
+@with_model
+def test_tau_leaping_mean():
+    """Tau-leaping (and hybrid) simulations approach the ODE solution"""
+    Monomer('A', ['a'])
+    Parameter('kf', 5e-5)
+    Parameter('kdeg', 0.1)
+    Parameter('A_0', 10000)
+    Initial(A(a=None), A_0)
+    Observable('AA', A(a=1) % A(a=1))
+    Rule('dimerize', A(a=None) + A(a=None) >> A(a=1) % A(a=1), kf)
+    Rule('degrade', A(a=None) >> None, kdeg)
+    tspan = np.linspace(0, 10, 11)
+    ode = ScipyOdeSimulator(model, tspan=tspan).run()
+    for kwargs in ({}, {'hybrid_threshold': 100}):
+        result = TauLeapingSimulator(model, tspan=tspan, seed=0,
+                                     **kwargs).run(n_runs=100)
+        mean = np.mean([obs['AA'] for obs in result.observables], axis=0)
+        ok_(np.allclose(mean, ode.observables['AA'], rtol=0.02))
+
+
+@with_model
+def test_tau_leaping_low_copy():
+    """Critical reactions keep low copy numbers integral and non-negative"""
+    Monomer('A')
+    Monomer('B')
+    Parameter('k', 1)
+    Parameter('A_0', 5)
+    Parameter('B_0', 1000)
+    Initial(A(), A_0)
+    Initial(B(), B_0)
+    Rule('degrade', A() + B() >> B(), k)
+    result = TauLeapingSimulator(model, tspan=np.linspace(0, 0.1, 11),
+                                 seed=0).run(n_runs=50)
+    species = np.array(result.species)
+    ok_(np.all(species >= 0))
+    ok_(np.all(species == np.round(species)))
+    eq_(species[:, -1, 0].max(), 0)
+
+
+def test_selective_output():
+    model = expression_observables.model
+    tspan = np.linspace(0, 5, 6)
+    full = SsaSimulator(model, tspan=tspan, seed=3).run(n_runs=4)
+    result = SsaSimulator(model, tspan=tspan, seed=3).run(
+        n_runs=4, save=['NBD_signal'], keep_species=False)
+    eq_(result.nsims, 4)
+    eq_(result.observables[0].dtype.names, None)
+    # (these simulations fit in a single batch, so use the same random
+    # numbers)
+    for n in range(4):
+        ok_(np.array_equal(result.expressions[n]['NBD_signal'],
+                           full.expressions[n]['NBD_signal']))
+    assert_raises(ValueError, lambda: result.species)
@@ -1,6 +1,11 @@
 from pysb.core import Initial, Model, Monomer, Parameter, Rule
 from pysb.testing import with_model
-from pysb.util import alias_model_components, rules_using_parameter
+from pysb.util import alias_model_components, rules_using_parameter, \
+    read_trajectories
+from nose.tools import assert_raises
+import numpy as np
+import os
+import tempfile
 
 
 def test_alias_model_components():
@@ -42,3 +47,44 @@ def test_rules_using_parameter():
     # Get rules by supplying Parameter object directly
     components = rules_using_parameter(model, keff)
     assert R2 in components
+
+
+def test_read_trajectories():
+    """
+    Tests for read_trajectories() in pysb.util
+    """
+    data = np.column_stack([np.linspace(0, 10, 1001),
+                            np.random.RandomState(0).rand(1001, 2)])
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        # A KaSim .out file
+        np.savetxt(filename, data, header="time 'A' 'AB'", comments='# ')
+        for chunk_size in (2 ** 24, 100):
+            result = read_trajectories(filename, chunk_size=chunk_size)
+            assert result.dtype.names == ('time', 'A', 'AB')
+            assert result.shape == (1001, )
+            assert np.allclose(result.view(float).reshape(1001, 3), data)
+
+        # Chunks are passed to the callback instead of being kept
+        rows = np.empty((1001, 3))
+
+        def store(start, chunk):
+            rows[start:start + len(chunk)] = \
+                chunk.view(float).reshape(len(chunk), -1)
+        n_rows = read_trajectories(filename, callback=store, chunk_size=100)
+        assert n_rows == 1001
+        assert np.allclose(rows, data)
+
+        # A BioNetGen .gdat file, with the column names given
+        np.savetxt(filename, data, fmt='%19.12e',
+                   header='%18s%20s%20s' % ('time', 'A_total', 'AB_total'),
+                   comments='#')
+        result = read_trajectories(filename, names=['t', 'x', 'y'])
+        assert np.allclose(result['y'], data[:, 2])
+
+        with open(filename, 'a') as f:
+            f.write('1 2 x\n')
+        assert_raises(ValueError, read_trajectories, filename)
+    finally:
+        os.remove(filename)
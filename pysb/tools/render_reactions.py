@@ -78,14 +78,15 @@ def run(model):
     pysb.bng.generate_equations(model)
 
     graph = pygraphviz.AGraph(directed=True, rankdir="LR")
-    ic_species = [cp for cp, parameter in model.initial_conditions]
+    ic_species = set(cp.canonical_key() for cp, parameter in
+                     model.initial_conditions)
     for i, cp in enumerate(model.species):
         species_node = 's%d' % i
         slabel = re.sub(r'% ', r'%\\l', str(cp))
         slabel += '\\l'
         color = "#ccffcc"
         # color species with an initial condition differently
-        if len([s for s in ic_species if s.is_equivalent_to(cp)]):
+        if cp.canonical_key() in ic_species:
             color = "#aaffff"
         graph.add_node(species_node,
                        label=slabel,
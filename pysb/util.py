@@ -4,6 +4,10 @@ import pysb.core
 import inspect
 import numpy
 import io
+import os
+import errno
+import re
+import warnings
 
 __all__ = ['alias_model_components', 'rules_using_parameter']
 
@@ -29,6 +33,148 @@ def rules_using_parameter(model, parameter):
     return cset
 
 
+def get_cache_dir(subdir=None):
+    """
+    Return the directory used by PySB for cached files, creating it if needed.
+
+    The location is taken from the PYSB_CACHE_DIR environment variable if
+    that's set, or else defaults to ``.cache/pysb`` in the user's home
+    directory.
+
+    Parameters
+    ----------
+    subdir : string, optional
+        Name of a subdirectory of the cache directory to return instead.
+    """
+    cache_dir = os.environ.get('PYSB_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'),
+                                            '.cache', 'pysb'))
+    if subdir is not None:
+        cache_dir = os.path.join(cache_dir, subdir)
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        # ignore "already exists" errors, re-raise the rest
+        if e.errno != errno.EEXIST:
+            raise
+    return cache_dir
+
+
+# Number of bytes of a trajectory file parsed at a time
+_READ_CHUNK_SIZE = 2 ** 22
+
+
+def read_trajectories(filename, names=None, callback=None,
+                      chunk_size=_READ_CHUNK_SIZE):
+    """
+    Read a trajectory file written by KaSim (.out) or BioNetGen (.cdat, .gdat)
+
+    The file has a header line starting with ``#`` which names the columns,
+    followed by a row of numbers per time point, separated by whitespace (or
+    commas). The header is parsed once, then the rows are parsed a chunk at a
+    time with :func:`numpy.fromstring` into a preallocated record array,
+    which is much faster than :func:`numpy.loadtxt` and only needs memory for
+    the result and one chunk of text.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the trajectory file.
+    names : list of strings, optional
+        Names of the columns, instead of those in the header line.
+    callback : callable, optional
+        Function to pass each chunk to instead of keeping the rows, so files
+        larger than the available memory can be processed or written to an
+        on-disk store. It is called with the index of the first row of the
+        chunk and a record array with the chunk's rows.
+    chunk_size : int, optional
+        Approximate number of bytes of the file to parse at a time.
+
+    Returns
+    -------
+    numpy.ndarray
+        A record array with a field for each column (e.g. ``result['time']``)
+        and a row per time point, or the number of rows read if a callback is
+        given.
+    """
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        if not header.startswith(b'#'):
+            raise ValueError('%s does not start with a header line' %
+                             filename)
+        if names is None:
+            names = [name.strip('\'"') for name in
+                     re.split(r'[\s,]+', header[1:].decode().strip())]
+        dtype = numpy.dtype([(str(name), float) for name in names])
+        size = os.fstat(f.fileno()).st_size - len(header)
+        result = None
+        n_rows = 0
+        for block in _line_blocks(f, chunk_size):
+            chunk = _parse_rows(block, dtype, filename)
+            if callback is not None:
+                callback(n_rows, chunk)
+            elif result is None:
+                # Estimate the number of rows from the size of the first chunk
+                n_estimated = int(numpy.ceil(size * len(chunk) /
+                                             float(len(block))))
+                if n_estimated <= len(chunk):
+                    result = chunk
+                else:
+                    result = numpy.empty(n_estimated, dtype)
+                    result[:len(chunk)] = chunk
+            else:
+                if n_rows + len(chunk) > len(result):
+                    grown = numpy.empty(max(2 * len(result),
+                                            n_rows + len(chunk)), dtype)
+                    grown[:n_rows] = result[:n_rows]
+                    result = grown
+                result[n_rows:n_rows + len(chunk)] = chunk
+            n_rows += len(chunk)
+    if callback is not None:
+        return n_rows
+    if result is None:
+        return numpy.empty(0, dtype)
+    if len(result) > n_rows:
+        result.resize(n_rows, refcheck=False)
+    return result
+
+
+def _line_blocks(f, chunk_size):
+    """Read a file in blocks of about chunk_size bytes of complete lines"""
+    remainder = b''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            if remainder.strip():
+                yield remainder
+            return
+        data = remainder + data
+        end = data.rfind(b'\n') + 1
+        remainder = data[end:]
+        if end:
+            yield data[:end]
+
+
+def _parse_rows(block, dtype, filename):
+    """Parse a block of lines of numbers into a record array"""
+    if b',' in block:
+        block = block.replace(b',', b' ')
+    with warnings.catch_warnings():
+        # numpy warns (or raises, in later versions) if it stops parsing
+        # before the end of the text
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = numpy.fromstring(block, sep=' ')
+        except (DeprecationWarning, ValueError):
+            raise ValueError('%s contains a value which is not a number' %
+                             filename)
+    n_columns = len(dtype.names)
+    if len(values) % n_columns:
+        raise ValueError('%s has rows without %d values' % (filename,
+                                                             n_columns))
+    return values.view(dtype)
+
+
 def synthetic_data(model, tspan, obs_list=None, sigma=0.1):
     #from pysb.integrate import odesolve
     from pysb.integrate import Solver